@@ -186,6 +186,27 @@ SEGMENT_SIZE = config('SEGMENT_SIZE', default=10, cast=int)
 DATA_VERSION = config('DATA_VERSION', default='testing')
 PGD_VERSION = config('PGD_VERSION', default='1.0.2')
 
+# Directory for the filtered PDB files handed to DSSP while importing.  A
+# tmpfs mount keeps this off the disk.  Defaults to the system temp directory.
+PDB_TMP_DIR = config('PDB_TMP_DIR', default=None)
+
+# Directory for cached DSSP results, see pgd_splicer/dssp_cache.py.  Caching
+# is disabled when this is not set.
+DSSP_CACHE_DIR = config('DSSP_CACHE_DIR', default=None)
+
+# Directory for parsed proteins, see pgd_splicer/parse_cache.py.  Caching is
+# disabled when this is not set.
+PARSE_CACHE_DIR = config('PARSE_CACHE_DIR', default=None)
+
+# Read atoms with the native parser instead of Bio.PDB, see
+# pgd_splicer/atom_records.py.  Bio.PDB is still used to run DSSP.
+NATIVE_ATOM_PARSER = config('NATIVE_ATOM_PARSER', default=False, cast=bool)
+
+# Create residue, sidechain and window tables with 4 byte floats and single
+# byte aa/ss codes, see pgd_core/fields.py.  MySQL only.  Existing tables are
+# converted with the compact_schema management command.
+COMPACT_SCHEMA = config('COMPACT_SCHEMA', default=False, cast=bool)
+
 # Django registration
 ACCOUNT_ACTIVATION_DAYS = config('ACCOUNT_ACTIVATION_DAYS', default=5, cast=int)
 
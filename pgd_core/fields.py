@@ -0,0 +1,46 @@
+"""
+Field types for the compact schema option.
+
+With the COMPACT_SCHEMA setting enabled, the measurement columns of residues,
+sidechains and search windows use 4 byte floats instead of double precision
+and the aa/ss codes are single byte ascii columns.  A 4 byte float keeps 7
+significant digits, more than the 1 to 3 decimals the geometry is reported
+with (see pgd_splicer/dump_protein.py).  Only MySQL is changed, the other
+databases keep their default column types.
+
+The types are decided when the tables are created.  Existing tables are
+altered with the compact_schema management command.
+"""
+
+from django.conf import settings
+from django.db import models
+
+
+def compact(connection):
+    return settings.COMPACT_SCHEMA and connection.vendor == 'mysql'
+
+
+class CompactFloatField(models.FloatField):
+    """
+    FloatField stored as a 4 byte float in the compact schema
+    """
+    def db_type(self, connection):
+        if compact(connection):
+            return 'float'
+        return super(CompactFloatField, self).db_type(connection)
+
+
+class CodeField(models.CharField):
+    """
+    Single character code, e.g. aa or ss, stored as a single byte in the
+    compact schema.  The codes are ascii letters, so they do not need the
+    multi byte character set of the database.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs['max_length'] = 1
+        super(CodeField, self).__init__(*args, **kwargs)
+
+    def db_type(self, connection):
+        if compact(connection):
+            return 'char(1) CHARACTER SET ascii'
+        return super(CodeField, self).db_type(connection)
@@ -5,8 +5,11 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from django.db import connection, models
 from django.test import TestCase
 
+from pgd_core.models import Residue
+
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -14,3 +17,23 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class CompactSchema(TestCase):
+
+    class MySQL(object):
+        vendor = 'mysql'
+
+    def test_db_type(self):
+        phi = Residue._meta.get_field('phi')
+        aa = Residue._meta.get_field('aa')
+        with self.settings(COMPACT_SCHEMA=True):
+            self.assertEqual(phi.db_type(self.MySQL()), 'float')
+            self.assertEqual(aa.db_type(self.MySQL()),
+                             'char(1) CHARACTER SET ascii')
+            # other databases keep their types
+            self.assertEqual(phi.db_type(connection),
+                             models.FloatField().db_type(connection))
+        with self.settings(COMPACT_SCHEMA=False):
+            self.assertEqual(aa.db_type(connection),
+                             models.CharField(max_length=1).db_type(connection))
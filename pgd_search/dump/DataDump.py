@@ -127,15 +127,7 @@ class BufferThread(Thread):
             first = True
 
             for offset, string in self.parent.iValues:
-                residue = segment
-                if offset < 0:
-                    while offset != 0:
-                        residue = residue.prev
-                        offset += 1
-                elif offset > 0:
-                    while offset != 0:
-                        residue = residue.next
-                        offset -= 1
+                residue = segment.segment[offset]
                 parts = [
                     str(self.parent.count) if first else ' ',
                     segment.protein_id,
@@ -147,7 +139,7 @@ class BufferThread(Thread):
                 for field in FIELDS:
                     # replace field with display value if needed
                     if field in FIELD_VALUE_REPLACEMENTS:
-                        code = residue.__dict__[field]
+                        code = getattr(residue, field)
                         if code:
                             for k,v in FIELD_VALUE_REPLACEMENTS[field]:
                                 if k == code:
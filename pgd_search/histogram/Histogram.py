@@ -128,15 +128,7 @@ class HistogramPlot():
                 self.maxCount = bin['count']
     
     def create_ref_string(self, index, property):
-        if index == 0:
-            prefix = ''
-        elif index < 0:
-            prefix = ''.join(['prev__' for i in range(index, 0)])
-        else:
-            prefix = ''.join(['next__' for i in range(index)])
-        resString = '%s%s' % (prefix, property)
-        
-        return resString
+        return window_field(index, property)
     
     def HistoPlot(self):
         
@@ -1,5 +1,5 @@
 from exceptions import AttributeError
-from math import ceil
+from math import ceil, floor
 import re
 import cPickle
 
@@ -9,15 +9,28 @@ from django.db import models
 from django.db.models import Q
 from django.contrib.auth.models import User
 
-from pgd_core.models import Protein,Residue
-from pgd_constants import AA_CHOICES, AA_CHOICES_DICT, SS_CHOICES
+from pgd_core.models import (Protein, Residue, Sidechain, sidechain_lookup,
+                             sidechain_view)
+from pgd_constants import (AA_CHOICES, AA_CHOICES_DICT, SS_CHOICES,
+                           PLOT_PROPERTY_CHOICES)
 from pgd_splicer.sidechain import bond_lengths_string_dict, bond_angles_string_dict
 from pgd_core import residue_indexes
+from pgd_core.fields import CodeField, CompactFloatField
 
 
 range_re = re.compile("(?<=[^-<>=])-")
 comp_re  = re.compile("^([<>]=?)?")
 
+# residue fields searched with query strings
+SEARCH_FIELDS = (
+    'a1',   'a2',   'a3',   'a4',   'a5',   'a6',   'a7',
+    'L1',   'L2',   'L3',   'L4',   'L5',
+    'phi',  'psi',  'ome',  'chi1', 'chi2', 'chi3', 'chi4', 'chi5',
+    'bm',   'bs',   'bg',
+    'h_bond_energy',
+    'zeta',
+)
+
 
 class RDict(dict):
     """ Helper class for accessing a dict's properties as if they were member
@@ -98,11 +111,11 @@ class Search(models.Model):
         # for now parse query every time.  otherwise the query results will be stored in the session
         return self.parse_search()
 
-    # Return the segments matched by the search.
+    # Return the windows matched by the search.
     def parse_search(self):
 
-        # Start with all segments...
-        query = Residue.objects.all()
+        # Start with all windows...
+        query = ResidueWindow.objects.all()
         data = self.data
         if not data:
             # if no params return everything
@@ -115,38 +128,39 @@ class Search(models.Model):
             data.proteins = data.proteins.replace(' ','').replace(',', '')
             codes = [data.proteins[i:i+4] for i in range(0, len(data.proteins), 4)]
             if data.proteins_i:
-                query = query.filter(protein__code__in=codes)
+                query = query.filter(protein__in=codes)
             else:
-                query = query.exclude(protein__code__in=codes)
+                query = query.exclude(protein__in=codes)
 
-        # ...filter by code lists...
+        # ...filter by resolution, these are copied into the window so no
+        # join with the protein is needed...
         if data.resolutionMin != None:
-            query = query.filter(protein__resolution__gte=data.resolutionMin)
+            query = query.filter(resolution__gte=data.resolutionMin)
 
         # ...filter by resolution...
         if data.resolutionMax != None:
-            query = query.filter(protein__resolution__lte=data.resolutionMax)
+            query = query.filter(resolution__lte=data.resolutionMax)
 
         # ...filter by rfactor...
         if data.rfactorMin != None:
-            query = query.filter(protein__rfactor__gte=data.rfactorMin)
+            query = query.filter(rfactor__gte=data.rfactorMin)
 
         # ...filter by rfactor...
         if data.rfactorMax != None:
-            query = query.filter(protein__rfactor__lte=data.rfactorMax)
+            query = query.filter(rfactor__lte=data.rfactorMax)
 
         #...filter by rfree...
         if data.rfreeMin != None:
-            query = query.filter(protein__rfree__gte=data.rfreeMin)
+            query = query.filter(rfree__gte=data.rfreeMin)
 
         # ...filter by rfree...
         if data.rfreeMax != None:
-            query = query.filter(protein__rfree__lte=data.rfreeMax)
+            query = query.filter(rfree__lte=data.rfreeMax)
 
 
         # ...filter by threshold...
         if data.threshold != None:
-            query = query.filter(protein__threshold__lte=data.threshold)
+            query = query.filter(threshold__lte=data.threshold)
 
         # ...filter by query strings (for values and value ranges)...
         def compare(x,y):
@@ -163,27 +177,12 @@ class Search(models.Model):
             search_res = Segmenter(data, index)
 
             # get field prefix for this residue
-            if index == 0:
-                seg_prefix = ''
-            elif index < 0:
-                seg_prefix = ''.join(['prev__' for i in range(index, 0)])
-            else:
-                seg_prefix = ''.join(['next__' for i in range(index)])
+            seg_prefix = window_prefix(index)
 
             # add isnull to ensure segment length is correct.  segments missing
             # a residue would be too short
-            if seg_prefix != '':
-                query = query.filter(**{'%sisnull' % seg_prefix:False})
-
-            # get possible sidechain fields based on selected AA types
-            sidechain_fields = []
-            """for aa_type in filter(lambda x: x[1],search_res.aa.items()):
-                aa_type_upper = aa_type[0].upper()
-                for field in bond_lengths_string_dict[aa_type_upper]:
-                    sidechain_fields.append('sidechain_%s__%s' % (aa_type_upper, field))
-                for field in bond_angles_string_dict[aa_type_upper]:
-                    sidechain_fields.append('sidechain_%s__%s' % (aa_type_upper, field))
-            """
+            if index != 0:
+                query = query.filter(**{'r%i__isnull' % (iIndex + index):False})
 
             # ...handle boolean values...
             #   (Filter on each binary field that is not set to NULL/None.)
@@ -219,46 +218,99 @@ class Search(models.Model):
             fields = filter(
                 # use only the fields with a '_include' value.
                 lambda x: search_res.__getitem__(x+'_i') != None,
-                (
-                    'a1',   'a2',   'a3',   'a4',   'a5',   'a6',   'a7',
-                    'L1',   'L2',   'L3',   'L4',   'L5',
-                    'phi',  'psi',  'ome',  'chi1', 'chi2', 'chi3', 'chi4', 'chi5',
-                    'bm',   'bs',   'bg',
-                    'h_bond_energy',
-                    'zeta',
-                )
+                SEARCH_FIELDS
             )
-            query = self.filter_fields(fields, query, search_res, seg_prefix)
+            query = self.filter_fields(fields, query, search_res,
+                                       lambda field: seg_prefix + field)
 
             # ... handle sidechain query strings ...
-            sidechain_fields = []
-            if search_res.aa:
-                for aa_type in [AA_CHOICES_DICT[aa].upper() for aa in search_res.aa]:
-                    if aa_type in bond_lengths_string_dict:
-                        field_base = '%s__%%s' % aa_type
-                        for field in bond_lengths_string_dict[aa_type]:
-                            key = field_base % field
-                            if search_res[key]:
-                                sidechain_fields.append(key)
-
-                        for field in bond_angles_string_dict[aa_type]:
-                            key = field_base % field
-                            if search_res[key]:
-                                sidechain_fields.append(key)
-
-            seg_prefix = '%ssidechain_' % seg_prefix
-            query = self.filter_fields(sidechain_fields, query, search_res, seg_prefix)
+            query = self.filter_fields(self.sidechain_fields(search_res),
+                query, search_res,
+                lambda field: window_field(index, 'sidechain_%s' % field))
 
         return query
 
-    def filter_fields(self, fields, query, search_res, seg_prefix):
+    def sidechain_fields(self, search_res):
+        """
+        returns the sidechain fields searched for a residue, e.g. ARG__CB_CG.
+        Only the sidechains of the selected aa types are searched.
+        """
+        sidechain_fields = []
+        if search_res.aa:
+            for aa_type in [AA_CHOICES_DICT[aa].upper() for aa in search_res.aa]:
+                if aa_type in bond_lengths_string_dict:
+                    field_base = '%s__%%s' % aa_type
+                    for field in bond_lengths_string_dict[aa_type]:
+                        key = field_base % field
+                        if search_res[key]:
+                            sidechain_fields.append(key)
+
+                    for field in bond_angles_string_dict[aa_type]:
+                        key = field_base % field
+                        if search_res[key]:
+                            sidechain_fields.append(key)
+        return sidechain_fields
+
+    def cube_lookups(self):
+        """
+        Returns a Q object selecting the PlotCube cells of the windows this
+        search matches, or None if the search filters on anything the cube
+        does not record.  Searches the cube expresses filter only on the aa
+        and ss of residue i, the segment length, the threshold and maximums
+        of the quality values that fall on a tier boundary.
+        """
+        data = self.data
+        if not data:
+            return Q()
+        data = RDict(data)
+
+        if data.proteins_i != None:
+            return None
+
+        lookups = Q()
+        for field, boundaries in CUBE_TIERS.items():
+            # every value is at least 0
+            if data['%sMin' % field]:
+                return None
+            maximum = data['%sMax' % field]
+            if maximum != None:
+                if maximum not in boundaries:
+                    return None
+                lookups &= Q(**{'%s_tier__lte' % field:
+                                boundaries.index(maximum)})
+
+        if data.threshold != None:
+            lookups &= Q(threshold__lte=data.threshold)
+
+        # windows end at the first missing neighbour, so every residue of a
+        # segment is present when its length fits in the window
+        lookups &= Q(segment__gte=int(data.residues))
+        for index in residue_indexes(int(data.residues)):
+            search_res = Segmenter(data, index)
+            for field in ('aa', 'ss'):
+                include = search_res[field + '_i']
+                if include == None:
+                    continue
+                if index != 0:
+                    return None
+                values = Q(**{'%s__in' % field: search_res[field]})
+                lookups &= values if include else ~values
+            if [field for field in SEARCH_FIELDS
+                    if search_res[field + '_i'] != None] \
+                    or self.sidechain_fields(search_res):
+                return None
+
+        return lookups
+
+    def filter_fields(self, fields, query, search_res, lookup):
         """
-        Filters the fields passed in
+        Filters the fields passed in.  lookup translates the name of a field
+        to its lookup for the residue searched
         """
 
         for field in fields:
             # seg_field is the name of the property of the given residue in the database
-            seg_field = seg_prefix+field
+            seg_field = lookup(field)
 
             constraints = []
 
@@ -338,219 +390,300 @@ class Search_code(models.Model):
     code    = models.CharField(max_length=4)
 
 
-class ResidueProxy():
-    """
-    This is a proxy to properties stored in the segment.  It is used
-    to emulate having a Residue but really just returns properties
-    that are stored in the segment object.  This is used because
-    it is faster than fetching the Residue from the database
+""" ====================================================================
+Residue Windows
+
+Searches match a window of residues around residue i.  Following prev/next
+links from Residue joins the residue table once per offset, so the splicer
+stores a window per residue instead: a row holding the fields of residue i
+and of each residue within SEGMENT_SIZE of it, flattened into columns named
+after their position in the window.  With the default SEGMENT_SIZE of 10,
+position 4 is residue i, r3_phi is the phi of i-1 and r5_phi that of i+1.
+Positions past the end of the chain, or across a chain break, are NULL.
+
+Windows are rebuilt for a protein whenever it is imported, see
+pgd_splicer/windows.py.  The sidechain of a position is referenced by the
+r<position>_sidechain foreign key.  Fields that are not copied into the
+window are reached through the residue foreign key of a position.
+
+The dihedral angles in CIRCULAR_FIELDS are stored with their sin and cos,
+so circular statistics are sums over the window table.
+
+The quality values of the protein (QUALITY_FIELDS) are copied into every
+window too.  Searches filter on them without joining the protein table, and
+composite indexes pair them with the aa and ss of residue i.
+
+The model consists of 2 parts:
+   1) an abstract base class that contains the fields of the window as a
+      whole and function definitions
+   2) a dynamically created child class that contains the fields of every
+      position.  This works by defining a dictionary of fields and passing
+      it to the type() function which creates a class bound to the
+      namespace of this file
 
-    This class is used in conjunction with ResidueProxy_subscripter
-    """
-    def __init__(self, index, parent):
-        self.parent = parent
-        self.string = 'r%i_%%s' % index
+==================================================================== """
 
-    def __getitem__(self, i):
-        return self.parent.__dict__[self.string % i]
+# position of residue i in a window
+iIndex = int(ceil(settings.SEGMENT_SIZE/2.0)-1)
 
+# residue fields copied into a window for every position
+WINDOW_FIELDS = (
+    'oldID', 'chainIndex', 'aa', 'ss',
+    'a1', 'a2', 'a3', 'a4', 'a5', 'a6', 'a7',
+    'L1', 'L2', 'L3', 'L4', 'L5',
+    'phi', 'psi', 'ome', 'omep', 'chi1', 'chi2', 'chi3', 'chi4', 'chi5',
+    'bm', 'bs', 'bg', 'h_bond_energy', 'zeta',
+)
 
-class ResidueProxy_subscripter():
-    """
-    ResidueProxy_subscripter
+# protein fields copied into every window
+QUALITY_FIELDS = ('threshold', 'resolution', 'rfactor', 'rfree')
 
-    This class emulates a list of residues.  It returns ResidueProxy
-    objects that emulate a real residue object.
+# dihedral angles stored with the sin and cos of the angle for every
+# position, e.g. r4_phi_sin and r4_phi_cos.  Circular statistics sum these,
+# see pgd_search/statistics/aggregates.py
+CIRCULAR_FIELDS = ('phi', 'psi', 'ome', 'omep', 'zeta',
+                   'chi1', 'chi2', 'chi3', 'chi4', 'chi5')
+
+# dihedral angles of residue i stored with their bin on the standard plot
+# grids, e.g. r4_phi_bin10.  Bins are numbered from -180 and 180 falls in the
+# last bin, so plots over -180 to 180 can group on them, see ConfDistPlot
+BIN_FIELDS = ('phi', 'psi', 'ome', 'chi1', 'chi2', 'chi3', 'chi4', 'chi5')
+BIN_SIZES = (1, 5, 10)
+
+
+def bin_field(field, size):
     """
+    returns the window field of the bin of an angle of residue i
+    """
+    return 'r%i_%s_bin%i' % (iIndex, field, size)
 
-    def __init__(self, key, parent):
-        self.parent = parent
-        #add this instance to the parent. doing this here
-        #makes defining subscriptor instance simpler because
-        #you only need to specify the key once
-        parent.__dict__[key] = self
 
-        # create a list of proxy objects for the residues in this segment
-        self.proxies = []
-        l_append = self.proxies.append
-        for i in range(settings.SEGMENT_SIZE):
-            l_append(ResidueProxy(i, parent))
+def angle_bin(angle, size):
+    """
+    returns the bin of an angle stored in its bin_field
+    """
+    return min(int(floor((angle + 180) / size)), 360 / size - 1)
+
 
-    def __getitem__(self, i):
-        try: # Get the object, if it's been instantiated...
-            return self.proxies[i]
+def bin_indexes():
+    """
+    returns the indexes of Ramachandran plots of an aa or ss group, which
+    group on the phi/psi bins of residue i
+    """
+    return [('r%i_%s' % (iIndex, code), bin_field('phi', size),
+             bin_field('psi', size))
+            for code in ('aa', 'ss') for size in BIN_SIZES]
 
-        except TypeError: # it wasn't an int, it must be a slice
-            #return the range of segments specified.  retrieve items through __getitem__()
-            #so items are initialized if needed.
-            return self.proxies[i.start:i.stop:i.step if i.step else 1]
+BIN_INDEXES = bin_indexes()
 
 
-class Residue_subscripter():
+def window_prefix(index):
     """
-    This is a lazy loading list of residues that a segment contains
-    When residues are requested the id's are fetched from the parent
-    segment and used to lookup the residue.  Residues are cached so
-    repeat lookups do not require database interaction
+    returns the prefix of the window fields of the residue at offset index
+    from residue i, e.g. r3_ for i-1
+    """
+    return 'r%i_' % (iIndex + index)
+
 
-    additionally this class also allows iteration of residues
+def residue_prefix(index):
+    """
+    returns the prefix for lookups that follow the residue at offset index
+    from residue i, e.g. r3__terminal_flag for i-1
     """
+    return 'r%i__' % (iIndex + index)
 
-    def __init__(self, key, parent):
-        self.parent = parent
-        #add this instance to the parent. doing this here
-        #makes defining subscriptor instance simpler because
-        #you only need to specify the key once
-        parent.__dict__[key] = self
+
+def window_field(index, field):
+    """
+    returns the lookup for a field of the residue at offset index from
+    residue i.  Fields copied into the window are read from the window and
+    sidechain fields, e.g. sidechain_ARG__CB_CG, from the sidechain of the
+    position.  Anything else is read through the residue.
+    """
+    if field in WINDOW_FIELDS:
+        return window_prefix(index) + field
+    if field.startswith('sidechain_'):
+        return window_prefix(index) + sidechain_lookup(field)
+    return residue_prefix(index) + field
 
 
-    def __getitem__(self, i):
-        """
-        called when an index is requested (ie. residues[1])
-        """
-        try: # Get the object, if it's been instantiated...
-            return self.parent.__dict__['r%i' % i]
-            #return self.foo[i]
-
-        except KeyError: # ...otherwise, instantiate it.
-            pass
-            # If the object can be instantiated, return it
-            if self.parent.__dict__['r%i_id' % i]:
-                self.parent.__dict__['r%i' % i] = Residue.objects.filter(id=self.parent.__dict__['r%i_id' % i])[0]
-                return self.parent.__dict__['r%i' % i]
-
-            # otherwise return None.  These objects are proxies to underlying properties
-            # so they must always return a values or None
-            else:
+class WindowResidue(object):
+    """
+    A single position of a window.  This emulates having a Residue: window
+    fields are read from the window, any other attribute from the Residue
+    itself, which requires fetching it.
+    """
+    def __init__(self, window, position):
+        self.window = window
+        self.position = position
+
+    def __getattr__(self, name):
+        if name in WINDOW_FIELDS:
+            return getattr(self.window, 'r%i_%s' % (self.position, name))
+        if name.startswith('sidechain_'):
+            aa = name[10:]
+            if AA_CHOICES_DICT[self.aa].upper() != aa:
                 return None
+            return sidechain_view(
+                getattr(self.window, 'r%i_sidechain' % self.position), aa)
+        return getattr(getattr(self.window, 'r%i' % self.position), name)
 
-        except TypeError: # it wasn't an int, it must be a slice
-            #return the range of segments specified.  retrieve items through __getitem__()
-            #so items are initialized if needed.
-            return self.foo[i.start:i.stop:i.step if i.step else 1]
 
+class WindowSegment(object):
+    """
+    The residues of a window indexed by their offset from residue i.  None
+    is returned for offsets that are not part of the window.
+    """
+    def __init__(self, window):
+        self.window = window
 
-    def __setitem__(self, i, v):
-        """
-        called when an index is set (ie. residues[1]=foo)
-        """
+    def __getitem__(self, index):
+        position = iIndex + index
+        if not 0 <= position < settings.SEGMENT_SIZE or \
+                getattr(self.window, 'r%i_id' % position) is None:
+            return None
+        return WindowResidue(self.window, position)
 
-        #populate dict and set the FK
-        if v:
-            self.parent.__dict__['r%i' % i] = v
-            self.parent.__dict__['r%i_id' % i] = v.id
 
-        #v is None, clear the object from the dict and clear the FK (if not already None)
-        elif self.parent.__dict__.has_key('r%i' % i):
-            del self.parent.__dict__['r%i' % i]
-            self.parent.__dict__['r%i_id' % i] = None
+class ResidueWindow_abstract(models.Model):
+    """
+    The id of a window is the id of residue i
+    """
+    protein = models.ForeignKey(Protein, related_name='windows')
+    chainID = models.CharField(max_length=1)
 
-    def __iter__(self):
-        # This function makes a generator object
-        def residue_generator(outer):
-            for i in range(settings.SEGMENT_SIZE):
-                try: # Get the next object...
-                    yield outer.__getitem__(i)
-                except IndexError: # ...until there are no more.
-                    raise StopIteration
-        return residue_generator(self)
+    # copies of the protein's values, see QUALITY_FIELDS
+    threshold  = models.IntegerField()
+    resolution = models.FloatField()
+    rfactor    = models.FloatField()
+    rfree      = models.FloatField()
 
+    @property
+    def segment(self):
+        return WindowSegment(self)
 
-class SegmentedProtein(models.Model):
-    """
-    Parallel to the Protein model to add fields specific to the segmentation
-    of the protein chain into segment objects
+    class Meta:
+        abstract = True
+        index_together = [
+            ('r%i_aa' % iIndex, 'r%i_ss' % iIndex, 'resolution'),
+            ('r%i_ss' % iIndex, 'resolution'),
+            ('resolution', 'rfactor', 'rfree', 'threshold'),
+        ] + BIN_INDEXES
 
-    This class is not an extension of the Protein model because it is intended
-    to have limited use.  Linking this to the Protein object creates issues
-    creating and querying (extra joins) Protein and SegmentedProtein objects
-    """
-    code = models.CharField(max_length=4, primary_key=True, unique=True)
 
-    # Date of the pdb the segments were generated from.  This is different from
-    # Protein.pdb_date.  It serves the same purpose of indicating if a Segment
-    # is up to date.  The difference is that this tracks updates for the
-    # Segment table.  The import process has separate transactions for the core
-    # protein and segments.  Its possible for the two to get out of sync if an
-    # import fails while proteins are being processed.
-    pdb_date = models.DateTimeField()
+# Build a dict for the fields of every position.  Windows are rebuilt along
+# with the residues they reference, so there is no need for the database to
+# enforce or cascade the references.
+window_dict = {'__module__' : 'pgd_search.models'}
+for i in range(settings.SEGMENT_SIZE):
+    window_dict["r%i" % i]            = models.ForeignKey(Residue, null=True,
+                                            related_name='window_r%i+' % i,
+                                            on_delete=models.DO_NOTHING,
+                                            db_constraint=False)
+    window_dict["r%i_sidechain" % i]  = models.ForeignKey(Sidechain, null=True,
+                                            related_name='window_r%i+' % i,
+                                            on_delete=models.DO_NOTHING,
+                                            db_constraint=False)
+    window_dict["r%i_oldID" % i]      = models.CharField(max_length=5, null=True)
+    window_dict["r%i_chainIndex" % i] = models.PositiveIntegerField(null=True)
+    window_dict["r%i_aa" % i]         = CodeField(choices=AA_CHOICES, null=True)
+    window_dict["r%i_ss" % i]         = CodeField(choices=SS_CHOICES, null=True)
+    for field in WINDOW_FIELDS[4:]:
+        window_dict["r%i_%s" % (i, field)] = CompactFloatField(null=True)
+    for field in CIRCULAR_FIELDS:
+        window_dict["r%i_%s_sin" % (i, field)] = CompactFloatField(null=True)
+        window_dict["r%i_%s_cos" % (i, field)] = CompactFloatField(null=True)
+
+for field in BIN_FIELDS:
+    for size in BIN_SIZES:
+        window_dict[bin_field(field, size)] = models.SmallIntegerField(null=True)
+
+# Create the ResidueWindow model class with the fields from the dict
+ResidueWindow = type('ResidueWindow', (ResidueWindow_abstract,), window_dict)
 
 
 """ ====================================================================
-Segment Model
+Plot Cube
+
+Most plots are the default phi/psi plot of a search that filters only on
+the aa and ss of residue i and the standard quality cutoffs.  The splicer
+sums the windows of the current data version into cells indexed by
+
+    aa, ss        - of residue i
+    threshold     - of the protein
+    tiers         - of resolution, rfactor and rfree, see CUBE_TIERS
+    segment       - the longest segment around residue i in the window,
+                    a search of n residues matches the windows with a
+                    segment of at least n
+    phi/psi bins  - of residue i, CUBE_BIN_SIZE degree bins from -180
+
+Each cell holds the number of windows and, for every field of residue i
+in CUBE_FIELDS, the number of values and the sum and sum of squares of the
+values, or the sums of their sin and cos for dihedral angles.  Plots of
+searches the cube expresses, see Search.cube_lookups, sum cells instead of
+counting windows, see ConfDistPlot.  The cube is built by
+pgd_splicer/cube.py whenever windows are rebuilt.
+==================================================================== """
 
-This model consists of 2 parts:
-   1) an abstract base class that contains all of the normal properties
-       and function definitions
-   2) a dynamically created child class that contains a set of fields
-      that dynamically resize depending on maximum possible segment
-      length.  This works by defining a dictionary of fields and
-      passing it to the type() function which creates a class bound
-      to the namespace of this file
+# tier boundaries of the quality values of the cube.  The tier of a value
+# is the number of boundaries below it, so a value is at most the kth
+# boundary exactly when its tier is at most k.  Search maximums must be one
+# of the boundaries to be answered from the cube.
+CUBE_TIERS = {
+    'resolution': (1.0, 1.2, 1.5, 1.8, 2.0, 2.5, 3.0),
+    'rfactor':    (0.2, 0.25, 0.3),
+    'rfree':      (0.25, 0.3, 0.35),
+}
 
-This allows the segment model to change size dynamically at runtime.
+# residue i fields summed in the cube, the fields that can be plotted
+CUBE_FIELDS = tuple(field for field, label in PLOT_PROPERTY_CHOICES)
 
-==================================================================== """
-#this pattern matches any property that is proxied to a residue
-proxyPattern = re.compile('^r([\d]+)_(?!id$)([\w]+)')
+CUBE_BIN_SIZE = 10
 
 
-iIndex = int(ceil(settings.SEGMENT_SIZE/2.0)-1)
-class Segment_abstract(models.Model):
+def cube_tier(field, value):
+    """
+    returns the tier of a quality value, see CUBE_TIERS
+    """
+    return len([boundary for boundary in CUBE_TIERS[field] if boundary < value])
 
-    protein = models.ForeignKey(Protein)
-    chainID = models.CharField(max_length=1)
-    length  = models.PositiveIntegerField()
-
-    def __init__(self, *args, **kwargs):
-        super(Segment_abstract, self).__init__(*args, **kwargs)
-        Residue_subscripter('residues', self)
-        ResidueProxy_subscripter('residueProxies', self)
-
-    def __getattribute__(self,name):
-        if name == 'offset':
-            return 0-self.__dict__['r%i_chainIndex' % iIndex]
-
-        #check for properties proxied to a residue object
-        match = proxyPattern.match(name)
-        if match:
-            index = int(match.group(1))
-            attr  = match.group(2)
-            residue = object.__getattribute__(self, 'residues')[index]
-            if residue:
-                return residue.__dict__[attr]
-
-            #return none if residue is none (transitive)
-            return None
 
-        # not a proxied attribute
-        else:
-            return object.__getattribute__(self, name)
+class PlotCube_abstract(models.Model):
+    """
+    A cell of the plot cube
+    """
+    version         = models.CharField(max_length=100)
+    aa              = CodeField(choices=AA_CHOICES, null=True)
+    ss              = CodeField(choices=SS_CHOICES, null=True)
+    threshold       = models.IntegerField()
+    resolution_tier = models.SmallIntegerField()
+    rfactor_tier    = models.SmallIntegerField()
+    rfree_tier      = models.SmallIntegerField()
+    segment         = models.SmallIntegerField()
+    phi_bin         = models.SmallIntegerField()
+    psi_bin         = models.SmallIntegerField()
+    observations    = models.IntegerField()
 
     class Meta:
         abstract = True
+        index_together = [
+            ('version', 'aa', 'ss'),
+            ('version', 'ss'),
+        ]
 
-# Build a dict for the fields of variable number
-seq_dict = {'__module__' : 'pgd_search.models'}
-for i in range(settings.SEGMENT_SIZE):
 
-    seq_dict["r%i_id" % i]              = models.PositiveIntegerField(null=True)
-    seq_dict["r%i_oldID" % i]           = models.CharField(max_length=5, null=True)
-    seq_dict["r%i_chainIndex" % i]      = models.PositiveIntegerField(null=True)
-    seq_dict["r%i_ss" % i]              = models.CharField(max_length=1, choices=SS_CHOICES, null=True)
-    seq_dict["r%i_aa" % i]              = models.CharField(max_length=1, choices=AA_CHOICES, null=True)
-    seq_dict["r%i_xpr" % i]             = models.NullBooleanField(null=True) # probably should be replaced
-
-    # the loops here are just to save on space/typing
-    for j in range(1,8):
-        seq_dict["r%i_a%i" % (i,j)] = models.FloatField(null=True)
-    for j in range(1,6):
-        seq_dict["r%i_L%i" % (i,j)] = models.FloatField(null=True)
-    for j in ("phi", "psi", "ome", "chi", "bm", "bs", "bg", "h_bond_energy", "zeta"):
-        seq_dict["r%i_%s" % (i,j)] = models.FloatField(null=True)
-
-# Create the Segment model class with the fields from the dict
-Segment = type('Segment', (Segment_abstract,), seq_dict)
+cube_dict = {'__module__' : 'pgd_search.models'}
+for field in CUBE_FIELDS:
+    cube_dict['%s_count' % field] = models.IntegerField()
+    if field in CIRCULAR_FIELDS:
+        measures = ('sin', 'cos')
+    else:
+        measures = ('sum', 'sumsq')
+    for measure in measures:
+        cube_dict['%s_%s' % (field, measure)] = models.FloatField(null=True)
+
+PlotCube = type('PlotCube', (PlotCube_abstract,), cube_dict)
+
 
 class saveSearchForm(forms.Form):
     title       = forms.CharField(label='Title')
@@ -9,12 +9,13 @@
 from django.db import connections
 from django.db.backends.mysql.compiler import SQLCompiler
 
-from django.db.models import Count, Avg, StdDev
+from django.db.models import Count, Avg, StdDev, Sum
 
 from pgd_constants import *
 from pgd_core.models import *
 from pgd_search.models import *
-from pgd_search.statistics.aggregates import DirectionalAvg, DirectionalStdDev, BinSort
+from pgd_search.statistics.aggregates import (BinSort, circular_stats,
+                                              circular_sums, linear_stats)
 from pgd_splicer.sidechain import sidechain_length_relationship_list, sidechain_angle_relationship_list
 from svg import *
 
@@ -184,7 +185,8 @@ class ConfDistPlot():
                  background_color='#ffffff',
                  graph_color='#222222',
                  text_color='#000000',
-                 hash_color='#666666'
+                 hash_color='#666666',
+                 search=None
                  ):
         """
          Constructor
@@ -203,6 +205,8 @@ class ConfDistPlot():
          graph_color: color used for background of plotted area
          text_color: color used for axis labels, hash labels, and title
          hash_color: color used for axis and hashes
+         search:   Search the querySet is from.  Plots of searches the
+                   PlotCube expresses are summed from the cube.
         """
     
         # Convert unicode to strings
@@ -210,6 +214,7 @@ class ConfDistPlot():
     
         # save properties
         self.querySet = querySet
+        self.search = search
         self.ref = ref
         self.xText = xText
         self.yText = yText
@@ -263,6 +268,26 @@ class ConfDistPlot():
         self.resXString, self.xTextString = self.create_res_string(self.residue_xproperty, self.xText)
         self.resYString, self.yTextString = self.create_res_string(self.residue_yproperty, self.yText)
 
+        # index set creation
+        self.index_set = set([self.resString,self.resXString,self.resYString])
+        
+        # Pick fields for retrieving values
+        if self.ref == "Observations":
+            self.fields = [(self.xText,self.xTextString), (self.yText,self.yTextString)]
+            self.stats_fields = []
+        elif self.ref == "all":
+            self.fields = [(field,i%(str(field))) for field in ([field for field,none in PLOT_PROPERTY_CHOICES]) for i in self.index_set]
+            self.stats_fields = self.fields
+        else:
+            self.fields = [(self.xText,self.xTextString), (self.yText,self.yTextString), (self.ref,self.refString)]
+            self.stats_fields = [(self.ref,self.refString)]
+
+        # Plots of common searches are summed from the plot cube
+        cells = self.cube_cells()
+        if cells is not None:
+            self.query_cube(cells)
+            return
+
         # Exclude values outside the plotted values
         querySet = self.querySet.filter(
             (Q(**{
@@ -281,32 +306,17 @@ class ConfDistPlot():
         )
         # Total # of observations
         self.numObs = querySet.count()
-        
-        # index set creation
-        self.index_set = set([self.resString,self.resXString,self.resYString])
-        
-        # Pick fields for retrieving values
-        if self.ref == "Observations":
-            self.fields = [(self.xText,self.xTextString), (self.yText,self.yTextString)]
-            self.stats_fields = []
-        elif self.ref == "all":
-            self.fields = [(field,i%(str(field))) for field in ([field for field,none in PLOT_PROPERTY_CHOICES]) for i in self.index_set]
-            self.stats_fields = self.fields
-        else:
-            self.fields = [(self.xText,self.xTextString), (self.yText,self.yTextString), (self.ref,self.refString)]
-            self.stats_fields = [(self.ref,self.refString)]
 
         # create set of annotations to include in the query
         # XXX if this is observations include all residues in the count,
         #     otherwise use the ref field so that the count is filters out nulls
         annotations = {'count':Count('id' if self.ref in ("Observations","all") else self.refString)}
-        torsion_avgs = {}
         for field in self.stats_fields:
             avg = '%s_avg' % field[1]
             stddev = '%s_stddev' % field[1]
             if field[0] in ANGLES:
-                annotations[avg] = DirectionalAvg(field[1])
-                torsion_avgs[field[0]] = {}
+                # avg and stddev are derived from the sums, see circular_stats
+                annotations.update(circular_sums(avg, field[1]))
             else:
                 annotations[avg] = Avg(field[1])
                 annotations[stddev] = StdDev(field[1])
@@ -324,14 +334,17 @@ class ConfDistPlot():
         # XXX in Django 1.2+ aggregates were changed to require connection and
         # SQLCompiler objects to generate sql.  We must initialize this all
         # manually to be able to grab the SQL for just our aggregate.
-        sortx = BinSort(self.xTextString, offset=x, bincount=xbin, max=x1)
-        sorty = BinSort(self.yTextString, offset=y, bincount=ybin, max=y1)
-        annotated_query.annotate(x=sortx, y=sorty)
-
+        #
+        # Standard grids group on the bins stored in the window instead, the
+        # shift converts the stored bin to the bin of the plot
         cn = connections['default']
         qn = SQLCompiler(annotated_query.query, cn, 'default').quote_name_unless_alias
-        sortx_sql = sortx.aggregate.as_sql(qn, cn)[0]
-        sorty_sql = sorty.aggregate.as_sql(qn, cn)[0]
+        sortx_sql, xshift = self.bin_sql(annotated_query, qn, cn, self.xText,
+                                         self.residue_xproperty,
+                                         self.xTextString, x, xbin, x1)
+        sorty_sql, yshift = self.bin_sql(annotated_query, qn, cn, self.yText,
+                                         self.residue_yproperty,
+                                         self.yTextString, y, ybin, y1)
 
         annotated_query = annotated_query.extra(select={'x':sortx_sql, 'y':sorty_sql})
         annotated_query = annotated_query.order_by('x','y')
@@ -349,70 +362,117 @@ class ConfDistPlot():
         # way of making this work
         annotated_query.query.group_by = []
         for entry in annotated_query:
-            key = (int(entry['x']), int(entry['y']))
-            # add  entry to the bins dict
-            bin = {
-                'count' : entry['count'],
-                'obs'         : [entry],
-                'pixCoords'   : key
-            }
+            key = (int(entry['x']) - xshift, int(entry['y']) - yshift)
+            for field in self.stats_fields:
+                if field[0] in ANGLES:
+                    avg = '%s_avg' % field[1]
+                    entry[avg], entry['%s_stddev' % field[1]] = \
+                        circular_stats(entry, avg)
+            self.add_bin(key, entry)
+
+    def add_bin(self, key, entry):
+        """
+        Adds a bin from a result row holding its count and statistics
+        """
+        # add  entry to the bins dict
+        bin = {
+            'count' : entry['count'],
+            'obs'         : [entry],
+            'pixCoords'   : key
+        }
 
-            # add all statistics
-            for k, v in entry.items():
-                if k in ('x','y','count'):
-                    continue
-                bin[k] = v 
-
-            if bin['count'] > 1:
-                # if this is an angle the stddev must be calculated in separate query
-                # using the circular standard deviation method
-                #
-                # due to null causing errors, each field must be run separate to filter
-                # out nulls for just that field
-                for field in self.stats_fields:
-                    if field[0] in ANGLES:
-                        avg = '%s_avg' % field[1]
-                        if avg and bin[avg]:
-                            torsion_avgs[field[0]]["'%s:%s'" % key] = bin[avg]
+        # add all statistics
+        for k, v in entry.items():
+            if k in ('x','y','count'):
+                continue
+            bin[k] = v 
 
-            else:
-                # no need for calculation, stddev infered from bincount
-                for field in self.fields:
-                    if field[0] in ANGLES:
-                        bin['%s_stddev' % field[1]] = 0
+        if bin['count'] < 2:
+            # no need for calculation, stddev infered from bincount
+            for field in self.fields:
+                if field[0] in ANGLES:
+                    bin['%s_stddev' % field[1]] = 0
 
-            self.bins[key] = bin
+        self.bins[key] = bin
 
-            # Find the bin with the most observations
-            if self.maxObs < bin['count']:
-                self.maxObs = bin['count']
+        # Find the bin with the most observations
+        if self.maxObs < bin['count']:
+            self.maxObs = bin['count']
 
-        # run queries to get stddevs for all torsion angles
-        # this is done outside the main loop because all of the averages 
-        # must first be collected so that they can be run in a single query
-        #
-        # This query uses a large case statement to select the average matching
-        # the bin the result is grouped into.  This isn't the cleanest way
-        # of doing this but it does work
-        prefix = self.get_prefix(self.residue_attribute)
+    def cube_cells(self):
+        """
+        Returns the PlotCube cells of the plot, or None if it is not a plot
+        the cube answers: the phi/psi plot of residue i over -180 to 180 in
+        CUBE_BIN_SIZE bins, shaded by observations or a field of residue i,
+        of a search the cube expresses.  Cubes of another data version are
+        not used.
+        """
+        if self.search is None or (self.xText, self.yText) != ('phi', 'psi') \
+                or self.residue_xproperty or self.residue_yproperty \
+                or (self.x, self.x1, self.y, self.y1) != (-180, 180, -180, 180) \
+                or (self.xbin, self.ybin) != (CUBE_BIN_SIZE, CUBE_BIN_SIZE):
+            return None
+        if self.ref != 'Observations' and (self.residue_attribute or
+                                           self.ref not in NON_FIELDS and
+                                           self.ref not in CUBE_FIELDS):
+            return None
+        lookups = self.search.cube_lookups()
+        if lookups is None:
+            return None
+        cells = PlotCube.objects.filter(version=DataVersion.current())
+        if not cells.exists():
+            return None
+        return cells.filter(lookups)
+
+    def query_cube(self, cells):
+        """
+        Sums the cells of the plot cube into the bins.  The statistics of a
+        bin are derived from the sums of its cells, see circular_stats and
+        linear_stats.
+        """
+        self.numObs = cells.aggregate(count=Sum('observations'))['count'] or 0
+
+        annotations = {'count': Sum('observations' if self.ref in NON_FIELDS
+                                    else '%s_count' % self.ref)}
         for field in self.stats_fields:
-            
+            avg = '%s_avg' % field[1]
+            annotations['%s_count' % avg] = Sum('%s_count' % field[0])
             if field[0] in ANGLES:
-                stddev = '%s_stddev' % field[1]
-                cases = ' '.join(['WHEN %s THEN %s' % (k,v) for k,v in filter(lambda x:x[1], torsion_avgs[field[0]].items())])
-                if cases:
-                    avgs = "CASE CONCAT(%s,':',%s) %s END" % (sortx_sql, sorty_sql, cases)
-                    annotations = {stddev:DirectionalStdDev(field[1], avg=avgs)}
-                    stddev_query = querySet \
-                                    .extra(select={'x':sortx_sql, 'y':sorty_sql}) \
-                                    .filter(**{'%s%s__isnull'%(prefix, field[1]):False}) \
-                                    .annotate(**annotations) \
-                                    .values(*annotations.keys()+['x','y']) \
-                                    .order_by('x','y')
-                    stddev_query.query.group_by = []
-                    for r in stddev_query:
-                        value = r[stddev] if r[stddev] else 0
-                        self.bins[(r['x'],r['y'])][stddev] = value
+                annotations['%s_sin_sum' % avg] = Sum('%s_sin' % field[0])
+                annotations['%s_cos_sum' % avg] = Sum('%s_cos' % field[0])
+            else:
+                annotations['%s_sum' % avg] = Sum('%s_sum' % field[0])
+                annotations['%s_sumsq' % avg] = Sum('%s_sumsq' % field[0])
+
+        bins = cells.values('phi_bin', 'psi_bin').annotate(**annotations) \
+                    .order_by()
+        for entry in bins:
+            key = (entry.pop('phi_bin'), entry.pop('psi_bin'))
+            for field in self.stats_fields:
+                avg = '%s_avg' % field[1]
+                stats = circular_stats if field[0] in ANGLES else linear_stats
+                entry[avg], entry['%s_stddev' % field[1]] = stats(entry, avg)
+            self.add_bin(key, entry)
+
+    def bin_sql(self, query, qn, cn, property, index, field, offset, size,
+                max):
+        """
+        Returns the SQL of the bin of a plotted field and the amount to
+        subtract from it to get the bin of the plot.  Angles of residue i
+        plotted over -180 to 180 on a standard grid use the bins stored in
+        the window (see BIN_FIELDS), which MySQL can group by without
+        sorting.  Anything else is binned with BinSort.
+        """
+        if property in BIN_FIELDS and int(index) == 0 and size in BIN_SIZES \
+                and max == 180 and offset < max and (offset + 180) % size == 0:
+            column = ResidueWindow._meta.get_field(
+                bin_field(property, int(size))).column
+            return '%s.%s' % (qn(ResidueWindow._meta.db_table), qn(column)), \
+                   int(offset + 180) / int(size)
+
+        sort = BinSort(field, offset=offset, bincount=size, max=max)
+        query.annotate(sort=sort)
+        return sort.aggregate.as_sql(qn, cn)[0], 0
 
     def create_res_string(self, index, property):
         """
@@ -420,18 +480,12 @@ class ConfDistPlot():
         """
         prefix = self.get_prefix(index)
         resString = '%s%%s' % prefix
-        refString = '%s%s' % (prefix, property)
+        refString = window_field(index, property)
         return resString, refString
 
     def get_prefix(self, index):
         """ Helper for generating residue prefixes based on index """
-        if index == 0:
-            prefix = ''
-        elif index < 0:
-            prefix = ''.join(['prev__' for i in range(index, 0)])
-        else:
-            prefix = ''.join(['next__' for i in range(index)])
-        return prefix
+        return window_prefix(index)
 
     def Plot(self):
         """
@@ -10,6 +10,7 @@ import json
 from PlotForm import PlotForm, ATTRIBUTE_CHOICES, PROPERTY_CHOICES
 from ConfDistFuncs import *
 from pgd_constants import AA_CHOICES
+from pgd_search.models import window_field
 from pgd_search.views import settings_processor
 from pgd_splicer.sidechain import sidechain_string_dict
 
@@ -21,30 +22,20 @@ def drawGraph(request, height=470, width=560, xStart=None, yStart=None, xEnd=Non
     @return: returns an SVG instance.
     """
 
-    query = pickle.loads(request.session['search']).querySet()
+    search = pickle.loads(request.session['search'])
+    query = search.querySet()
     # calculate default values for min, max, and binsize if no values were given
-    if residue_xproperty == 0:
-        xPrefix = ''
-    elif residue_xproperty < 0:
-        xPrefix = ''.join(['prev__' for i in range(residue_xproperty, 0)])
-    else:
-        xPrefix = ''.join(['next__' for i in range(residue_xproperty)])
-
-    if residue_yproperty == 0:
-        yPrefix = ''
-    elif residue_yproperty < 0:
-        yPrefix = ''.join(['prev__' for i in range(residue_yproperty, 0)])
-    else:
-        yPrefix = ''.join(['next__' for i in range(residue_yproperty)])
+    xField = window_field(residue_xproperty or 0, xProperty)
+    yField = window_field(residue_yproperty or 0, yProperty)
 
     if xStart == None:
-        xStart = query.aggregate(min=Min('%s%s' % (xPrefix, xProperty)))['min']
+        xStart = query.aggregate(min=Min(xField))['min']
     if xEnd == None:
-        xEnd = query.aggregate(max=Max('%s%s' % (xPrefix, xProperty)))['max']
+        xEnd = query.aggregate(max=Max(xField))['max']
     if yStart == None:
-        yStart = query.aggregate(min=Min('%s%s' % (yPrefix ,yProperty)))['min']
+        yStart = query.aggregate(min=Min(yField))['min']
     if yEnd == None:
-        yEnd = query.aggregate(max=Max('%s%s' % (yPrefix ,yProperty)))['max']
+        yEnd = query.aggregate(max=Max(yField))['max']
     if xBin == None:
         xBin = math.fabs(xEnd - xStart) / 36
     if yBin == None:
@@ -67,12 +58,13 @@ def drawGraph(request, height=470, width=560, xStart=None, yStart=None, xEnd=Non
                 residue_attribute,
                 residue_xproperty,
                 residue_yproperty,
-                pickle.loads(request.session['search']).querySet(),
+                query,
                 hue,
                 background_color,
                 graph_color,
                 text_color,
-                hash_color
+                hash_color,
+                search
         )
 
         svg = cdp.Plot()
@@ -226,6 +218,7 @@ def plotDump(request):
         form = PlotForm(request.POST) # A form bound to the POST data
         if form.is_valid(): # All validation rules pass
             data = form.cleaned_data
+            search = pickle.loads(request.session['search'])
 
             cdp = ConfDistPlot(
                 360,               #height
@@ -245,7 +238,8 @@ def plotDump(request):
                 int(data['residue_attribute']),
                 int(data['residue_xproperty']),
                 int(data['residue_yproperty']),
-                pickle.loads(request.session['search']).querySet()
+                search.querySet(),
+                search=search
             )
 
             response = HttpResponse(mimetype="text/tab-separated-values")
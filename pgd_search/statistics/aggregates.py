@@ -1,3 +1,6 @@
+from math import atan2, degrees, log, sqrt
+
+from django.db.models import Count, Sum
 from django.db.models.aggregates import Aggregate
 from django.db.models.sql.aggregates import Aggregate as SQLAggregate
 
@@ -33,33 +36,64 @@ class PGDAggregate(Aggregate):
         self.aggregate = aggregate
     
 
-class DirectionalStdDev(PGDAggregate):
-    alias = 'DirectionalStdDev'
-    name =  'DirectionalStdDev'
+class BinSort(PGDAggregate):
+    alias = 'BinSort'
+    name =  'BinSort'
 
 
-class DirectionalStdDevSQL(SQLAggregate):
-    is_computed = True
+class BinSortSQL(SQLAggregate):
     sql_function = ''
-    sql_template =  '%(function)sSQRT(IF((MOD(%(field)s+360,360)-%(avg)s)<180,SUM(POW(MOD(%(field)s+360,360)-%(avg)s,2)),SUM(POW(360-(MOD(%(field)s+360,360)-%(avg)s),2)))/(COUNT(%(field)s)-1))'
-
+    sql_template = '%(function)sFLOOR((IF(%(field)s<%(offset).16f,360,0)+%(field)s-%(offset).16f)/%(bincount).16f)-IF(%(field)s=%(max).16f,1,0)'
 
-class DirectionalAvg(PGDAggregate):
-    alias = 'DirectionalAvg'
-    name =  'DirectionalAvg'
 
+def circular_sums(alias, field):
+    """
+    Aggregates for the circular average and standard deviation of an angle,
+    see circular_stats.  Sums the sin/cos columns that are stored along with
+    the angles in the window table, so a single pass is needed.
 
-class DirectionalAvgSQL(SQLAggregate):
-    is_computed = True
-    sql_function = ''
-    sql_template = '%(function)sIF(DEGREES(ATAN2(-AVG(SIN(RADIANS(%(field)s))),-AVG(COS(RADIANS(%(field)s))))) < 0,DEGREES(ATAN2(-AVG(SIN(RADIANS(%(field)s))),-AVG(COS(RADIANS(%(field)s))))) + 180,DEGREES(ATAN2( -AVG(SIN(RADIANS(%(field)s))),-AVG(COS(RADIANS(%(field)s))))) - 180)'
+    @param alias: name the statistics are returned as
+    @param field: lookup of the angle, e.g. r4_phi
+    """
+    return {
+        '%s_sin_sum' % alias: Sum('%s_sin' % field),
+        '%s_cos_sum' % alias: Sum('%s_cos' % field),
+        '%s_count' % alias: Count(field),
+    }
 
 
-class BinSort(PGDAggregate):
-    alias = 'BinSort'
-    name =  'BinSort'
+def circular_stats(row, alias):
+    """
+    Removes the sums of circular_sums from a result row and returns the
+    circular average and standard deviation in degrees.  Both are derived
+    from the mean resultant vector of the angles: its direction is the
+    average and its length R gives the standard deviation sqrt(-2 ln R).
+    None is returned for values that are undefined.
+    """
+    s = row.pop('%s_sin_sum' % alias)
+    c = row.pop('%s_cos_sum' % alias)
+    n = row.pop('%s_count' % alias)
+    if not n:
+        return None, None
+    r = min(sqrt(s*s + c*c) / n, 1.0)
+    if r < 1e-9:
+        # the angles cancel out, there is no average direction
+        return None, None
+    return degrees(atan2(s, c)), degrees(sqrt(-2 * log(r)))
 
 
-class BinSortSQL(SQLAggregate):
-    sql_function = ''
-    sql_template = '%(function)sFLOOR((IF(%(field)s<%(offset).16f,360,0)+%(field)s-%(offset).16f)/%(bincount).16f)-IF(%(field)s=%(max).16f,1,0)'
+def linear_stats(row, alias):
+    """
+    Removes the count, sum and sum of squares of a value from a result row,
+    keyed <alias>_count, <alias>_sum and <alias>_sumsq, and returns the
+    average and the population standard deviation, as Avg and StdDev would.
+    None is returned for values that are undefined.
+    """
+    total = row.pop('%s_sum' % alias)
+    squares = row.pop('%s_sumsq' % alias)
+    n = row.pop('%s_count' % alias)
+    if not n:
+        return None, None
+    avg = total / n
+    # rounding may leave a tiny negative variance for equal values
+    return avg, sqrt(max(squares / n - avg * avg, 0.0))
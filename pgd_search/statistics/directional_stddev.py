@@ -1,15 +1,15 @@
 from django.db.models import Min, Max, Avg, StdDev
 
-from pgd_search.statistics.aggregates import DirectionalAvg, DirectionalStdDev
+from pgd_search.statistics.aggregates import circular_stats, circular_sums
 
 
 class DirectionalStatisticsQuery():
     """
-    This is a specialized query that performs two queries and merges the
-    results.  The first calculates any aggregate functions that can be completed
-    in a normal query.  min/max/avg for all fields, and stddev for linear
-    fields.  The second query calculates directional stddev for any fields that
-    require it using the avgs calculated in the first query
+    This is a specialized query that calculates statistics for linear fields
+    and dihedral angles in a single query.  min/max/avg/stddev of linear
+    fields are plain aggregates.  The directional avg and stddev of angles
+    are derived from sums of their stored sin/cos values, see
+    circular_stats.
     """
 
     def __init__(self, angles, fields, prefix, queryset):
@@ -37,7 +37,6 @@ class DirectionalStatisticsQuery():
         Private method for executing query, always runs query and then updates cache
         """
         annotations = {}
-        aa_rows = {}
         p = self.prefix
         aa_field = p%'aa'
         
@@ -45,7 +44,7 @@ class DirectionalStatisticsQuery():
         for field in self.angles:
             annotations['min_%s' % field] = Min(p%field)
             annotations['max_%s' % field] = Max(p%field)
-            annotations['avg_%s' % field] = DirectionalAvg(p%field)
+            annotations.update(circular_sums(field, p%field))
         for field in self.fields:
             annotations['min_%s' % field] = Min(p%field)
             annotations['max_%s' % field] = Max(p%field)
@@ -59,29 +58,10 @@ class DirectionalStatisticsQuery():
         query = query.annotate(**annotations)
         
         results = list(query)
-        
-        # construction 2nd query for DirectionStdDev calculations for each
-        # dihedral angle.  only needed if there is at least one dihedral angle
-        if self.angles:
-            annotations = {}
-            for row in results:
-                aa_rows[row[aa_field]] = row
-                for field in self.angles:
-                    avg=row['avg_%s' % field]
-                    if avg:
-                        annotations['stddev_%s' % field] = DirectionalStdDev(p%field, avg=avg)
-                    else:
-                        row['stddev_%s' % field] = None
-            
-            if annotations:
-                query = self.queryset
-                query = query.values(aa_field)
-                query = query.annotate(**annotations)
-            
-            # update the original results with the results of the 2nd query
-            for row in query:
-                outer_row = aa_rows[row[aa_field]]
-                outer_row.update(row)
+        for row in results:
+            for field in self.angles:
+                row['avg_%s' % field], row['stddev_%s' % field] = \
+                    circular_stats(row, field)
         
         # rename aa columns
         if self.prefix != '%s':
@@ -107,7 +87,6 @@ class DirectionalStatisticsTotalQuery(DirectionalStatisticsQuery):
         Private method for executing query, always runs query and then updates cache
         """
         annotations = {}
-        aa_rows = {}
         p = self.prefix
         aa_field = p%'aa'
         
@@ -115,7 +94,7 @@ class DirectionalStatisticsTotalQuery(DirectionalStatisticsQuery):
         for field in self.angles:
             annotations['min_%s' % field] = Min(p%field)
             annotations['max_%s' % field] = Max(p%field)
-            annotations['avg_%s' % field] = DirectionalAvg(p%field)
+            annotations.update(circular_sums(field, p%field))
         for field in self.fields:
             annotations['min_%s' % field] = Min(p%field)
             annotations['max_%s' % field] = Max(p%field)
@@ -126,22 +105,9 @@ class DirectionalStatisticsTotalQuery(DirectionalStatisticsQuery):
         # query.  save query in a list so that its members can be modified
         query = self.queryset
         totals = query.aggregate(**annotations)
-        
-        # construction 2nd query for DirectionStdDev calculations for each
-        # dihedral angle.
-        if self.angles:
-            annotations = {}
-            for field in self.angles:
-                avg=totals['avg_%s' % field]
-                if avg:
-                    annotations['stddev_%s' % field] = DirectionalStdDev(field, avg=avg)
-                else:
-                    totals['stddev_%s' % field] = None
-            
-            if annotations:
-                query = self.queryset
-                stddevs = query.aggregate(**annotations)
-                totals.update(stddevs)
+        for field in self.angles:
+            totals['avg_%s' % field], totals['stddev_%s' % field] = \
+                circular_stats(totals, field)
         
         totals['aa'] = 'total'
         self.results = [totals]
@@ -8,6 +8,8 @@ from django.http import HttpResponse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 from pgd_constants import AA_CHOICES, SS_CHOICES, AA_CHOICES_DICT
+from pgd_core.models import sidechain_column
+from pgd_search.models import window_prefix
 from pgd_search.statistics.aggregates import *
 from pgd_search.statistics.directional_stddev import *
 from pgd_search.statistics.form import StatsForm
@@ -132,13 +134,8 @@ def calculate_statistics(queryset, iIndex=0):
     last = start
 
     # get field prefix for this residue
-    if iIndex == 0:
-        prefix = ''
-    elif iIndex < 0:
-        prefix = ''.join(['prev__' for i in range(iIndex, 0)])
-    else:
-        prefix = ''.join(['next__' for i in range(iIndex)])
-    field_prefix = '%s%%s' % prefix  
+    prefix = window_prefix(iIndex)
+    field_prefix = '%s%%s' % prefix
 
     ss_field = '%sss' % prefix
     aa_field = '%saa' % prefix
@@ -197,22 +194,18 @@ def calculate_statistics(queryset, iIndex=0):
 
 def calculate_aa_statistics(queryset, aa, iIndex=0):
     """ Calculates statistics for a single AA type """
-    # get field prefix for this residue
-    if iIndex == 0:
-        prefix = ''
-    elif iIndex < 0:
-        prefix = ''.join(['prev__' for i in range(iIndex, 0)])
-    else:
-        prefix = ''.join(['next__' for i in range(iIndex)])
-    field_prefix = '%s%%s' % prefix  
+    # get field prefix for this residue.  Sidechains are joined through the
+    # sidechain of the window position
+    prefix = window_prefix(iIndex)
+    field_prefix = '%ssidechain__%%s' % prefix
     
     queryset = queryset.filter(**{'%saa'%prefix:aa})
     full_aa = AA_CHOICES_DICT[aa].upper()
     
     angles = []
     if aa in BOND_LENGTHS:
-        fields = [str('sidechain_%s__%s' % (full_aa,f)) for f in BOND_ANGLES[aa]] + \
-             [str('sidechain_%s__%s' % (full_aa,f)) for f in BOND_LENGTHS[aa]]
+        fields = [str(sidechain_column(full_aa, f)) for f in BOND_ANGLES[aa]] + \
+             [str(sidechain_column(full_aa, f)) for f in BOND_LENGTHS[aa]]
     else:
         fields = []
     
@@ -220,6 +213,13 @@ def calculate_aa_statistics(queryset, aa, iIndex=0):
     dsq_thread.start()
     dsq_thread.join()
     results = dsq_thread.results[0]
+    # name the results after the sidechain fields the stats page displays
+    column_prefix = sidechain_column(full_aa, '')
+    for key in results.keys():
+        stat, sep, column = key.partition('_')
+        if column.startswith(column_prefix):
+            results['%s_sidechain_%s__%s' % (stat, full_aa,
+                    column[len(column_prefix):])] = results.pop(key)
     # XXX the Total query sets aa to total, but really its just a single AA
     results['aa'] = aa
     return results
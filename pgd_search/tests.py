@@ -7,8 +7,10 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from pgd_search.models import *
 from pgd_core.models import *
-#from pgd_splicer.SegmentBuilder import SegmentBuilderTask
+from pgd_search.statistics.aggregates import circular_stats, linear_stats
+from pgd_splicer.windows import store_windows
 from pgd_constants import AA_CHOICES, SS_CHOICES
+import math
 from math import ceil
 from search.SearchForm import SearchSyntaxField
 import pytz
@@ -65,7 +67,6 @@ class SearchParserValidation(LiveServerTestCase):
         residue = Residue()
         residue.protein = protein
         residue.chain = chain
-        residue.chainID = chain.code
         residue.chainIndex = z
         #set choice fields.
         residue.aa = self.calculateAA(i)
@@ -83,6 +84,13 @@ class SearchParserValidation(LiveServerTestCase):
         return chainList
 
 
+    def parse_search(self, search):
+        # searches match windows, which are built by the splicer.  build them
+        # for the residues created by the test and return the residues matched
+        for protein in Protein.objects.all():
+            store_windows(protein)
+        return Residue.objects.filter(id__in=search.parse_search().values('id'))
+
     #creates a set objects with predictable values so we can predict search results
     def setUp(self):
         self.tearDown()
@@ -116,8 +124,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search; upper bound of the expected range is NON-INCLUSIVE
             set(chainList[1:6]),
-            set(Search.parse_search(search)),
-            "Query strings search test failed on range '%s'.  Expected value was %s    Actual values were %s"%(data['a1_0'], set(chainList[1:5]), set(Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Query strings search test failed on range '%s'.  Expected value was %s    Actual values were %s"%(data['a1_0'], set(chainList[1:5]), set(self.parse_search(search)))
         )
 
         data['a1_0'] = "1-3"
@@ -126,7 +134,7 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search; upper bound of the expected range is NON-INCLUSIVE
             set(chainList[1:4]),
-            set(Search.parse_search(search)),
+            set(self.parse_search(search)),
             "Query strings search test failed on range '%s'"%data['a1_0']
         )
 
@@ -136,8 +144,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search
             set(chainList[0:6]),
-            set(Search.parse_search(search)),
-            "Query strings search test failed on range '%s'.  Expected value was %s    Actual values were %s"%(data['a1_0'], set(chainList[0:6]), set(Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Query strings search test failed on range '%s'.  Expected value was %s    Actual values were %s"%(data['a1_0'], set(chainList[0:6]), set(self.parse_search(search)))
         )
 
         data['a1_0'] = '<=6'
@@ -145,8 +153,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search
             set(chainList[0:7]),
-            set(Search.parse_search(search)),
-            "Query strings search test failed on range '%s'.  Expected value was %s    Actual values were %s"%(data['a1_0'], set(chainList[0:7]), set(Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Query strings search test failed on range '%s'.  Expected value was %s    Actual values were %s"%(data['a1_0'], set(chainList[0:7]), set(self.parse_search(search)))
         )
 
         data['a1_0'] = '>5'
@@ -154,8 +162,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search
             set(chainList[6:7]),
-            set(Search.parse_search(search)),
-            "Query strings search test failed on range '%s'.  Expected value was %s    Actual values were %s"%(data['a1_0'], set(chainList[6:7]), set(Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Query strings search test failed on range '%s'.  Expected value was %s    Actual values were %s"%(data['a1_0'], set(chainList[6:7]), set(self.parse_search(search)))
         )
 
         data['a1_0'] = '>=5'
@@ -163,8 +171,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search
             set(chainList[5:7]),
-            set(Search.parse_search(search)),
-            "Query strings search test failed on range '%s'.  Expected value was %s    Actual values were %s"%(data['a1_0'], set(chainList[5:7]), set(Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Query strings search test failed on range '%s'.  Expected value was %s    Actual values were %s"%(data['a1_0'], set(chainList[5:7]), set(self.parse_search(search)))
         )
 
 
@@ -197,8 +205,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that both proteins are returned
             set(chainList+chainList2),
-            set(Search.parse_search(search)),
-            "Resolution search failed on %f-%f   Expected results were %s   Returned results were %s"%(data['resolutionMin'],data['resolutionMax'],list(x.protein.resolution for x in chainList+chainList2),list(y.protein.resolution for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Resolution search failed on %f-%f   Expected results were %s   Returned results were %s"%(data['resolutionMin'],data['resolutionMax'],list(x.protein.resolution for x in chainList+chainList2),list(y.protein.resolution for y in self.parse_search(search)))
         )
 
         data['resolutionMin'] = 0.1
@@ -209,8 +217,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that one protein is returned
             set(chainList2),
-            set(Search.parse_search(search)),
-            "Resolution search failed on %f-%f   Expected results were %s   Returned results were %s"%(data['resolutionMin'],data['resolutionMax'],list(x.protein.resolution for x in chainList2),list(y.protein.resolution for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Resolution search failed on %f-%f   Expected results were %s   Returned results were %s"%(data['resolutionMin'],data['resolutionMax'],list(x.protein.resolution for x in chainList2),list(y.protein.resolution for y in self.parse_search(search)))
         )
 
         data['resolutionMin'] = 1
@@ -221,8 +229,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that one protein is returned
             set(chainList),
-            set(Search.parse_search(search)),
-            "Resolution search failed on %f-%f   Expected results were %s   Returned results were %s"%(data['resolutionMin'],data['resolutionMax'],list(x.protein.resolution for x in chainList),list(y.protein.resolution for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Resolution search failed on %f-%f   Expected results were %s   Returned results were %s"%(data['resolutionMin'],data['resolutionMax'],list(x.protein.resolution for x in chainList),list(y.protein.resolution for y in self.parse_search(search)))
         )
 
         data['resolutionMin'] = 1.1
@@ -233,8 +241,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that one protein is returned
             set(chainList),
-            set(Search.parse_search(search)),
-            "Resolution search failed on %f-%f   Expected results were %s   Returned results were %s"%(data['resolutionMin'],data['resolutionMax'],list(x.protein.resolution for x in chainList),list(y.protein.resolution for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Resolution search failed on %f-%f   Expected results were %s   Returned results were %s"%(data['resolutionMin'],data['resolutionMax'],list(x.protein.resolution for x in chainList),list(y.protein.resolution for y in self.parse_search(search)))
         )
 
         data['resolutionMin'] = .3
@@ -245,8 +253,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that no proteins are returned
             set(),
-            set(Search.parse_search(search)),
-            "Resolution search failed on %f-%f   Expected results were %s   Returned results were %s"%(data['resolutionMin'],data['resolutionMax'],set(),list(y.protein.resolution for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Resolution search failed on %f-%f   Expected results were %s   Returned results were %s"%(data['resolutionMin'],data['resolutionMax'],set(),list(y.protein.resolution for y in self.parse_search(search)))
         )
 
 
@@ -270,8 +278,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search
             set(),
-            set(Search.parse_search(search)),
-            "Threshold search failed on %i  Expected results were the %s  Returned results were %s"%(data['threshold'],set(), list(y.protein.threshold for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Threshold search failed on %i  Expected results were the %s  Returned results were %s"%(data['threshold'],set(), list(y.protein.threshold for y in self.parse_search(search)))
         )
 
         data['threshold'] = 25
@@ -279,8 +287,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search
             set(chainList[1]+chainList[2]+chainList[3]+chainList[4]),
-            set(Search.parse_search(search)),
-            "Threshold search failed on %i  Expected results were the %s  Returned results were %s"%(data['threshold'],list(y.protein.threshold for y in chainList[1]+chainList[2]+chainList[3]+chainList[4]), list(y.protein.threshold for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Threshold search failed on %i  Expected results were the %s  Returned results were %s"%(data['threshold'],list(y.protein.threshold for y in chainList[1]+chainList[2]+chainList[3]+chainList[4]), list(y.protein.threshold for y in self.parse_search(search)))
         )
 
         data['threshold'] = 75
@@ -288,8 +296,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search
             set(chainList[1]+chainList[2]+chainList[3]+chainList[4]+chainList[5]),
-            set(Search.parse_search(search)),
-            "Threshold search failed on %i  Expected results were the %s  Returned results were %s"%(data['threshold'],list(y.protein.threshold for y in chainList[1]+chainList[2]+chainList[3]+chainList[4]+chainList[5]), list(y.protein.threshold for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Threshold search failed on %i  Expected results were the %s  Returned results were %s"%(data['threshold'],list(y.protein.threshold for y in chainList[1]+chainList[2]+chainList[3]+chainList[4]+chainList[5]), list(y.protein.threshold for y in self.parse_search(search)))
         )
 
 
@@ -300,7 +308,7 @@ class SearchParserValidation(LiveServerTestCase):
             #self.assertEqual(
                 ## See that the intended query is executed by parse_search
                 #set(Segment.objects.filter(protein__threshold=index).all()),
-                #set(Search.parse_search(search).all()),
+                #set(self.parse_search(search).all()),
                 #"Threshold search failed on %i"%(index)
             #)
 
@@ -319,16 +327,16 @@ class SearchParserValidation(LiveServerTestCase):
 
         self.assertEqual(
             set(chainList),
-            set(Search.parse_search(search)),
-            "Resolution search failed on %s   Expected results were %s   Returned results were %s"%(data['proteins'],list(x.protein.code for x in chainList),list(y.protein.code for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Resolution search failed on %s   Expected results were %s   Returned results were %s"%(data['proteins'],list(x.protein.code for x in chainList),list(y.protein.code for y in self.parse_search(search)))
         )
 
         #test inverse
         data['proteins_i'] = False
         self.assertEqual(
             set(chainList2),
-            set(Search.parse_search(search)),
-            "Resolution search failed on %s   Expected results were %s   Returned results were %s"%(data['proteins'],list(x.protein.code for x in chainList),list(y.protein.code for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Resolution search failed on %s   Expected results were %s   Returned results were %s"%(data['proteins'],list(x.protein.code for x in chainList),list(y.protein.code for y in self.parse_search(search)))
         )
 
         #testing multi-code and parsing robustness
@@ -336,8 +344,8 @@ class SearchParserValidation(LiveServerTestCase):
         data['proteins_i'] = True
         self.assertEqual(
             set(chainList+chainList2),
-            set(Search.parse_search(search)),
-            "Resolution search failed on %s   Expected results were %s   Returned results were %s"%(data['proteins'],list(x.protein.code for x in chainList+chainList2),list(y.protein.code for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Resolution search failed on %s   Expected results were %s   Returned results were %s"%(data['proteins'],list(x.protein.code for x in chainList+chainList2),list(y.protein.code for y in self.parse_search(search)))
         )
 
         #test inverse
@@ -345,8 +353,8 @@ class SearchParserValidation(LiveServerTestCase):
         data['proteins'] = 'none'
         self.assertEqual(
             set(),
-            set(Search.parse_search(search)),
-            "Resolution search failed on the empty set   Expected results were the empty set   Returned results were %s"%(list(y.protein.code for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Resolution search failed on the empty set   Expected results were the empty set   Returned results were %s"%(list(y.protein.code for y in self.parse_search(search)))
         )
 
         #test inverse
@@ -354,8 +362,8 @@ class SearchParserValidation(LiveServerTestCase):
         data['proteins'] = 'gmez,kats'
         self.assertEqual(
             set(),
-            set(Search.parse_search(search)),
-            "Resolution search failed on the empty set   Expected results were the empty set   Returned results were %s"%(list(y.protein.code for y in Search.parse_search(search)))
+            set(self.parse_search(search)),
+            "Resolution search failed on the empty set   Expected results were the empty set   Returned results were %s"%(list(y.protein.code for y in self.parse_search(search)))
         )
 
     def testSearchAa(self):
@@ -379,8 +387,8 @@ class SearchParserValidation(LiveServerTestCase):
             self.assertEqual(
                 # See that the intended query is executed by parse_search
                 list(chainList[aa_index+1]),
-                list(Search.parse_search(search)),
-                "Specific AA search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(aa_choice, (list(getattr(x, 'aa') for x in (chainList[aa_index+1]))), (list(str(getattr(y, 'aa')) for y in (Search.parse_search(search)))), len(Search.parse_search(search)))
+                list(self.parse_search(search)),
+                "Specific AA search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(aa_choice, (list(getattr(x, 'aa') for x in (chainList[aa_index+1]))), (list(str(getattr(y, 'aa')) for y in (self.parse_search(search)))), len(self.parse_search(search)))
             )
 
             #test the negation of a single index.
@@ -392,8 +400,8 @@ class SearchParserValidation(LiveServerTestCase):
             search.data = data
             self.assertEqual(
                 list(negatedList),
-                list(Search.parse_search(search)),
-                "Negated AA search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(aa_choice, (list(getattr(x, 'aa') for x in (negatedList))), (list(str(getattr(y, 'aa')) for y in (Search.parse_search(search)))), len(Search.parse_search(search)))
+                list(self.parse_search(search)),
+                "Negated AA search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(aa_choice, (list(getattr(x, 'aa') for x in (negatedList))), (list(str(getattr(y, 'aa')) for y in (self.parse_search(search)))), len(self.parse_search(search)))
             )
 
         data['aa_i_0'] = 1
@@ -404,8 +412,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search
             list(chainList[1] + chainList[2] + chainList[3]),
-            list(Search.parse_search(search)),
-            "Specific AA search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(aa_choice, (list(getattr(x, 'aa') for x in (chainList[1] + chainList[2] + chainList[3]))), (list(str(getattr(y, 'aa')) for y in (Search.parse_search(search)))), len(Search.parse_search(search)))
+            list(self.parse_search(search)),
+            "Specific AA search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(aa_choice, (list(getattr(x, 'aa') for x in (chainList[1] + chainList[2] + chainList[3]))), (list(str(getattr(y, 'aa')) for y in (self.parse_search(search)))), len(self.parse_search(search)))
         )
 
         data['aa_i_0'] = 0
@@ -416,8 +424,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search
             list(chainList[4] + chainList[5]),
-            list(Search.parse_search(search)),
-            "Specific AA search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(aa_choice, (list(getattr(x, 'aa') for x in (chainList[4] + chainList[5]))), (list(str(getattr(y, 'aa')) for y in (Search.parse_search(search)))), len(Search.parse_search(search)))
+            list(self.parse_search(search)),
+            "Specific AA search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(aa_choice, (list(getattr(x, 'aa') for x in (chainList[4] + chainList[5]))), (list(str(getattr(y, 'aa')) for y in (self.parse_search(search)))), len(self.parse_search(search)))
         )
 
 
@@ -443,8 +451,8 @@ class SearchParserValidation(LiveServerTestCase):
             self.assertEqual(
                 # See that the intended query is executed by parse_search
                 list(chainList[ss_index+1]),
-                list(Search.parse_search(search)),
-                "Specific ss search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(ss_choice, (list(getattr(x, 'ss') for x in (chainList[ss_index+1]))), (list(str(getattr(y, 'ss')) for y in (Search.parse_search(search)))), len(Search.parse_search(search)))
+                list(self.parse_search(search)),
+                "Specific ss search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(ss_choice, (list(getattr(x, 'ss') for x in (chainList[ss_index+1]))), (list(str(getattr(y, 'ss')) for y in (self.parse_search(search)))), len(self.parse_search(search)))
             )
 
             #test the negation of a single index.
@@ -456,8 +464,8 @@ class SearchParserValidation(LiveServerTestCase):
             search.data = data
             self.assertEqual(
                 list(negatedList).sort(),
-                list(Search.parse_search(search)).sort(),
-                "Negated ss search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(ss_choice, (list(getattr(x, 'ss') for x in (negatedList))), (list(str(getattr(y, 'ss')) for y in (Search.parse_search(search)))), len(Search.parse_search(search)))
+                list(self.parse_search(search)).sort(),
+                "Negated ss search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(ss_choice, (list(getattr(x, 'ss') for x in (negatedList))), (list(str(getattr(y, 'ss')) for y in (self.parse_search(search)))), len(self.parse_search(search)))
             )
 
         data['ss_i_0'] = 1
@@ -468,8 +476,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search
             list(chainList[1] + chainList[2] + chainList[3]).sort(),
-            list(Search.parse_search(search)).sort(),
-            "Specific ss search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(ss_choice, (list(getattr(x, 'ss') for x in (chainList[1] + chainList[2] + chainList[3]))), (list(str(getattr(y, 'ss')) for y in (Search.parse_search(search)))), len(Search.parse_search(search)))
+            list(self.parse_search(search)).sort(),
+            "Specific ss search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(ss_choice, (list(getattr(x, 'ss') for x in (chainList[1] + chainList[2] + chainList[3]))), (list(str(getattr(y, 'ss')) for y in (self.parse_search(search)))), len(self.parse_search(search)))
         )
 
         data['ss_i_0'] = 0
@@ -480,8 +488,8 @@ class SearchParserValidation(LiveServerTestCase):
         self.assertEqual(
             # See that the intended query is executed by parse_search
             list(chainList[4] + chainList[5]).sort(),
-            list(Search.parse_search(search)).sort(),
-            "Specific ss search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(ss_choice, (list(getattr(x, 'ss') for x in (chainList[4] + chainList[5]))), (list(str(getattr(y, 'ss')) for y in (Search.parse_search(search)))), len(Search.parse_search(search)))
+            list(self.parse_search(search)).sort(),
+            "Specific ss search failed on '%s'  Expected results were %s  Returned results were %s with %s entries"%(ss_choice, (list(getattr(x, 'ss') for x in (chainList[4] + chainList[5]))), (list(str(getattr(y, 'ss')) for y in (self.parse_search(search)))), len(self.parse_search(search)))
         )
 
     def testSearchMultipleResidues(self):
@@ -509,9 +517,9 @@ class SearchParserValidation(LiveServerTestCase):
             search.data = data
             self.assertAlmostEqual(
                 (getattr(chainList[2], '%s'%field)),
-                (getattr((Search.parse_search(search).all()[0]), '%s'%field)),#this grabs the first object in the returned search, and attempts to grab the attribute in 'field' out of it
+                (getattr((self.parse_search(search).all()[0]), '%s'%field)),#this grabs the first object in the returned search, and attempts to grab the attribute in 'field' out of it
                 4,
-                "Multiple residue search failed on field %s  Expected result was %s  Returned result was %s"%(field, set((getattr(chainList[2], '%s'%field), )), set(getattr(x, '%s'%field) for x in Search.parse_search(search)))
+                "Multiple residue search failed on field %s  Expected result was %s  Returned result was %s"%(field, set((getattr(chainList[2], '%s'%field), )), set(getattr(x, '%s'%field) for x in self.parse_search(search)))
             )
 
 class SearchFieldValidationCase(LiveServerTestCase):
@@ -768,3 +776,87 @@ class SidechainStatistics(LiveServerTestCase):
         # cbcg_element = self.driver.find_element_by_css_selector("td.CB_CG")
         self.assertTrue(cbcg_element.is_displayed())
         self.assertNotEqual("--", cbcg_element.text)
+
+
+class CircularStatistics(unittest.TestCase):
+
+    def sums(self, angles):
+        return {'phi_sin_sum': sum(math.sin(math.radians(a)) for a in angles),
+                'phi_cos_sum': sum(math.cos(math.radians(a)) for a in angles),
+                'phi_count': len(angles)}
+
+    def test_wraparound(self):
+        # the average of angles either side of 180 is 180, not 0
+        avg, stddev = circular_stats(self.sums([170, -170]), 'phi')
+        self.assertAlmostEqual(abs(avg), 180)
+        self.assertAlmostEqual(stddev, 10, places=0)
+        row = self.sums([-60, -50, -70])
+        avg, stddev = circular_stats(row, 'phi')
+        self.assertAlmostEqual(avg, -60)
+        self.assertEqual(row, {})
+
+    def test_undefined(self):
+        self.assertEqual(circular_stats(self.sums([]), 'phi'), (None, None))
+        self.assertEqual(circular_stats(self.sums([0, 180]), 'phi'),
+                         (None, None))
+        self.assertAlmostEqual(circular_stats(self.sums([45]), 'phi')[1], 0)
+
+
+class AngleBins(unittest.TestCase):
+
+    def test_angle_bin(self):
+        self.assertEqual(angle_bin(-180.0, 10), 0)
+        self.assertEqual(angle_bin(-170.5, 10), 0)
+        self.assertEqual(angle_bin(-60.0, 10), 12)
+        self.assertEqual(angle_bin(-60.0, 1), 120)
+        self.assertEqual(angle_bin(179.9, 5), 71)
+        # 180 falls in the last bin, as with BinSort over -180 to 180
+        self.assertEqual(angle_bin(180.0, 10), 35)
+        self.assertEqual(angle_bin(180.0, 1), 359)
+
+
+class CubeLookups(unittest.TestCase):
+
+    def search(self, **data):
+        # a search of the default form, the fields not set are omitted
+        values = {'residues': '3', 'threshold': '25',
+                  'resolutionMin': 0.0, 'resolutionMax': 1.2,
+                  'rfactorMin': 0.0, 'rfactorMax': 0.25,
+                  'rfreeMin': 0.0, 'rfreeMax': 0.3}
+        values.update(data)
+        return Search(data=values)
+
+    def test_expressible(self):
+        self.assertNotEqual(self.search().cube_lookups(), None)
+        self.assertNotEqual(self.search(ss_0=['H'], ss_i_0=1, aa_0=['g'],
+                                        aa_i_0=0).cube_lookups(), None)
+        self.assertNotEqual(Search(data={}).cube_lookups(), None)
+
+    def test_not_expressible(self):
+        # filters on anything but residue i, the segment and quality tiers
+        self.assertEqual(self.search(aa_1=['g'], aa_i_1=1).cube_lookups(),
+                         None)
+        self.assertEqual(self.search(phi_0='<0', phi_i_0=1).cube_lookups(),
+                         None)
+        self.assertEqual(self.search(ome_1='<=-90,>=90',
+                                     ome_i_1=1).cube_lookups(), None)
+        self.assertEqual(self.search(resolutionMax=1.3).cube_lookups(), None)
+        self.assertEqual(self.search(rfactorMin=0.1).cube_lookups(), None)
+        self.assertEqual(self.search(proteins='1ABC',
+                                     proteins_i=1).cube_lookups(), None)
+
+    def test_cube_tier(self):
+        self.assertEqual(cube_tier('resolution', 0.9), 0)
+        # a value on a boundary is in the tier it closes
+        self.assertEqual(cube_tier('resolution', 1.2), 1)
+        self.assertEqual(cube_tier('resolution', 1.21), 2)
+        self.assertEqual(cube_tier('rfree', 0.5), len(CUBE_TIERS['rfree']))
+
+    def test_linear_stats(self):
+        row = {'L1_sum': 6.0, 'L1_sumsq': 14.0, 'L1_count': 3}
+        avg, stddev = linear_stats(row, 'L1')
+        self.assertAlmostEqual(avg, 2)
+        self.assertAlmostEqual(stddev, math.sqrt(2 / 3.0))
+        self.assertEqual(row, {})
+        self.assertEqual(linear_stats({'L1_sum': None, 'L1_sumsq': None,
+                                       'L1_count': 0}, 'L1'), (None, None))
@@ -2,6 +2,8 @@ import math
 
 from django.conf import settings
 
+from pgd_core.models import DataVersion
+
 
 """
 Properties for residues as indexes
@@ -19,6 +21,6 @@ def settings_processor(request):
     return {
         'PGD_VERSION': settings.PGD_VERSION,
         'ROOT': settings.SITE_ROOT,
-        'DATA_VERSION': settings.DATA_VERSION,
+        'DATA_VERSION': DataVersion.current(),
         'GOOGLE_ID': settings.GOOGLE_ID
     }
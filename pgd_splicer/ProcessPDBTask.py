@@ -17,31 +17,60 @@ if __name__ == '__main__':
     # Done setting up django environment
     # ==========================================================
 
-from datetime import datetime
+from cStringIO import StringIO
+from datetime import datetime, timedelta
 from gzip import GzipFile
-from math import degrees, sqrt
-from multiprocessing import Pool
+import logging
+from multiprocessing import Pool, Process, Queue, TimeoutError, cpu_count
 from operator import itemgetter
 import os
+from Queue import Empty, Full
 import sys
-from tempfile import NamedTemporaryFile
+import time
 
 import Bio.PDB
-from Bio.PDB import calc_angle as pdb_calc_angle
-from Bio.PDB import calc_dihedral as pdb_calc_dihedral
-from django.db import transaction
+import numpy
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
 
 from pgd_core.models import (Protein as ProteinModel, Chain as ChainModel,
-                             Residue as ResidueModel, Sidechain_ARG,
-                             Sidechain_ASN, Sidechain_ASP, Sidechain_CYS,
-                             Sidechain_GLN, Sidechain_GLU, Sidechain_HIS,
-                             Sidechain_ILE, Sidechain_LEU, Sidechain_LYS,
-                             Sidechain_MET, Sidechain_PHE, Sidechain_PRO,
-                             Sidechain_SER, Sidechain_THR, Sidechain_TRP,
-                             Sidechain_TYR, Sidechain_VAL)
+                             Residue as ResidueModel, Sidechain,
+                             sidechain_column)
 
-from pgd_splicer.chi import CHI_MAP, CHI_CORRECTIONS_TESTS, CHI_CORRECTIONS
-from pgd_splicer.sidechain import bond_angles, bond_lengths
+from pgd_splicer.chi import CHI_MAP
+from pgd_splicer import (atom_records, dssp_cache, parse_cache,
+                         residue_diff, scheduling)
+from pgd_splicer.journal import ImportJournal
+from pgd_splicer.geometry import (BACKBONE_FIELDS, SIDECHAIN_TABLES,
+                                  backbone_geometry, chain_layout, coordinates)
+from pgd_splicer.sidechain import sidechain_string_dict
+from pgd_splicer.telemetry import Telemetry
+from pgd_splicer.timing import StageTimer
+from pgd_splicer.cube import store_plot_cube
+from pgd_splicer.windows import store_quality, store_windows
+
+# progress of the workers on each protein, chain and residue.  The import
+# reports its progress and failures from the telemetry events.
+logger = logging.getLogger(__name__)
+
+# number of rows written by each INSERT statement in bulk mode
+BULK_BATCH_SIZE = 500
+
+# default number of writer processes, and proteins saved per transaction
+WRITERS = 1
+COMMIT_SIZE = 10
+
+# tasks, i.e. chunks of proteins, a pool worker runs before it is replaced
+MAX_TASKS_PER_CHILD = 50
+
+# seconds between checks that the writer processes are alive while waiting
+# on them
+WRITER_POLL = 5
+
+# default paths of the import status file and journal
+STATUS_FILE = 'ProcessPDB.status.json'
+JOURNAL_FILE = 'ProcessPDB.journal'
 
 
 def NO_VALUE(field):
@@ -79,35 +108,34 @@ AA3to1 =  {
 }
 
 
-aa_class = {
-    'r':(Sidechain_ARG,'sidechain_ARG'),
-    'n':(Sidechain_ASN,'sidechain_ASN'),
-    'd':(Sidechain_ASP,'sidechain_ASP'),
-    'c':(Sidechain_CYS,'sidechain_CYS'),
-    'q':(Sidechain_GLN,'sidechain_GLN'),
-    'e':(Sidechain_GLU,'sidechain_GLU'),
-    'h':(Sidechain_HIS,'sidechain_HIS'),
-    'i':(Sidechain_ILE,'sidechain_ILE'),
-    'l':(Sidechain_LEU,'sidechain_LEU'),
-    'k':(Sidechain_LYS,'sidechain_LYS'),
-    'm':(Sidechain_MET,'sidechain_MET'),
-    'f':(Sidechain_PHE,'sidechain_PHE'),
-    'p':(Sidechain_PRO,'sidechain_PRO'),
-    's':(Sidechain_SER,'sidechain_SER'),
-    't':(Sidechain_THR,'sidechain_THR'),
-    'w':(Sidechain_TRP,'sidechain_TRP'),
-    'y':(Sidechain_TYR,'sidechain_TYR'),
-    'v':(Sidechain_VAL,'sidechain_VAL')
-}
+# residue type of the sidechain of each aa code with a sidechain
+aa_sidechain = dict((aa, resname) for resname, aa in AA3to1.items()
+                    if resname in sidechain_string_dict)
+
+# columns of the sidechain table
+SIDECHAIN_FIELDS = [field.attname for field in Sidechain._meta.fields
+                    if not field.primary_key]
+
+# residue fields compared by diff_store_pdb, relations are compared separately
+RESIDUE_FIELDS = [field.attname for field in ResidueModel._meta.fields
+                  if not field.rel and not field.primary_key]
+
+# residue columns that are no longer part of the Residue model.  Databases
+# created before they were removed must drop them with the compact_schema
+# management command, see check_schema.
+DROPPED_RESIDUE_COLUMNS = ('chainID', 'prev_id', 'next_id')
 
 
 class InvalidResidueException(Exception):
     """
     Exception identifying something wrong while processing
     a protein residue.  this is used to jump to a common error
-    handling routine.
+    handling routine.  reason is a short category used in the
+    import telemetry.
     """
-    pass
+    def __init__(self, message, reason='invalid'):
+        Exception.__init__(self, message)
+        self.reason = reason
 
 
 class ProcessPDBTask():
@@ -124,52 +152,206 @@ class ProcessPDBTask():
             return 0
         return self.finished_proteins / self.total_proteins * 100
 
+    def report(self, telemetry):
+        """
+        Print a progress line
+        """
+        self.finished_proteins = telemetry.finished
+        remaining = telemetry.remaining()
+        print "Progress: %s of %s (%0.2f%%), %s failed, %s elapsed, " \
+              "%s remaining" % (
+            self.finished_proteins, self.total_proteins, self.progress(),
+            telemetry.counters.get('failed', 0),
+            timedelta(seconds=int(telemetry.elapsed())),
+            timedelta(seconds=int(remaining)) if remaining is not None else '?')
+
+    def report_utilization(self, telemetry, pool_size, chunks):
+        """
+        Print how busy the pool and each worker was
+        """
+        utilization = telemetry.utilization()
+        pool = [w for w in utilization if w.startswith('pool')]
+        busy = sum(telemetry.workers[w]['busy'] for w in pool)
+        print "Pool: %s processes, %s chunks, %0.1f%% utilized" % (
+            pool_size, chunks,
+            busy * 100 / (pool_size * telemetry.elapsed()) if pool else 0)
+        for name in sorted(utilization):
+            print "    %-14s %5s proteins  %8.1fs busy  %5.1f%% utilized" % (
+                name, telemetry.workers[name]['proteins'],
+                telemetry.workers[name]['busy'], utilization[name] * 100)
 
     def work(self, **kwargs):
         """
         Work function - expects a list of pdb file prefixes.
+
+        Proteins whose pdb file is missing or not newer than the imported
+        data are skipped before any work is dispatched to the pool.
+
+        Parsing and saving are separated.  The pool parses proteins and
+        hands each one to the writer processes through a bounded queue as
+        soon as it is parsed.  The writers save the proteins, committing
+        several per transaction.
+
+        Proteins are dispatched longest first in chunks that shrink towards
+        the end of the run, see scheduling.py.  The utilization of each
+        worker is printed when the import is complete.
+
+        Options:
+            bulk - save proteins with bulk_store_pdb instead of store_pdb.
+            diff - save proteins with diff_store_pdb, writing only the
+                   residues that changed since the previous import.
+            writers - number of writer processes.
+            commit_size - number of proteins saved per transaction.
+            load_from_cache - load parsed proteins from PARSE_CACHE_DIR
+                              instead of parsing pdb files.
+            status_file - path of the JSON status file updated during the
+                          import, see telemetry.py.  None disables it.
+            log_file - path of a log receiving one JSON line per event.
+            journal - path of the import journal, see journal.py.
+            resume - skip proteins recorded as imported in the journal.
+
+        The plot cube is rebuilt when the import saved any protein.
         """
         # process a single protein dict, or a list of proteins
         pdbs = kwargs['data']
+        bulk = kwargs.get('bulk', False)
+        diff = kwargs.get('diff', False)
+        writers = kwargs.get('writers') or WRITERS
+        commit_size = kwargs.get('commit_size') or COMMIT_SIZE
 
         print 'processing :', len(pdbs)
 
+        check_schema()
 
         if not isinstance(pdbs, list):
             pdbs = [pdbs]
         #print 'PDBS TO PROCESS:', pdbs
-        self.total_proteins = len(pdbs)
-        skipped = 0
-        imported = 0
-
-        pool = Pool(maxtasksperchild=50)
-        started = datetime.now()
 
-        results = pool.imap_unordered(workhorse, pdbs)
-        for result in results:
-            if result:
-                imported += 1
-            else:
-                skipped += 1
-            self.finished_proteins += 1
-
-            percent = self.progress()
-            now = datetime.now()
-            elapsed = now - started
-            if int(percent):
-                remaining = elapsed * 100 // int(percent)
-		remaining -= elapsed
-            else:
-                remaining = elapsed * 100
-            print "-" * 42
-            print "Processed protein %s of %s" % (self.finished_proteins,
-                                                  self.total_proteins)
-            print "%s imported, %s skipped (%0.6f%%)" % (imported, skipped,
-                                                         percent)
-            print "%s elapsed, %s remaining" % (elapsed, remaining)
-            print "-" * 42
+        journal = ImportJournal(kwargs.get('journal') or JOURNAL_FILE)
+        if kwargs.get('resume'):
+            # skip proteins the journal records as imported
+            pdbs, done = journal.pending(pdbs)
+            print "%s already imported according to %s" % (len(done),
+                                                            journal.path)
+
+        if kwargs.get('load_from_cache'):
+            # rebuild everything from the parse cache, pdb files are not used
+            if not settings.PARSE_CACHE_DIR:
+                raise Exception('PARSE_CACHE_DIR must be set to load from cache')
+            worker = load_worker
+            stale, up_to_date, missing = pdbs, [], []
+            path = lambda code: parse_cache.cache_path(
+                settings.PARSE_CACHE_DIR, code)
+        else:
+            worker = parse_worker
+            stale, up_to_date, missing = find_stale_pdbs(pdbs)
+            path = lambda code: atom_records.pdb_path(code) or ''
+        for data in missing:
+            print 'ERROR - File not found: %s' % data['code']
+        print "%s to process, %s up-to-date, %s missing" % (
+            len(stale), len(up_to_date), len(missing))
+
+        self.total_proteins = len(stale)
+        self.finished_proteins = 0
+        telemetry = Telemetry(len(stale),
+                              kwargs.get('status_file', STATUS_FILE),
+                              kwargs.get('log_file'))
+
+        # child processes must open their own database connections
+        connection.close()
+
+        queue = Queue(writers * commit_size * 2)
+        results = Queue()
+        processes = [Process(target=write_proteins,
+                             args=(queue, results, bulk, commit_size, diff))
+                     for i in range(writers)]
+        for process in processes:
+            process.start()
+
+        pool_size = cpu_count()
+        costs = scheduling.estimate_costs(
+            stale, scheduling.file_sizes(stale, path),
+            scheduling.load_runtimes(kwargs.get('log_file')))
+        chunks = scheduling.chunks(scheduling.longest_first(stale, costs),
+                                   costs, pool_size)
+        pool = Pool(pool_size, initializer=init_worker, initargs=(queue,),
+                    maxtasksperchild=MAX_TASKS_PER_CHILD)
+
+        def record(event):
+            telemetry.record(event)
+            if event['event'] == 'saved':
+                journal.record(event['code'], event['pdb_hash'],
+                               event['pdb_date'])
+
+        # pool workers block on the queue while the writers are behind, so
+        # every wait checks that the writers are still alive.  If one died
+        # the import stops rather than waiting for it forever.
+        try:
+            tasks = [(worker, chunk) for chunk in chunks]
+            parsed = pool.imap_unordered(work_chunk, tasks)
+            while True:
+                try:
+                    events = parsed.next(WRITER_POLL)
+                except StopIteration:
+                    break
+                except TimeoutError:
+                    check_writers(processes)
+                    continue
+                for event in events:
+                    record(event)
+
+                # record what the writers have done so far
+                while True:
+                    try:
+                        event = results.get_nowait()
+                    except Empty:
+                        break
+                    record(event)
+                check_writers(processes)
+                self.report(telemetry)
+
+            pool.close()
+            pool.join()
+
+            # one stop marker per writer, then wait for the writers to
+            # finish.  Each writer sends None when it is done.
+            for process in processes:
+                put_to_writers(queue, None, processes)
+            done = 0
+            while done < len(processes):
+                try:
+                    event = results.get(timeout=WRITER_POLL)
+                except Empty:
+                    check_writers(processes)
+                    continue
+                if event is None:
+                    done += 1
+                else:
+                    record(event)
+                    self.report(telemetry)
+        except:
+            pool.terminate()
+            for process in processes:
+                process.terminate()
+            telemetry.close()
+            journal.close()
+            raise
+        for process in processes:
+            process.join()
+        telemetry.close()
+        journal.close()
+
+        # the plot cube is summed from the windows once the writers are done
+        if telemetry.counters.get('saved', 0):
+            with transaction.atomic():
+                store_plot_cube()
 
         print 'ProcessPDBTask - Processing Complete'
+        print "%s imported, %s failed, %s up-to-date, %s missing" % (
+            telemetry.counters.get('saved', 0),
+            telemetry.counters.get('failed', 0),
+            len(up_to_date), len(missing))
+        self.report_utilization(telemetry, pool_size, len(chunks))
 
         # return only the code of proteins inserted or updated
         # we no longer need to pass any data as it is contained in the database
@@ -178,25 +360,275 @@ class ProcessPDBTask():
         return codes
 
 
-def workhorse(data):
+def print_exception(code, e):
+    """
+    Log an exception raised while processing a protein
+    """
+    import traceback
+    exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
+    print "*** print_tb:"
+    traceback.print_tb(exceptionTraceback, limit=10, file=sys.stdout)
+    print 'EXCEPTION in Protein: %s %s %s' % (code, e.__class__, e)
+
+
+def count_residues(data):
+    return sum(len(residues) for residues in data['chains'].values())
+
+
+def failed_event(code, stage, e):
+    return {'event': 'failed', 'code': code, 'stage': stage,
+            'reason': e.__class__.__name__}
+
+
+# wall clock time at which the current worker process started
+worker_started = None
+
+# queue of the writer processes, set in each worker process
+writer_queue = None
+
+
+def init_worker(queue):
+    """
+    Pool initializer, run once in each worker process.  Django is
+    configured by the parent.  Database connections inherited from it must
+    not be used, the parent closes its connection before the pool starts.
+
+    @param queue: bounded queue the parsed proteins are put on for the
+                  writers
+    """
+    global worker_started, writer_queue
+    worker_started = time.time()
+    writer_queue = queue
+    connection.close()
+
+
+def check_schema():
     """
-    Update a single protein entry.
+    Checks that the residue table has none of the DROPPED_RESIDUE_COLUMNS.
+    The NOT NULL chainID column of older databases makes every new residue
+    fail to insert, so the import stops before any work is done instead.
 
-    This is a viable entrypoint for parallelizing the process.
+    @raises Exception naming the columns and the command that drops them
+    """
+    cursor = connection.cursor()
+    columns = [row[0] for row in connection.introspection
+               .get_table_description(cursor, ResidueModel._meta.db_table)]
+    dropped = [column for column in DROPPED_RESIDUE_COLUMNS
+               if column in columns]
+    if dropped:
+        raise Exception('The residue table still has the removed columns %s.'
+                        '  Run "python manage.py compact_schema" before '
+                        'importing, see docs/source/importing_data.rst'
+                        % ', '.join(dropped))
+
+
+def worker_event(role, event, started):
+    """
+    Adds the worker and the time it spent on a protein to an event
+    """
+    finished = time.time()
+    event.update({'worker': '%s-%s' % (role, os.getpid()),
+                  'worker_started': worker_started,
+                  'busy': finished - started,
+                  'finished': finished})
+    return event
+
+
+def work_chunk(task):
+    """
+    Runs worker on each protein of a chunk.  This is the entrypoint for the
+    pool.  Each parsed protein is put on the writer queue as soon as it is
+    parsed, so only the telemetry events of the chunk are returned.
+
+    @param task: tuple of (worker, list of proteins)
+    @return list of telemetry events
+    """
+    worker, chunk = task
+    events = []
+    for data in chunk:
+        started = time.time()
+        data, event = worker(data)
+        events.append(worker_event('pool', event, started))
+        if data:
+            # blocks while the writers are behind
+            writer_queue.put(data)
+    return events
+
+
+def parse_worker(data):
     """
+    Parse a single protein.  Run by the pool through work_chunk.
 
-    # only update pdbs if they are newer
-    if pdb_file_is_newer(data):
-        return process_pdb(data)
+    @return (parsed protein or None if it could not be parsed, telemetry
+            event)
+    """
+    code = data['code']
+    timings = {}
+    invalid = {}
+    try:
+        data = parse_pdb(data, timings, invalid)
+    except Exception, e:
+        print_exception(code, e)
+        return None, failed_event(code, 'parse', e)
+
+    return data, {'event': 'parsed', 'code': code,
+                  'residues': count_residues(data),
+                  'stages': dict((stage, t['wall'])
+                                 for stage, t in timings.items()),
+                  'invalid': invalid}
+
+
+def load_worker(data):
+    """
+    Load a single protein from the parse cache.  Run by the pool through
+    work_chunk when rebuilding from the cache.
+
+    @return (parsed protein or None, telemetry event)
+    """
+    code = data['code']
+    started = time.time()
+    try:
+        data = load_pdb(data)
+    except Exception, e:
+        print_exception(code, e)
+        return None, failed_event(code, 'load', e)
+
+    return data, {'event': 'parsed', 'code': code,
+                  'residues': count_residues(data),
+                  'stages': {'load': time.time() - started}}
+
+
+def check_writers(processes):
+    """
+    Raises an exception if a writer process died.  Writers that are done
+    exit with code 0.
+    """
+    for process in processes:
+        if process.exitcode not in (None, 0):
+            raise Exception('Writer process %s exited with code %s' % (
+                process.pid, process.exitcode))
+
+
+def put_to_writers(queue, data, processes, timeout=WRITER_POLL):
+    """
+    Puts data on the queue of the writers, checking that they are alive
+    while the queue is full
+    """
+    while True:
+        try:
+            queue.put(data, timeout=timeout)
+            return
+        except Full:
+            check_writers(processes)
+
+
+def write_proteins(queue, results, bulk=False, commit_size=COMMIT_SIZE,
+                   diff=False):
+    """
+    Writer process.  Saves parsed proteins taken from the queue until a None
+    is received, committing commit_size proteins per transaction.  A
+    telemetry event for each protein is put on the results queue, followed
+    by None when the writer is done.
+    """
+    global worker_started
+    worker_started = time.time()
+    if diff:
+        store = diff_store_pdb
+    elif bulk:
+        store = bulk_store_pdb
     else:
-        print 'INFO: Skipping up-to-date PDB: %s' % data['code']
-        return False
+        store = store_pdb
+    batch = []
+    for data in iter(queue.get, None):
+        batch.append(data)
+        if len(batch) == commit_size:
+            write_events(batch, store, results)
+            batch = []
+    if batch:
+        write_events(batch, store, results)
+    connection.close()
+    results.put(None)
+
+
+def write_events(proteins, store, results):
+    """
+    Saves a batch of proteins and reports an event for each of them
+    """
+    started = time.time()
+    failures = write_batch(proteins, store)
+    seconds = (time.time() - started) / len(proteins)
+    for data in proteins:
+        code = data['code']
+        if code in failures:
+            event = {'event': 'failed', 'code': code, 'stage': 'db',
+                     'reason': failures[code]}
+        else:
+            pdb_date = data.get('pdb_date')
+            event = {'event': 'saved', 'code': code,
+                     'residues': count_residues(data),
+                     'stages': {'db': seconds},
+                     'pdb_hash': data.get('pdb_hash'),
+                     'pdb_date': pdb_date.strftime(parse_cache.DATE_FORMAT)
+                                 if pdb_date else None}
+            if 'changes' in data:
+                event['changes'] = data['changes']
+        # the batch is shared equally between its proteins
+        results.put(worker_event('writer', event, time.time() - seconds))
+
+
+def write_batch(proteins, store):
+    """
+    Save a batch of proteins in one transaction.  If the transaction fails
+    the proteins are saved one at a time, so a single bad protein does not
+    cause the rest of the batch to be lost.
+
+    @return dict mapping the code of each protein that could not be saved
+            to the name of the exception raised
+    """
+    error = commit_proteins(proteins, store)
+    if error is None:
+        return {}
+    if len(proteins) == 1:
+        return {proteins[0]['code']: error}
+
+    failures = {}
+    for data in proteins:
+        error = commit_proteins([data], store)
+        if error is not None:
+            failures[data['code']] = error
+    return failures
 
 
 @transaction.commit_manually
-def process_pdb(data):
+def commit_proteins(proteins, store):
     """
-    Process an individual pdb file
+    Save proteins using store and commit them as a single transaction.
+
+    @return None, or the name of the exception if the transaction failed
+    """
+    try:
+        for data in proteins:
+            code = data['code']
+            store(data)
+            logger.debug('Saved %s', code)
+
+    except Exception, e:
+        print_exception(code, e)
+        transaction.rollback()
+        return e.__class__.__name__
+
+    transaction.commit()
+    return None
+
+
+def parse_pdb(data, timings=None, invalid=None):
+    """
+    Parse an individual pdb file.  No database access is done, the returned
+    dict contains everything needed to save the protein.  See
+    parseWithBioPython for timings and invalid.
+
+    If PARSE_CACHE_DIR is set, a cached result for the same file is used
+    and new results are added to the cache.
     """
 
     # create a copy of the data.  This dict will have a large amount of data
@@ -205,159 +637,437 @@ def process_pdb(data):
     # e.g. if it were looped over with a large list of PDBs
     data = data.copy()
 
-    try:
-        residue_props = None
-        code = data['code']
-        chains_filter = data.get("chains")
-        filename = 'pdb%s.ent.gz' % code.lower()
-        print '    Processing: ', code
+    code = data['code']
+    chains_filter = data.get("chains")
+    filename = os.path.basename(atom_records.pdb_path(code) or
+                                atom_records.PDB_FILENAME % code.lower())
+    logger.debug('Processing %s', code)
 
-        # update datastructure
-        data['chains'] = {}
+    # the hash identifies the file in the parse cache and import journal
+    pdb_hash = parse_cache.file_hash(os.path.join('./pdb', filename))
+    data['pdb_hash'] = pdb_hash
 
-        # 1) parse with bioPython
-        data = parseWithBioPython(filename, data, chains_filter)
+    cache_dir = settings.PARSE_CACHE_DIR
+    if cache_dir:
+        cached = parse_cache.load(cache_dir, code, pdb_hash)
+        if cached:
+            chains = parse_cache.select_chains(cached[0], cached[1],
+                                               chains_filter)
+            if chains is not None:
+                logger.debug('Using cached parse of %s', code)
+                data['chains'] = chains
+                return data
 
-        # 2) Create/Get Protein and save values
-        try:
-            protein = ProteinModel.objects.get(code=code)
-            print '  Existing protein: ', code
-        except ProteinModel.DoesNotExist:
-            print '  Creating protein: ', code
-            protein = ProteinModel()
-        protein.code       = code
-        protein.threshold  = float(data['threshold'])
-        protein.resolution = float(data['resolution'])
-        protein.rfactor    = float(data['rfactor'])
-        protein.rfree      = float(data['rfree'])
-        protein.pdb_date   = data['pdb_date']
-        protein.save()
-
-        # 3) Get/Create Chains and save values
-        chains = {}
-        for chaincode, residues in data['chains'].items():
-            chainId = '%s%s' % (protein.code, chaincode)
-            try:
-                chain = protein.chains.get(id=chainId)
-                print '   Existing Chain: %s' % chaincode
-            except ChainModel.DoesNotExist:
-                print '   Creating Chain: %s' % chaincode
-                chain = ChainModel()
-                chain.id      = chainId
-                chain.protein = protein
-                chain.code    = chaincode
-                chain.save()
+    # update datastructure
+    data['chains'] = {}
 
-                protein.chains.add(chain)
-            #create dictionary of chains for quick access
-            chains[chaincode] = chain
+    # parse with bioPython
+    data = parseWithBioPython(filename, data, chains_filter, timings, invalid)
 
+    if cache_dir:
+        parse_cache.write_entry(parse_cache.cache_path(cache_dir, code), data,
+                                pdb_hash, chains_filter)
+    return data
 
-            # 4) iterate through residue data creating residues
-            for residue_props in sorted(residues.values(), key=itemgetter("chainIndex")):
 
-                # 4a) find the residue object so it can be updated or create a new one
-                try:
-                    residue = chain.residues.get(oldID=str(residue_props['oldID']))
-                except ResidueModel.DoesNotExist:
-                    #not found, create new residue
-                    #print 'New Residue'
-                    residue = ResidueModel()
-                    residue.protein = protein
-                    residue.chain   = chain
-                    residue.chainID = chain.id[4]
-
-                # 4b) copy properties into a residue object
-                #     property keys should match property name in object
-                residue.__dict__.update(residue_props)
-
-                # 4c) set previous
-                if "prev" in residue_props:
-                    residue.prev = old_residue
-
-                # 4d) find and create sidechain if needed.  set the property
-                #     in the residue for the correct sidechain type
-                if 'sidechain' in residue_props:
-                    klass, name = aa_class[residue_props['aa']]
-                    try:
-                        sidechain = getattr(residue, name)
-                        if not sidechain:
-                            sidechain = klass()
-                    except:
-                        sidechain = klass()
-                    sidechain.__dict__.update(residue_props['sidechain'])
-                    sidechain.save()
-                    residue.__setattr__(name, sidechain)
+def load_pdb(data):
+    """
+    Load a parsed protein from the parse cache without reading the pdb file.
+    """
+    data = data.copy()
+    code = data['code']
+    cached = parse_cache.load(settings.PARSE_CACHE_DIR, code)
+    if not cached:
+        raise Exception('No cached parse for %s' % code)
+    meta, chains = cached
+
+    chains = parse_cache.select_chains(meta, chains, data.get('chains'))
+    if chains is None:
+        raise Exception('Cached parse for %s is missing chains' % code)
+    data['chains'] = chains
+    data['pdb_date'] = meta['pdb_date']
+    data['pdb_hash'] = meta['hash']
+    return data
+
+
+def store_pdb(data):
+    """
+    Save a parsed protein, updating the residues of a previous import.
+    Must be called within a transaction.
+    """
+    # 1) Create/Get Protein and save values
+    protein = save_protein(data)
 
-                # 4e) save
-                residue.save()
-                chain.residues.add(residue)
+    # 2) Get/Create Chains and save values
+    chains = {}
+    for chaincode, residues in data['chains'].items():
+        chain = save_chain(protein, chaincode)
+        #create dictionary of chains for quick access
+        chains[chaincode] = chain
 
-                # 4f) Update old_residue.next
-                if "prev" in residue_props:
-                    old_residue.next = residue
-                    old_residue.save()
 
+        # 3) iterate through residue data creating residues
+        for residue_props in sorted(residues.values(), key=itemgetter("chainIndex")):
 
-                old_residue = residue
-            print '    %s proteins' % len(residues)
+            # 3a) find the residue object so it can be updated or create a new one
+            try:
+                residue = chain.residues.get(oldID=str(residue_props['oldID']))
+            except ResidueModel.DoesNotExist:
+                #not found, create new residue
+                #print 'New Residue'
+                residue = ResidueModel()
+                residue.protein = protein
+                residue.chain   = chain
+
+            # 3b) copy properties into a residue object
+            #     property keys should match property name in object
+            residue.__dict__.update(residue_props)
+
+            # 3c) find and create sidechain if needed.  set the property
+            #     in the residue for the correct sidechain type
+            if 'sidechain' in residue_props:
+                if residue.sidechain_id:
+                    sidechain = residue.sidechain
+                else:
+                    sidechain = Sidechain()
+                sidechain.__dict__.update(sidechain_values(
+                    residue_props['aa'], residue_props['sidechain']))
+                sidechain.save()
+                residue.sidechain = sidechain
 
+            # 3d) save
+            residue.save()
+            chain.residues.add(residue)
+        logger.debug('Stored %s residues', len(residues))
 
-    except Exception, e:
-        import traceback
-        exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
-        print "*** print_tb:"
-        print residue_props
-        traceback.print_tb(exceptionTraceback, limit=10, file=sys.stdout)
-        print 'EXCEPTION in Residue: %s %s %s' % (code, e.__class__, e)
-        transaction.rollback()
-        return False
+    # 4) rebuild the search windows of the protein
+    store_windows(protein)
 
-    # 5) entire protein has been processed, commit transaction
-    transaction.commit()
-    return True
 
+def bulk_store_pdb(data):
+    """
+    Save a parsed protein using set-based writes.  Must be called within a
+    transaction.
 
-def pdb_file_is_newer(data):
+    Instead of fetching and saving each residue, all residues and sidechains
+    of a chain are written with batched INSERT statements.  Residues already stored
+    for the protein are deleted first, so the number of queries depends on
+    the number of chains and rows written rather than on the residue count.
     """
-    Compares if the pdb file used as an input is newer than data already
-    in the database.
+    # 1) Create/Get Protein and remove residues from a previous import
+    protein = save_protein(data)
+    delete_residues(protein)
+
+    # 2) Get/Create Chains and insert their residues
+    for chaincode, residues in data['chains'].items():
+        chain = save_chain(protein, chaincode)
+        bulk_create_residues(protein, chain, residues)
+        logger.debug('Inserted %s residues', len(residues))
 
-    This is used to prevent processing proteins if they do not need to be
-    processed.
+    # 3) rebuild the search windows of the protein
+    store_windows(protein)
+
+
+def diff_store_pdb(data):
     """
+    Save a parsed protein, writing only what changed since the previous
+    import.  Must be called within a transaction.
 
-    code =  data['code']
-    path = './pdb/pdb%s.ent.gz' % code.lower()
-    print path
-    if os.path.exists(path):
-        pdb_date = datetime.fromtimestamp(os.path.getmtime(path))
+    The residues stored for the protein are loaded with one query and their
+    sidechains with another.  They are compared with
+    the parsed values using the tolerances in residue_diff.py: only the
+    changed fields of changed rows are updated, new residues are inserted
+    and residues that are no longer present are deleted.  A protein that
+    was not imported before is saved with bulk_store_pdb.
 
+    A summary of the changes is printed and stored in data['changes'].
+    """
+    summary = residue_diff.new_summary()
+    data['changes'] = summary
+
+    # 1) Create/Get Protein and load what is stored for it
+    protein = save_protein(data)
+    stored = {}
+    for row in protein.residues.values('id', 'chain_id', 'sidechain_id',
+                                       *RESIDUE_FIELDS):
+        stored[(row['chain_id'], row['oldID'])] = row
+    if not stored:
+        bulk_store_pdb(data)
+        summary['inserted'] = count_residues(data)
+        logger.debug('%s: %s', data['code'],
+                     residue_diff.format_summary(summary))
+        return
+
+    sidechains = {}
+    keys = dict((row['sidechain_id'], key) for key, row in stored.items()
+                if row['sidechain_id'] is not None)
+    if keys:
+        for row in Sidechain.objects.filter(id__in=keys).values():
+            sidechains[keys[row['id']]] = row
+
+    # 2) Get/Create Chains and compare their residues
+    updates = []
+    obsolete_sidechains = []
+    for chaincode, residues in data['chains'].items():
+        chain = save_chain(protein, chaincode)
+        for residue_props in sorted(residues.values(),
+                                    key=itemgetter("chainIndex")):
+            residue = ResidueModel()
+            residue.protein = protein
+            residue.chain   = chain
+            residue.__dict__.update(residue_props)
+            residue.oldID   = str(residue.oldID)
+            key = (chain.id, residue.oldID)
+            row = stored.pop(key, None)
+            old_sidechain = sidechains.get(key)
+
+            # 2a) new residues are inserted
+            if row is None:
+                if 'sidechain' in residue_props:
+                    sidechain = Sidechain(**sidechain_values(
+                        residue_props['aa'], residue_props['sidechain']))
+                    sidechain.save()
+                    residue.sidechain = sidechain
+                residue.save()
+                summary['inserted'] += 1
+                continue
+
+            # 2b) compare the residue and its sidechain
+            changed = residue_diff.changed_fields(
+                row, dict((field, getattr(residue, field))
+                          for field in RESIDUE_FIELDS))
+            sidechain_changed = {}
+            if 'sidechain' in residue_props:
+                # the columns of other residue types are cleared when the
+                # residue type changed
+                values = sidechain_values(residue_props['aa'],
+                                          residue_props['sidechain'])
+                if old_sidechain:
+                    sidechain_changed = residue_diff.changed_fields(
+                        old_sidechain, values)
+                    if sidechain_changed:
+                        Sidechain.objects.filter(id=old_sidechain['id']) \
+                                         .update(**sidechain_changed)
+                else:
+                    sidechain = Sidechain(**values)
+                    sidechain.save()
+                    changed['sidechain'] = sidechain.id
+            elif old_sidechain:
+                # the sidechain is gone
+                changed['sidechain'] = None
+                obsolete_sidechains.append(old_sidechain)
+
+            if changed:
+                updates.append((row['id'], changed))
+            if changed or sidechain_changed:
+                summary['updated'] += 1
+                summary['fields'] += len(changed) + len(sidechain_changed)
+            else:
+                summary['unchanged'] += 1
+
+    # 3) write the changed fields of each changed residue
+    for id, changed in updates:
+        ResidueModel.objects.filter(id=id).update(**changed)
+
+    # 4) delete residues that are no longer present
+    vanished = stored.values()
+    if vanished:
+        ResidueModel.objects.filter(
+            id__in=[old['id'] for old in vanished]).delete()
+        obsolete_sidechains.extend(sidechains[key] for key in stored
+                                   if key in sidechains)
+        summary['deleted'] = len(vanished)
+    if obsolete_sidechains:
+        Sidechain.objects.filter(
+            id__in=[old['id'] for old in obsolete_sidechains]).delete()
+
+    # 5) rebuild the search windows if any residue changed, otherwise only
+    #    the protein's values may have changed
+    if summary['updated'] or summary['inserted'] or summary['deleted']:
+        store_windows(protein)
     else:
-        print 'ERROR - File not found'
-        return False
+        store_quality(protein)
+
+    logger.debug('%s: %s', protein.code, residue_diff.format_summary(summary))
+
+
+def sidechain_values(aa, values):
+    """
+    Column values of the sidechain of a residue of type aa.  Columns of
+    other residue types and fields that were not calculated are None.
+    """
+    row = dict.fromkeys(SIDECHAIN_FIELDS)
+    resname = aa_sidechain[aa]
+    for field in sidechain_string_dict[resname]:
+        field = field.replace('-', '_')
+        row[sidechain_column(resname, field)] = values.get(field)
+    return row
+
+
+def save_protein(data):
+    """
+    Create or update the Protein for a parsed pdb and save its values
+    """
+    code = data['code']
     try:
         protein = ProteinModel.objects.get(code=code)
+        logger.debug('Existing protein: %s', code)
     except ProteinModel.DoesNotExist:
-        # Protein not in database, pdb is new
-        data['pdb_date'] = pdb_date
+        logger.debug('Creating protein: %s', code)
+        protein = ProteinModel()
+    protein.code       = code
+    protein.threshold  = float(data['threshold'])
+    protein.resolution = float(data['resolution'])
+    protein.rfactor    = float(data['rfactor'])
+    protein.rfree      = float(data['rfree'])
+    protein.pdb_date   = data['pdb_date']
+    protein.save()
+    return protein
+
+
+def save_chain(protein, chaincode):
+    """
+    Get the Chain of a protein, creating it if it does not exist yet
+    """
+    chainId = '%s%s' % (protein.code, chaincode)
+    try:
+        chain = protein.chains.get(id=chainId)
+        logger.debug('Existing chain: %s', chaincode)
+    except ChainModel.DoesNotExist:
+        logger.debug('Creating chain: %s', chaincode)
+        chain = ChainModel()
+        chain.id      = chainId
+        chain.protein = protein
+        chain.code    = chaincode
+        chain.save()
+
+        protein.chains.add(chain)
+    return chain
+
+
+def delete_residues(protein):
+    """
+    Delete all residues and sidechains stored for a protein.
+    """
+    residues = protein.residues.all()
+    sidechain_ids = [id for id in residues.values_list('sidechain', flat=True)
+                     if id is not None]
+    residues.delete()
+
+    if sidechain_ids:
+        Sidechain.objects.filter(id__in=sidechain_ids).delete()
+
+
+def bulk_create_residues(protein, chain, residues):
+    """
+    Insert the residues of a chain with batched INSERT statements.  Must be
+    called within a transaction.
+
+    bulk_create does not return primary keys.  Sidechains are inserted first
+    and their ids, assigned by the database, are read back in a single query:
+    the sidechain table is locked above its highest id, so the new rows are
+    the ones above it, in the order they were inserted.  The residues are
+    then inserted with their sidechain already set.
+    """
+    residues = sorted(residues.values(), key=itemgetter("chainIndex"))
+
+    with_sidechain = [r for r in residues if 'sidechain' in r]
+    sidechain_ids = {}
+    if with_sidechain:
+        last_id = Sidechain.objects.select_for_update() \
+                                   .order_by('-id') \
+                                   .values_list('id', flat=True)[:1]
+        last_id = last_id[0] if last_id else 0
+        Sidechain.objects.bulk_create(
+            [Sidechain(**sidechain_values(r['aa'], r['sidechain']))
+             for r in with_sidechain],
+            batch_size=BULK_BATCH_SIZE)
+        ids = list(Sidechain.objects.filter(id__gt=last_id)
+                                    .order_by('id')
+                                    .values_list('id', flat=True))
+        if len(ids) != len(with_sidechain):
+            raise Exception('Sidechains were inserted by another import')
+        sidechain_ids = dict(zip([r['chainIndex'] for r in with_sidechain],
+                                 ids))
+
+    objects = []
+    for residue_props in residues:
+        residue = ResidueModel()
+        residue.protein = protein
+        residue.chain   = chain
+        residue.__dict__.update(residue_props)
+        residue.sidechain_id = sidechain_ids.get(residue_props['chainIndex'])
+        objects.append(residue)
+    ResidueModel.objects.bulk_create(objects, batch_size=BULK_BATCH_SIZE)
+
+
+def pdb_date_is_newer(imported_date, pdb_date):
+    """
+    Whether the date of a pdb file is newer than the date of the file the
+    protein was imported from.  Dates are compared to the second because the
+    database does not store microseconds.  Naive file dates are taken to be
+    in the default timezone, as they are when saved.
+    """
+    if imported_date is None:
         return True
+    pdb_date = pdb_date.replace(microsecond=0)
+    if timezone.is_aware(imported_date) and timezone.is_naive(pdb_date):
+        pdb_date = timezone.make_aware(pdb_date,
+                                       timezone.get_default_timezone())
+    return imported_date < pdb_date
+
 
-    data['pdb_date'] = pdb_date
-    return protein.pdb_date < pdb_date and str(protein.pdb_date) != str(pdb_date)[:19]
+def find_stale_pdbs(pdbs, pdb_dir='./pdb'):
+    """
+    Finds the proteins whose pdb file is newer than the data already in the
+    database.  The dates of all imported proteins are loaded with a single
+    query and the pdb directory is listed once, so that up-to-date proteins
+    never reach the worker pool.  Proteins without a pdb file may have an
+    mmCIF file instead.
+
+    pdb_date is set on each protein that has a pdb file.
+
+    @return tuple of lists (stale, up_to_date, missing)
+    """
+    imported_dates = dict(ProteinModel.objects.values_list('code', 'pdb_date'))
+    files = set(os.listdir(pdb_dir)) if os.path.isdir(pdb_dir) else set()
+
+    stale = []
+    up_to_date = []
+    missing = []
+    for data in pdbs:
+        code = data['code']
+        filename = atom_records.pdb_filename(code, files)
+        if filename is None:
+            missing.append(data)
+            continue
+
+        pdb_date = datetime.fromtimestamp(
+            os.path.getmtime(os.path.join(pdb_dir, filename)))
+        data['pdb_date'] = pdb_date
+        if code not in imported_dates or \
+                pdb_date_is_newer(imported_dates[code], pdb_date):
+            stale.append(data)
+        else:
+            up_to_date.append(data)
+
+    return stale, up_to_date, missing
+
+
+# residue names of the amino acids that are processed, compared against the
+# residue name field (columns 18-20) of ATOM and HETATM records.
+AMINO_ACIDS = frozenset(AA3to1)
 
 
 def amino_present(s):
     """
-    Whether a given line contains a valid amino acid.
-    
-    NB: "SEC" is a valid amino acid, regardless of its absence from
-    AA3to1.
+    Whether a given line contains a valid amino acid in its residue name
+    field.
 
     See #17223 for details.
     """
 
-    return any(amino in s for amino in AA3to1)
+    return s[17:20] in AMINO_ACIDS
 
 def hetatm_amino(s):
     """
@@ -379,11 +1089,41 @@ def atom_noamino(s):
     return s.startswith("ATOM ") and not amino_present(s)
 
 
-def parseWithBioPython(path, props, chains_filter=None):
+def filter_pdb(lines):
+    """
+    Discards the lines of a PDB file that have the bad HETATM pattern.  This
+    is largely for 2VQ1, see #8319 for details.  Also removes any ATOM lines
+    with invalid amino acids.  See #17223 for details.
+
+    @return the filtered file contents as a string
+    """
+    return ''.join(line for line in lines
+                   if not hetatm_amino(line) and not atom_noamino(line))
+
+
+def filter_records(records):
+    """
+    Discards the same atoms as filter_pdb from atoms read by atom_records:
+    HETATM amino acids and ATOM records that aren't amino acids.
+    """
+    amino = numpy.in1d(records['resname'], list(AMINO_ACIDS))
+    hetatm = records['hetatm']
+    return records[~(hetatm & amino) & ~(~hetatm & ~amino)]
+
+
+def parseWithBioPython(path, props, chains_filter=None, timings=None,
+                       invalid=None):
     """
-    Parse values from file that can be parsed using BioPython library
+    Parse values from file that can be parsed using BioPython library.
+    Files ending in .cif.gz are read as mmCIF.
+
+    @param timings: optional dict in which the time spent in each stage is
+                    recorded, see timing.py
+    @param invalid: optional dict in which invalid residues are counted by
+                    InvalidResidueException reason
     @return a dict containing the properties that were processed
     """
+    timer = StageTimer(timings)
 
     pdb = './pdb'
 
@@ -391,298 +1131,261 @@ def parseWithBioPython(path, props, chains_filter=None):
 
     chains = props['chains']
 
-    decompressed = NamedTemporaryFile()
-    gunzipped = GzipFile(full_path)
-
-    # Go through, one line at a time, and discard lines that have the bad
-    # HETATM pattern. This is largely for 2VQ1, see #8319 for details.
-    # Also remove any ATOM lines with invalid amino acids.
-    # See #17223 for details.
-    for line in gunzipped:
-	if not hetatm_amino(line) and not atom_noamino(line):
-            decompressed.write(line)
-
-    # Be kind; rewind.
-    decompressed.seek(0)
-
-    structure = Bio.PDB.PDBParser().get_structure('pdbname',
-                                                  decompressed.name)
+    if full_path.endswith('.cif.gz'):
+        # mmCIF files are streamed with the native parser.  DSSP only reads
+        # pdb files, so it is given the filtered atoms as pdb records.
+        records = filter_records(
+            atom_records.read_cif_records(GzipFile(full_path)))
+        contents = atom_records.format_records(records)
+        timer.mark('filter')
+        structure = None
+        model = atom_records.group_records(records)
+    else:
+        # Decompress and filter the file in one pass.  The structure is
+        # parsed from memory, only DSSP needs the filtered file on disk.
+        contents = filter_pdb(GzipFile(full_path))
+        timer.mark('filter')
+
+        # The native parser reads the atoms into arrays, see
+        # atom_records.py.  Bio.PDB is then only used if DSSP has to be run.
+        if settings.NATIVE_ATOM_PARSER:
+            structure = None
+            model = atom_records.read_model(contents)
+        else:
+            structure = Bio.PDB.PDBParser().get_structure(
+                'pdbname', StringIO(contents))[0]
+            model = atom_records.from_structure(structure)
+    timer.mark('parse')
 
     # dssp can't do multiple models. if we ever need to, we'll have to
-    # iterate through them
-    dssp = Bio.PDB.DSSP(model=structure[0], pdb_file=decompressed.name,
-                        dssp='dsspcmbi')
+    # iterate through them.  Results are cached by file contents.
+    dssp = dssp_cache.secondary_structure(structure, contents,
+                                          settings.DSSP_CACHE_DIR)
+    del structure
+    timer.mark('dssp')
 
     if not dssp.keys():
         raise Exception("No chains were parsed!")
 
-    for chain in structure[0]:
-        chain_id = chain.get_id()
+    for chain_id, chain in model.chains:
 
         # only process selected chains
         if chains_filter and not chain_id in chains_filter:
-            print 'Skipping Chain: %s' % chain_id
+            logger.debug('Skipping chain: %s', chain_id)
+            continue
+
+        # chain ids from mmCIF files may be longer than Chain.code allows.
+        # Their atoms are not in the pdb records given to DSSP either, so the
+        # chain is left out and its residues are counted as invalid.
+        if len(chain_id) > 1:
+            logger.debug('Skipping chain with long id: %s', chain_id)
+            if invalid is not None:
+                invalid['chain_id'] = invalid.get('chain_id', 0) + len(chain)
             continue
 
         # construct structure for saving chain
         if not chain_id in props['chains']:
             residues = {}
             props['chains'][chain_id] = residues
-            print 'PROCESSING CHAIN [%s]' % chain, len(chain)
-
-        newID = 0
-
-        #iterate residues
-        res_old_id = None
-        oldN       = None
-        oldCA      = None
-        oldC       = None
-        prev       = None
-
-        for res in chain:
+            logger.debug('Processing chain %s: %s residues', chain_id,
+                         len(chain))
+
+        # 1) find the residues that can be processed.  Their position in the
+        #    chain is kept so breaks caused by invalid residues can be found.
+        positions = []
+        valid = []
+        for position, res in enumerate(chain):
             try:
-                newID += 1
-                terminal = False
-                hetflag, res_id, icode = res.get_id()
-
-                # We can't handle any hetflags. This is primarily to filter
-                # out water, but there can be others as well.
-                if hetflag != ' ':
-                    raise InvalidResidueException("HetCode %r" % hetflag)
-
-                resname = res.resname
-
-                # We can't deal with residues that aren't of amino acids.
-                if resname not in AA3to1:
-                    raise InvalidResidueException("Bad amino acid %r" %
-                                                  resname)
-
-                # XXX Get the dictionary of atoms in the Main conformation.
-                # BioPython should do this automatically, but it does not
-                # always choose the main conformation.  Leading to some
-                # Interesting results
-                atoms = {}
-                for atom in res.get_unpacked_list():
-                    if atom.get_altloc() in ('A', ' '):
-                        atoms[atom.name] = atom
-
-                # Exclude water residues
-                # Exclude any Residues that are missing _ANY_ of the
-                #     mainchain atoms.  Any atom could be missing
-                all_mainchain = ('N' in atoms) and ('CA' in atoms) and ('C' in atoms) and ('O' in atoms)
-                if not all_mainchain:
-                    raise InvalidResidueException("Missing atom")
-
-                # Create dictionary structure and initialize all values.  All
-                # Values are required.  Values that are not filled in will retain
-                # the NO_VALUE value.
-                #
-                # Store residue properties using OLD_ID as the key to ensure it is
-                # unique.  We're including residues from all chains in the same
-                # dictionary and chainindex may have duplicates.
-                old_id = res_id if icode == ' ' else '%s%s' % (res_id, icode)
-                if old_id in residues:
-                    res_dict = residues[old_id]
-                else:
-                    # This residue doesn't exist yet.
-                    res_dict = {}
-                    residues[old_id] = res_dict
-                    res_dict['oldID'] = old_id
-
-                initialize_all_geometry(res_dict)
-
-                # Get Properties from DSSP and other per residue properties
-                chain = res.get_parent().get_id()
-                key = chain, (hetflag, res_id, icode)
-                if key in dssp:
-                    (residue_dssp, secondary_structure, accessibility,
-                     relative_accessibility, phi, psi) = dssp[key]
-                else:
-                    raise InvalidResidueException("Key %r not in DSSP" %
-                                                  (key,))
-
-                res_dict['chain'] = chain
-                res_dict['ss'] = secondary_structure
-                res_dict['aa'] = AA3to1[resname]
-                res_dict['h_bond_energy'] = 0.00
-
-                # Get Vectors for mainchain atoms and calculate geometric angles,
-                # dihedral angles, and lengths between them.
-                N    = atoms['N'].get_vector()
-                CA   = atoms['CA'].get_vector()
-                C    = atoms['C'].get_vector()
-                CB   = atoms['CB'].get_vector() if "CB" in atoms else None
-                O    = atoms['O'].get_vector()
-
-                if oldC:
-                    # determine if there are missing residues by calculating
-                    # the distance between the current residue and previous
-                    # residue.  If the L1 distance is greater than 2.5 it
-                    # cannot possibly be the correct order of residues.
-                    L1 = calc_distance(oldC,N)
-
-                    if L1 < 2.5:
-                        # properties that span residues
-                        residues[res_old_id]['a6'] = calc_angle(oldCA,oldC,N)
-                        residues[res_old_id]['a7'] = calc_angle(oldO,oldC,N)
-                        residues[res_old_id]['psi'] = calc_dihedral(oldN,oldCA,oldC,N)
-                        residues[res_old_id]['ome'] = calc_dihedral(oldCA,oldC,N,CA)
-                        residues[res_old_id]['next'] = newID
-                        res_dict['prev'] = residues[res_old_id]['chainIndex']
-                        res_dict['a1']     = calc_angle(oldC,N,CA)
-                        res_dict['phi']    = calc_dihedral(oldC,N,CA,C)
-                        res_dict['L1'] = L1
-
-                        # proline has omega-p property
-                        if prev and resname == 'PRO' and 'CD' in atoms:
-                            CD = atoms['CD'].get_vector()
-                            res_dict['omep'] = calc_dihedral(oldCA, oldC, N, CD)
-
-                        terminal = False
-
-                if terminal:
-                    # break in the chain,
-                    # 1) add terminal flags to both ends of the break so
-                    #    the break can quickly be found.
-                    # 2) skip a number in the new style index.  This allows
-                    #    the break to be visible without checking the
-                    #    terminal flag
-                    newID += 1
-                    res_dict['terminal_flag'] = True
-                    residues[res_old_id]['terminal_flag'] = True
-
-                # newID cannot be set until after we determine if it is terminal
-                res_dict['chainIndex'] = newID
-
-                res_dict['L2'] = calc_distance(N,CA)
-                res_dict['L4'] = calc_distance(CA,C)
-                res_dict['L5'] = calc_distance(C,O)
-                res_dict['a3'] = calc_angle(N,CA,C)
-                res_dict['a5'] = calc_angle(CA,C,O)
-
-                if CB:
-                    res_dict['a2'] = calc_angle(N,CA,CB)
-                    res_dict['a4'] = calc_angle(CB,CA,C)
-                    res_dict['L3'] = calc_distance(CA,CB)
-                    res_dict['zeta'] = calc_dihedral(CA, N, C, CB)
-
-                # Calculate Bg - bfactor of the 4th atom in Chi1.
-                try:
-                    atom_name = CHI_MAP[resname][0][3]
-                    res_dict['bg'] = res[atom_name].get_bfactor()
-                except KeyError:
-                    # not all residues have chi
-                    pass
-
-
-                # Other B Averages
-                #    Bm - Average of bfactors in main chain.
-                #    Bm - Average of bfactors in side chain.
-                main_chain = []
-                side_chain = []
-                for name in atoms:
-                    if name in ('N', 'CA', 'C', 'O','OXT'):
-                        main_chain.append(atoms[name].get_bfactor())
-                    elif name in ('H'):
-                        continue
-                    else:
-                        side_chain.append(atoms[name].get_bfactor())
-
-                if main_chain != []:
-                    res_dict['bm'] = sum(main_chain) // len(main_chain)
-
-                if side_chain != []:
-                    res_dict['bs'] = sum(side_chain) // len(side_chain)
-
-
-                # CHI corrections - Some atoms have symettrical values
-                # in the sidechain that aren't guarunteed to be listed
-                # in the correct order by within the PDB file.  The correct order can be
-                # determined by checking for the larger of two Chi values.  If the 2nd value
-                # listed in CHI_CORRECTIONS_TESTS is larger, then corrections are needed. There
-                # may be multiple corrections per Residue which are listed in CHI_CORRECTIONS.
-                # each pair of atoms will be swapped so that any future calculation will use
-                # the correct values.
-                #
-                # Both angles are required to determine whether atoms are labeled correctly.
-                # If only one angle is present then we check to see if it is less than 90
-                # degrees.  if it is less than 90 degress then it is considered ChiN-1
-                # See: Ticket #1545 for more details.
-                if resname in CHI_CORRECTIONS_TESTS:
-                    values = calc_chi(atoms, prev, CHI_CORRECTIONS_TESTS[resname])
-                    correct = False
-                    if not len(values):
-                        for atom1, atom2 in CHI_CORRECTIONS[resname]:
-                            if atom1 in atoms: del atoms[atom1]
-                            if atom2 in atoms: del atoms[atom2]
-
-                    elif len(values) == 1:
-                        if 'chi1' in values and abs(values['chi1']) > 90:
-                            correct = True
-                        elif 'chi2' in values and abs(values['chi2']) < 90:
-                            correct = True
-
-                    elif abs(values['chi2']) < abs(values['chi1']):
-                        correct = True
-
-                    if correct:
-                        for atom1, atom2 in CHI_CORRECTIONS[resname]:
-                            old_atom1 = atoms.get(atom1)
-                            old_atom2 = atoms.get(atom2)
-                            if old_atom1:
-                                atoms[atom2] = old_atom1
-                            else:
-                                # del atoms[atom2]
-                                atoms.pop(atom2, None)
-                            if old_atom2:
-                                atoms[atom1] = old_atom2
-                            else:
-                                # del atoms[atom1]
-                                atoms.pop(atom1, None)
-
-
-                #Calculate CHI values.  The mappings for per peptide chi's are stored
-                #in a separate file and a function is used to calculate the chi based
-                #based on the peptide of this residue and the lists of atoms in the
-                #chi mappings.
-                if resname in CHI_MAP:
-                    res_dict.update(calc_chi(atoms, prev, CHI_MAP[resname]))
-                sidechain = {}
-                if resname in bond_lengths:
-                    calc_sidechain_lengths(atoms, sidechain, bond_lengths[resname])
-                if resname in bond_angles:
-                    calc_sidechain_angles(atoms, prev, sidechain, bond_angles[resname])
-                if sidechain:
-                    res_dict['sidechain'] = sidechain
-
-                # Reset for next pass.  We save some relationships which span two atoms.
-                res_old_id = old_id
-                oldN       = N
-                oldCA      = CA
-                oldC       = C
-                oldO       = O
-                prev = res
+                valid.append(validate_residue(chain_id, res, dssp))
+                positions.append(position)
 
             except InvalidResidueException, e:
                 # something has gone wrong in the current residue
                 # indicating that it should be excluded from processing
-                # log a warning
-                print 'Invalid residue! protein: %s chain: %s residue: %s exception: %s' % (path, chain_id, res.get_id(), e)
-                if oldC:
-                    residues[res_old_id]['terminal_flag'] = True
-                    newID += 1
-                oldN       = None
-                oldCA      = None
-                oldC       = None
-                prev       = None
-                if res_id in residues:
-                    del residues[res_id]
-
-        print 'Processed %s residues' % len(residues)
+                # it is counted by reason in the telemetry of the import
+                logger.debug('Invalid residue! protein: %s chain: %s '
+                             'residue: %s exception: %s',
+                             path, chain_id, res.id, e)
+                if invalid is not None:
+                    invalid[e.reason] = invalid.get(e.reason, 0) + 1
+        timer.mark('residues')
+
+        if not valid:
+            logger.debug('Processed %s residues', len(residues))
+            continue
+
+        # 2) determine chain indexes and breaks, then calculate geometric
+        #    angles, dihedral angles, and lengths between mainchain atoms for
+        #    the whole chain at once.  Missing residues are detected through
+        #    the distance between a residue and the previous residue.  If the
+        #    L1 distance is greater than 2.5 it cannot possibly be the correct
+        #    order of residues.
+        #
+        #    NB: only invalid residues mark a break with terminal flags and a
+        #    skipped chain index, residues separated by a long L1 are just
+        #    left unlinked.
+        chain_index, contiguous, terminal = chain_layout(positions, len(chain))
+        atom_dicts = [atoms for res, atoms, ss in valid]
+        geometry = backbone_geometry(
+            coordinates(atom_dicts, 'N', model.coord),
+            coordinates(atom_dicts, 'CA', model.coord),
+            coordinates(atom_dicts, 'C', model.coord),
+            coordinates(atom_dicts, 'O', model.coord),
+            coordinates(atom_dicts, 'CB', model.coord),
+            coordinates(atom_dicts, 'CD', model.coord),
+            contiguous,
+            numpy.array([res.resname == 'PRO' for res, atoms, ss in valid]))
+        res_dicts = []
+        timer.mark('backbone')
+
+        # 3) Create dictionary structure and initialize all values.  All
+        #    Values are required.  Values that are not filled in will retain
+        #    the NO_VALUE value.
+        for i, (res, atoms, secondary_structure) in enumerate(valid):
+            hetflag, res_id, icode = res.id
+            resname = res.resname
+
+            # Store residue properties using OLD_ID as the key to ensure it is
+            # unique.  We're including residues from all chains in the same
+            # dictionary and chainindex may have duplicates.
+            old_id = res_id if icode == ' ' else '%s%s' % (res_id, icode)
+            if old_id in residues:
+                res_dict = residues[old_id]
+            else:
+                # This residue doesn't exist yet.
+                res_dict = {}
+                residues[old_id] = res_dict
+                res_dict['oldID'] = old_id
+
+            initialize_all_geometry(res_dict)
+
+            res_dict['chain'] = chain_id
+            res_dict['ss'] = secondary_structure
+            res_dict['aa'] = AA3to1[resname]
+            res_dict['h_bond_energy'] = 0.00
+            res_dict['chainIndex'] = int(chain_index[i])
+
+            if terminal[i]:
+                # the next residue is invalid, flag the break so it can
+                # quickly be found.
+                res_dict['terminal_flag'] = True
+
+            for field in BACKBONE_FIELDS:
+                value = geometry[field][i]
+                if not numpy.isnan(value):
+                    res_dict[field] = float(value)
+
+            # Calculate Bg - bfactor of the 4th atom in Chi1.
+            try:
+                atom_name = CHI_MAP[resname][0][3]
+                res_dict['bg'] = float(model.bfactor[res.selected[atom_name]])
+            except KeyError:
+                # not all residues have chi
+                pass
+
+
+            # Other B Averages
+            #    Bm - Average of bfactors in main chain.
+            #    Bm - Average of bfactors in side chain.
+            main_chain = []
+            side_chain = []
+            for name in atoms:
+                if name in ('N', 'CA', 'C', 'O','OXT'):
+                    main_chain.append(float(model.bfactor[atoms[name]]))
+                elif name in ('H'):
+                    continue
+                else:
+                    side_chain.append(float(model.bfactor[atoms[name]]))
+
+            if main_chain != []:
+                res_dict['bm'] = sum(main_chain) // len(main_chain)
+
+            if side_chain != []:
+                res_dict['bs'] = sum(side_chain) // len(side_chain)
+
+            res_dicts.append(res_dict)
+        timer.mark('residues')
+
+        # 4) Calculate CHI values and sidechain lengths and angles.  Residues
+        #    are grouped by type so that all residues of one type are
+        #    processed at once using the precompiled atom table of the type.
+        #    The tables also apply CHI corrections, symmetrical atoms that
+        #    aren't guaranteed to be listed in the correct order are swapped
+        #    before any values are calculated.  See chi.py and Ticket #1545.
+        by_type = {}
+        for i, (res, atoms, secondary_structure) in enumerate(valid):
+            by_type.setdefault(res.resname, []).append(i)
+
+        for resname, indexes in by_type.items():
+            if resname not in SIDECHAIN_TABLES:
+                continue
+            chi, sidechain = SIDECHAIN_TABLES[resname].calculate(
+                [valid[i][1] for i in indexes],
+                [valid[i-1][0].selected if contiguous[i] else None
+                 for i in indexes],
+                model.coord)
+
+            for j, i in enumerate(indexes):
+                res_dict = res_dicts[i]
+                for name, values in chi.items():
+                    if not numpy.isnan(values[j]):
+                        res_dict[name] = float(values[j])
+                res_sidechain = {}
+                for name, values in sidechain.items():
+                    if not numpy.isnan(values[j]):
+                        res_sidechain[name] = float(values[j])
+                if res_sidechain:
+                    res_dict['sidechain'] = res_sidechain
+        timer.mark('sidechain')
+
+        logger.debug('Processed %s residues', len(residues))
 
     return props
 
 
+def validate_residue(chain_id, res, dssp):
+    """
+    Checks that a residue can be processed and collects its atoms.
+
+    @param res: atom_records.Residue
+    @param dssp: dict of secondary structure, see dssp_cache
+    @return tuple of (residue, atoms, secondary structure)
+    @raises InvalidResidueException if the residue must be excluded
+    """
+    hetflag, res_id, icode = res.id
+
+    # We can't handle any hetflags. This is primarily to filter
+    # out water, but there can be others as well.
+    if hetflag != ' ':
+        raise InvalidResidueException("HetCode %r" % hetflag, 'hetatm')
+
+    resname = res.resname
+
+    # We can't deal with residues that aren't of amino acids.
+    if resname not in AA3to1:
+        raise InvalidResidueException("Bad amino acid %r" % resname,
+                                      'amino_acid')
+
+    # XXX Use the atoms in the Main conformation.  BioPython's selected
+    # atoms do not always belong to the main conformation.  Leading to some
+    # Interesting results
+    atoms = res.atoms
+
+    # Exclude water residues
+    # Exclude any Residues that are missing _ANY_ of the
+    #     mainchain atoms.  Any atom could be missing
+    all_mainchain = ('N' in atoms) and ('CA' in atoms) and ('C' in atoms) and ('O' in atoms)
+    if not all_mainchain:
+        raise InvalidResidueException("Missing atom", 'missing_atom')
+
+    # Get Properties from DSSP and other per residue properties
+    key = chain_id, (hetflag, res_id, icode)
+    if key not in dssp:
+        raise InvalidResidueException("Key %r not in DSSP" % (key,), 'dssp')
+
+    return res, atoms, dssp[key]
+
+
 def initialize_geometry(residue, geometry_list):
     """
     Initialize the dictionary for geometry data
@@ -707,112 +1410,23 @@ def initialize_all_geometry(residue):
     initialize_geometry(residue, dihedral_list)
 
 
-def calc_distance(atom1, atom2):
+def protein_args(args):
     """
-    Calculates distance between atoms because this is not built into BIOPython
+    Protein dict as passed to ProcessPDBTask.work from the values of a
+    protein on the command line or a line of a selection file:
 
-    scribed from http://www.scribd.com/doc/9816032/BioPython-for-Bioinfo
-    """
-    dx = atom1[0] - atom2[0]
-    dy = atom1[1] - atom2[1]
-    dz = atom1[2] - atom2[2]
-    return sqrt(dx*dx + dy*dy + dz*dz)
+        code chains threshold resolution rfactor rfree
 
-
-def calc_angle(atom1, atom2, atom3):
-    """
-    overridding pdb version of function to return values converted to degress
+    Chains are a string of chain ids.  Raises IndexError when a value is
+    missing and ValueError when a number is invalid.
     """
-    return degrees(pdb_calc_angle(atom1, atom2, atom3))
-
-
-def calc_dihedral(atom1, atom2, atom3, atom4):
-    """
-    overridding pdb version of function to return values converted to degress
-    """
-    return degrees(pdb_calc_dihedral(atom1, atom2, atom3, atom4))
-
-
-def calc_chi(residue, residue_prev, mapping):
-    """
-    Calculates Values for CHI using the predefined list of CHI angles in
-    the CHI_MAP.  CHI_MAP contains the list of all peptides and the atoms
-    that make up their different chi values.  This function will process
-    the values known to exist, it will also skip chi values if some of the
-    atoms are missing
-
-    @param mapping: list of mappings to use
-    """
-    residue_dict = {}
-    try:
-        for i in range(len(mapping)):
-            chi_atom_names= mapping[i]
-            try:
-                chi_atoms = []
-                for n in chi_atom_names:
-                    if residue_prev and n[-2:]=='-1':
-                        chi_atoms.append(residue_prev[n[:-2]].get_vector())
-                    else:
-                        chi_atoms.append(residue[n].get_vector())
-                chi = calc_dihedral(*chi_atoms)
-                residue_dict['chi%i'%(i+1)] = chi
-            except KeyError:
-                #missing an atom
-                continue
-
-    except KeyError:
-        # this residue type does not have chi
-        pass
-    return residue_dict
-
-
-def calc_sidechain_lengths(residue, residue_dict, mapping):
-    """
-    Calculates Values for sidechain bond lengths. Uses a predefined list
-    from sidechain.py, specifically bond_lengths.
-    """
-    try:
-        for i in range(len(mapping)):
-            atom_names = mapping[i]
-            try:
-                sidechain_atoms = [residue[n].get_vector() for n in atom_names]
-                sidechain_length = calc_distance(*sidechain_atoms)
-                residue_dict['%s_%s' % (atom_names[0], atom_names[1])] = sidechain_length
-            except KeyError:
-                #missing an atom
-                continue
-
-    except KeyError:
-        # this residue type does not have sidechain lengths
-        pass
-
-
-def calc_sidechain_angles(residue, residue_prev, residue_dict, mapping):
-    """
-    Calculates Values for sidechain bond angles. Uses a predefined list
-    from sidechain.py, specifically bond_angles.
-    """
-    try:
-        for i in range(len(mapping)):
-            atom_names = mapping[i]
-            try:
-                sidechain_atoms = []
-                for n in atom_names:
-                    if residue_prev and n[-2:]=='-1':
-                        sidechain_atoms.append(residue_prev[n[:-2]].get_vector())
-                    else:
-                        sidechain_atoms.append(residue[n].get_vector())
-                sidechain_angle = calc_angle(*sidechain_atoms)
-                angle_key = '%s_%s_%s' % (atom_names[0], atom_names[1], atom_names[2])
-                angle_key = angle_key.replace('-','_')
-                residue_dict[angle_key] = sidechain_angle
-            except KeyError:
-                #missing an atom
-                continue
-
-    except KeyError:
-        # this residue type does not have sidechain angles
-        pass
+    return {'code':args[0],
+            'chains':[c for c in args[1]],
+            'threshold':float(args[2]),
+            'resolution':float(args[3]),
+            'rfactor':float(args[4]),
+            'rfree':float(args[5])
+            }
 
 
 if __name__ == '__main__':
@@ -821,15 +1435,6 @@ if __name__ == '__main__':
     """
     import logging
 
-    def process_args(args):
-        return {'code':args[0],
-                'chains':[c for c in args[1]],
-                'threshold':float(args[2]),
-                'resolution':float(args[3]),
-                'rfactor':float(args[4]),
-                'rfree':float(args[5])
-                }
-
     task = ProcessPDBTask()
 
     logging.basicConfig(filename='ProcessPDB.log',level=logging.DEBUG)
@@ -837,29 +1442,74 @@ if __name__ == '__main__':
     #task.parent = WorkerProxy()
 
     pdbs = []
+    options = {}
 
     argv = sys.argv
+    if '--bulk' in argv:
+        argv.remove('--bulk')
+        options['bulk'] = True
+    if '--load-from-cache' in argv:
+        argv.remove('--load-from-cache')
+        options['load_from_cache'] = True
+    if '--resume' in argv:
+        argv.remove('--resume')
+        options['resume'] = True
+    if '--diff' in argv:
+        argv.remove('--diff')
+        options['diff'] = True
+    for arg in argv[1:]:
+        if arg.startswith('--status='):
+            argv.remove(arg)
+            options['status_file'] = arg[9:]
+        elif arg.startswith('--event-log='):
+            argv.remove(arg)
+            options['log_file'] = arg[12:]
+        elif arg.startswith('--journal='):
+            argv.remove(arg)
+            options['journal'] = arg[10:]
+    for arg in argv[1:]:
+        if arg.startswith('--writers='):
+            argv.remove(arg)
+            options['writers'] = int(arg[10:])
+        elif arg.startswith('--commit-size='):
+            argv.remove(arg)
+            options['commit_size'] = int(arg[14:])
+
     if len(argv) == 1:
         print 'Usage:'
-        print '   ProcessPDBTask code chains threshold resolution rfactor rfree [repeat]'
+        print '   ProcessPDBTask [options] code chains threshold resolution rfactor rfree [repeat]'
         print '       chains are a string of chain ids: ABCXYZ'
         print ''
-        print '   <cmd> | ProcessPDBTask --pipein'
+        print '   <cmd> | ProcessPDBTask [options] --pipein'
         print '   piped protein values must be separated by newlines'
+        print ''
+        print 'Options:'
+        print '   --bulk  insert residues with batched statements.  Existing'
+        print '           residues of each imported protein are replaced.'
+        print '   --diff  update only the residues and fields that changed since'
+        print '           the previous import of each protein.'
+        print '   --writers=N  number of processes saving proteins (default %s)' % WRITERS
+        print '   --commit-size=N  proteins saved per transaction (default %s)' % COMMIT_SIZE
+        print '   --load-from-cache  rebuild from parsed proteins in PARSE_CACHE_DIR'
+        print '           without reading pdb files.'
+        print '   --status=FILE  JSON status file (default %s)' % STATUS_FILE
+        print '   --event-log=FILE  log each import event as a line of JSON'
+        print '   --journal=FILE  journal of imported proteins (default %s)' % JOURNAL_FILE
+        print '   --resume  skip proteins recorded in the journal'
         sys.exit(0)
 
     elif len(argv) == 2 and argv[1] == '--pipein':
         for line in sys.stdin:
-            pdbs.append(process_args(line.split(' ')))
+            pdbs.append(protein_args(line.split(' ')))
 
     else:
         for i in range(1,len(argv),6):
             try:
                 print argv[i:i+6]
-                pdbs.append(process_args(argv[i:i+6]))
+                pdbs.append(protein_args(argv[i:i+6]))
             except IndexError, e:
                 print e
                 print 'Usage: ProcessPDBTask.py code chain threshold resolution rfactor rfree...'
                 sys.exit(0)
 
-    task.work(**{'data':pdbs})
+    task.work(data=pdbs, **options)
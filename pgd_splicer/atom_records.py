@@ -0,0 +1,376 @@
+"""
+Native reader of the atoms of pdb and mmCIF files.
+
+Bio.PDB builds a Structure/Model/Chain/Residue/Atom object graph for every
+file, which is slow and takes a lot of memory for large entries.  The
+splicer only needs the coordinates and B-factors of the atoms of each
+residue, so the fixed columns of the coordinate records are read straight
+into a structured array instead and residues refer to atoms by row.
+
+Residues and atoms are grouped the way Bio.PDB.PDBParser groups them:
+
+    * only the first model is read
+    * a new residue starts whenever the chain, residue id or residue name
+      changes.  Atoms of a standard residue that is defined again are added
+      to it, a redefinition with another residue name (a point mutation)
+      replaces it, as Bio.PDB selects the last residue name.
+    * an atom with a blank altloc whose name is already used in the residue
+      is ignored
+    * the selected atom of each name is the one with the highest occupancy,
+      the first one on ties
+
+mmCIF files are streamed: only the columns of the _atom_site loop that are
+needed are kept, and reading stops after the first model.  The author
+chain, residue and atom names are used, which are the names used in pdb
+files.
+
+The same structures can be built from a Bio.PDB model with from_structure,
+so the rest of the splicer does not depend on the parser that was used.
+"""
+
+from collections import namedtuple
+import os
+import re
+
+import numpy
+
+# names of the files a protein may be stored in, in order of preference
+PDB_FILENAME = 'pdb%s.ent.gz'
+CIF_FILENAME = '%s.cif.gz'
+
+NAN = float('nan')
+
+# fixed columns of a coordinate record, padded to 80 characters
+LINE_DTYPE = numpy.dtype([('record', 'S6'), ('serial', 'S5'), ('pad1', 'S1'),
+                          ('name', 'S4'), ('altloc', 'S1'),
+                          ('resname', 'S3'), ('pad2', 'S1'), ('chain', 'S1'),
+                          ('resseq', 'S4'), ('icode', 'S1'), ('pad3', 'S3'),
+                          ('x', 'S8'), ('y', 'S8'), ('z', 'S8'),
+                          ('occupancy', 'S6'), ('bfactor', 'S6'),
+                          ('rest', 'S14')])
+
+# atoms as read by read_records.  Coordinates are single precision like the
+# coordinates of Bio.PDB atoms, missing occupancies are NaN and missing
+# B-factors are 0.
+ATOM_DTYPE = numpy.dtype([('hetatm', bool), ('chain', 'S4'), ('resseq', 'i4'),
+                          ('icode', 'S1'), ('resname', 'S5'), ('name', 'S4'),
+                          ('altloc', 'S1'), ('coord', 'f4', 3),
+                          ('occupancy', 'f8'), ('bfactor', 'f8')])
+
+# A residue of a Model.
+#   id - (hetflag, resseq, icode) as used by Bio.PDB and DSSP
+#   atoms - dict mapping atom name to row for atoms with altloc 'A' or ' '
+#   selected - dict mapping atom name to the row of the selected atom
+Residue = namedtuple('Residue', 'id resname atoms selected')
+
+
+class Model(object):
+    """
+    Atoms of the first model of a pdb file
+
+    @param coord: (n, 3) array of atom coordinates
+    @param bfactor: array of atom B-factors
+    @param chains: list of (chain id, list of Residues) in file order
+    """
+
+    def __init__(self, coord, bfactor, chains):
+        self.coord = coord
+        self.bfactor = bfactor
+        self.chains = chains
+
+
+def pdb_filename(code, files):
+    """
+    Name of the file of a protein, the pdb file if there is one.
+
+    @param files: set of the names of the files in the pdb directory
+    @return file name, or None if there is no file for the protein
+    """
+    for pattern in (PDB_FILENAME, CIF_FILENAME):
+        filename = pattern % code.lower()
+        if filename in files:
+            return filename
+    return None
+
+
+def pdb_path(code, pdb_dir='./pdb'):
+    """
+    Path of the file of a protein, or None if there is no file for it
+    """
+    for pattern in (PDB_FILENAME, CIF_FILENAME):
+        path = os.path.join(pdb_dir, pattern % code.lower())
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _floats(column, default):
+    values = numpy.char.strip(column)
+    values[values == ''] = default
+    return values.astype('f8')
+
+
+def read_records(contents):
+    """
+    Reads the ATOM and HETATM records of the first model
+
+    @param contents: pdb file contents
+    @return structured array of ATOM_DTYPE
+    """
+    lines = []
+    for line in contents.split('\n'):
+        record = line[:6]
+        if record == 'ATOM  ' or record == 'HETATM':
+            lines.append('%-80.80s' % line)
+        elif lines and record in ('MODEL ', 'ENDMDL', 'END   ', 'CONECT'):
+            break
+
+    raw = numpy.frombuffer(''.join(lines), LINE_DTYPE)
+    records = numpy.zeros(len(raw), ATOM_DTYPE)
+    records['hetatm'] = raw['record'] == 'HETATM'
+    for name in ('chain', 'icode', 'resname', 'name', 'altloc'):
+        records[name] = raw[name]
+    records['resseq'] = numpy.char.strip(raw['resseq']).astype(int)
+    for i, axis in enumerate('xyz'):
+        records['coord'][:, i] = raw[axis].astype('f8')
+    records['occupancy'] = _floats(raw['occupancy'], NAN)
+    records['bfactor'] = _floats(raw['bfactor'], 0)
+    return records
+
+
+def hetflag(hetatm, resname):
+    if not hetatm:
+        return ' '
+    if resname in ('HOH', 'WAT'):
+        return 'W'
+    return 'H_%s' % resname
+
+
+def atom_name(fullname):
+    # names containing spaces are kept as they are, like Bio.PDB does
+    split = fullname.split()
+    return split[0] if len(split) == 1 else fullname
+
+
+# mmCIF columns read by read_cif_records, with the ATOM_DTYPE field they
+# fill.  Author names are used where present, as in pdb files.
+CIF_COLUMNS = (('group_PDB', 'hetatm'),
+               ('auth_asym_id', 'chain'), ('label_asym_id', 'chain'),
+               ('auth_seq_id', 'resseq'), ('label_seq_id', 'resseq'),
+               ('pdbx_PDB_ins_code', 'icode'),
+               ('auth_comp_id', 'resname'), ('label_comp_id', 'resname'),
+               ('auth_atom_id', 'name'), ('label_atom_id', 'name'),
+               ('label_alt_id', 'altloc'),
+               ('Cartn_x', 'x'), ('Cartn_y', 'y'), ('Cartn_z', 'z'),
+               ('occupancy', 'occupancy'), ('B_iso_or_equiv', 'bfactor'),
+               ('pdbx_PDB_model_num', 'model'))
+
+# a quoted or a plain mmCIF token.  Quotes only end a token when followed by
+# whitespace, so names like O5' need no quoting.
+CIF_TOKEN = re.compile(r"""'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(\S+)""")
+
+
+def cif_tokens(line):
+    if '"' not in line and "'" not in line:
+        return line.split()
+    return [single or double or plain for single, double, plain
+            in CIF_TOKEN.findall(line)]
+
+
+def cif_rows(line, lines, width):
+    """
+    Yields the rows of a loop, starting with line.  A row may span several
+    lines and a line may hold several rows.
+    """
+    tokens = []
+    while line is not None:
+        if line.startswith('#') or line.startswith('_') or \
+                line.startswith('loop_') or line.startswith('data_'):
+            return
+        tokens.extend(cif_tokens(line))
+        while len(tokens) >= width:
+            yield tokens[:width]
+            tokens = tokens[width:]
+        line = next(lines, None)
+
+
+def read_cif_records(lines):
+    """
+    Reads the atoms of the first model from the _atom_site loop of an
+    mmCIF file.  Lines are read until the end of the first model.
+
+    @param lines: iterable of the lines of the file
+    @return structured array of ATOM_DTYPE
+    """
+    lines = iter(lines)
+    header = []
+    for line in lines:
+        if line.startswith('_atom_site.'):
+            header.append(line.strip()[11:])
+        elif header:
+            break
+    else:
+        return numpy.zeros(0, ATOM_DTYPE)
+
+    # the first listed of the columns filling a field is used
+    columns = {}
+    for name, field in CIF_COLUMNS:
+        if name in header and field not in columns:
+            columns[field] = header.index(name)
+    values = dict((field, []) for field in columns)
+    model = None
+    for row in cif_rows(line, lines, len(header)):
+        if 'model' in columns:
+            if model is None:
+                model = row[columns['model']]
+            elif row[columns['model']] != model:
+                break
+        for field, column in columns.items():
+            values[field].append(row[column])
+
+    records = numpy.zeros(len(values['x']), ATOM_DTYPE)
+    if 'hetatm' in values:
+        records['hetatm'] = numpy.array(values['hetatm']) == 'HETATM'
+    for field, default, cast in (('chain', ' ', str), ('icode', ' ', str),
+                                 ('resname', '', str), ('name', '', str),
+                                 ('altloc', ' ', str), ('resseq', 0, int),
+                                 ('occupancy', NAN, float),
+                                 ('bfactor', 0, float)):
+        if field in values:
+            # '.' and '?' mark missing values
+            records[field] = [default if value in ('.', '?') else cast(value)
+                              for value in values[field]]
+        else:
+            records[field] = default
+    for i, axis in enumerate('xyz'):
+        records['coord'][:, i] = numpy.array(values[axis], 'f8')
+    return records
+
+
+def format_records(records):
+    """
+    Writes atoms as the ATOM and HETATM records of a pdb file, e.g. for
+    programs that only read pdb files.  Atoms of chains or residues with
+    longer names, or of residues with larger numbers, than a pdb file allows
+    are left out rather than truncated.
+    """
+    lines = []
+    for serial, atom in enumerate(records.tolist()):
+        hetatm, chain, resseq, icode, resname, name, altloc, coord, \
+            occupancy, bfactor = atom
+        if len(chain) > 1 or len(resname) > 3 or not -999 <= resseq <= 9999:
+            continue
+        if len(name) < 4:
+            name = ' %s' % name
+        lines.append('%-6s%5d %-4s%1s%3s %1s%4d%1s   %8.3f%8.3f%8.3f%6.2f%6.2f\n'
+                     % ('HETATM' if hetatm else 'ATOM', (serial + 1) % 100000,
+                        name, altloc, resname, chain, resseq, icode,
+                        coord[0], coord[1], coord[2],
+                        0 if numpy.isnan(occupancy) else occupancy, bfactor))
+    return ''.join(lines)
+
+
+def read_model(contents):
+    """
+    Reads the atoms of the first model and groups them into chains and
+    residues.
+
+    @return Model
+    """
+    return group_records(read_records(contents))
+
+
+def group_records(records):
+    """
+    Groups atoms into chains and residues
+
+    @param records: structured array of ATOM_DTYPE
+    @return Model
+    """
+    chain_ids = records['chain'].tolist()
+    hetatms = records['hetatm'].tolist()
+    resseqs = records['resseq'].tolist()
+    icodes = records['icode'].tolist()
+    resnames = records['resname'].tolist()
+    names = records['name'].tolist()
+    altlocs = records['altloc'].tolist()
+    occupancy = records['occupancy']
+
+    chains = {}
+    order = []
+    positions = {}
+    current = None
+    residue = None
+    for row in xrange(len(records)):
+        chain_id = chain_ids[row]
+        resname = resnames[row]
+        res_id = (hetflag(hetatms[row], resname), resseqs[row], icodes[row])
+        if (chain_id, res_id, resname) != current:
+            current = (chain_id, res_id, resname)
+            if chain_id not in chains:
+                chains[chain_id] = []
+                order.append(chain_id)
+            residues = chains[chain_id]
+            position = positions.get((chain_id, res_id))
+            if position is None:
+                residue = Residue(res_id, resname, {}, {})
+                positions[(chain_id, res_id)] = len(residues)
+                residues.append(residue)
+            elif res_id[0] != ' ':
+                # redefined hetero residues are discarded
+                residue = None
+            elif residues[position].resname == resname:
+                residue = residues[position]
+            else:
+                residue = Residue(res_id, resname, {}, {})
+                residues[position] = residue
+
+        if residue is None:
+            continue
+        name = atom_name(names[row])
+        altloc = altlocs[row]
+        selected = residue.selected
+        if name in selected:
+            if altloc == ' ':
+                continue
+            if occupancy[row] > occupancy[selected[name]]:
+                selected[name] = row
+        else:
+            selected[name] = row
+        if altloc in ('A', ' '):
+            residue.atoms[name] = row
+
+    return Model(records['coord'], records['bfactor'],
+                 [(code, chains[code]) for code in order])
+
+
+def from_structure(model):
+    """
+    Converts a Bio.PDB model into a Model
+
+    @return Model
+    """
+    coord = []
+    bfactor = []
+    chains = []
+    for chain in model:
+        residues = []
+        for res in chain:
+            rows = {}
+            atoms = {}
+            for atom in res.get_unpacked_list():
+                rows[id(atom)] = len(coord)
+                if atom.get_altloc() in ('A', ' '):
+                    atoms[atom.name] = len(coord)
+                coord.append(atom.coord)
+                bfactor.append(atom.get_bfactor())
+            # disordered atoms stand for their selected altloc
+            selected = dict((atom.name,
+                             rows[id(getattr(atom, 'selected_child', atom))])
+                            for atom in res)
+            residues.append(Residue(res.get_id(), res.resname, atoms,
+                                    selected))
+        chains.append((chain.get_id(), residues))
+
+    return Model(numpy.array(coord, 'f').reshape(-1, 3),
+                 numpy.array(bfactor, 'd'), chains)
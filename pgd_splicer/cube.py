@@ -0,0 +1,105 @@
+"""
+Plot cube of the search windows, see PlotCube in pgd_search/models.py.
+
+The cube is summed from the window table with a single INSERT ... SELECT
+grouped by the dimensions of the cube, so it is built by the database
+without reading the windows.  Windows without a phi or psi for residue i
+are left out, they are never plotted on the phi/psi grid.
+
+The cube is stamped with the current data version and replaced as a whole
+whenever windows are rebuilt: after recreating the window table and at the
+end of an import.  A rebuild sums the cube into a shadow table that is
+swapped in with the other tables, see rebuild.py.  Plots ignore a cube of
+another version.
+"""
+
+from django.conf import settings
+from django.db import connection
+
+from pgd_core.models import DataVersion
+from pgd_search.models import (PlotCube, ResidueWindow, CIRCULAR_FIELDS,
+                               CUBE_BIN_SIZE, CUBE_FIELDS, CUBE_TIERS,
+                               bin_field, iIndex)
+
+
+def cube_sql(cube_table=None, window_table=None):
+    """
+    Builds the statement that sums the windows into the cube.  The data
+    version is its only parameter.
+
+    @param cube_table: table the cube is inserted into, PlotCube's by default
+    @param window_table: table the windows are read from, ResidueWindow's by
+                         default
+    """
+    qn = connection.ops.quote_name
+    window_opts = ResidueWindow._meta
+    cube_opts = PlotCube._meta
+
+    def column(name):
+        return qn(window_opts.get_field(name).column)
+
+    def count(positions):
+        return '(%s)' % (' + '.join(
+            'CASE WHEN %s IS NOT NULL THEN 1 ELSE 0 END' % column('r%i' % p)
+            for p in positions) or '0')
+
+    def tier(field):
+        # see cube_tier
+        return '(%s)' % ' + '.join(
+            'CASE WHEN %s > %r THEN 1 ELSE 0 END' % (column(field), boundary)
+            for boundary in CUBE_TIERS[field])
+
+    # windows end at the first missing neighbour, so the residues present
+    # before and after residue i are contiguous.  A segment of n residues
+    # needs (n - 1) / 2 residues before i and the rest after it, see
+    # residue_indexes.
+    before = count(range(iIndex))
+    after = count(range(iIndex + 1, settings.SEGMENT_SIZE))
+    segment = 'CASE WHEN %s <= %s THEN 2 * %s + 1 ELSE 2 * %s + 2 END' % (
+        after, before, after, before)
+
+    phi_bin = column(bin_field('phi', CUBE_BIN_SIZE))
+    psi_bin = column(bin_field('psi', CUBE_BIN_SIZE))
+    dimensions = [
+        ('aa', column('r%i_aa' % iIndex)),
+        ('ss', column('r%i_ss' % iIndex)),
+        ('threshold', column('threshold')),
+    ] + [
+        ('%s_tier' % field, tier(field)) for field in sorted(CUBE_TIERS)
+    ] + [
+        ('segment', segment),
+        ('phi_bin', phi_bin),
+        ('psi_bin', psi_bin),
+    ]
+
+    measures = [('observations', 'COUNT(*)')]
+    for field in CUBE_FIELDS:
+        value = column('r%i_%s' % (iIndex, field))
+        measures.append(('%s_count' % field, 'COUNT(%s)' % value))
+        if field in CIRCULAR_FIELDS:
+            for function in ('sin', 'cos'):
+                measures.append(('%s_%s' % (field, function), 'SUM(%s)' % (
+                    column('r%i_%s_%s' % (iIndex, field, function)))))
+        else:
+            measures.append(('%s_sum' % field, 'SUM(%s)' % value))
+            measures.append(('%s_sumsq' % field,
+                             'SUM(%s * %s)' % (value, value)))
+
+    columns = ['version'] + [name for name, sql in dimensions + measures]
+    return 'INSERT INTO %s (%s) SELECT %%s, %s FROM %s ' \
+           'WHERE %s IS NOT NULL AND %s IS NOT NULL GROUP BY %s' % (
+        qn(cube_table or cube_opts.db_table),
+        ', '.join(qn(cube_opts.get_field(name).column) for name in columns),
+        ', '.join(sql for name, sql in dimensions + measures),
+        qn(window_table or window_opts.db_table), phi_bin, psi_bin,
+        ', '.join(sql for name, sql in dimensions))
+
+
+def store_plot_cube():
+    """
+    Replaces the plot cube with one summed from the stored windows, for the
+    current data version.  Must be called within a transaction.
+    """
+    PlotCube.objects.all().delete()
+    cursor = connection.cursor()
+    cursor.execute(cube_sql(), [DataVersion.current()])
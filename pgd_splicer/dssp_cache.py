@@ -0,0 +1,134 @@
+"""
+Cache of DSSP secondary structure assignments.
+
+Running dsspcmbi is one of the slower steps of importing a protein and its
+output only depends on the filtered pdb file and the dsspcmbi binary.  The
+assignments are stored on disk keyed by a hash of both, so re-importing a
+protein with an unchanged file does not spawn DSSP again.
+
+Each cache entry is a gzipped file with one tab separated line per residue:
+
+    chain  hetflag  resseq  icode  secondary_structure
+
+The cache is enabled by setting DSSP_CACHE_DIR.
+"""
+
+from cStringIO import StringIO
+from distutils.spawn import find_executable
+from gzip import GzipFile
+import hashlib
+import os
+from tempfile import NamedTemporaryFile
+
+import Bio.PDB
+from django.conf import settings
+
+DSSP_BINARY = 'dsspcmbi'
+
+_binary_hashes = {}
+
+
+def binary_version(binary=DSSP_BINARY):
+    """
+    Identifies the installed DSSP binary by hashing its contents.  The hash
+    is calculated once per process.
+    """
+    if binary not in _binary_hashes:
+        path = find_executable(binary)
+        if path is None:
+            raise Exception('DSSP binary not found: %s' % binary)
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(65536), ''):
+                sha.update(block)
+        _binary_hashes[binary] = sha.hexdigest()
+    return _binary_hashes[binary]
+
+
+def cache_path(cache_dir, contents, binary=DSSP_BINARY):
+    """
+    Path of the cache entry for a filtered pdb file
+    """
+    sha = hashlib.sha1(contents)
+    sha.update(binary_version(binary))
+    key = sha.hexdigest()
+    return os.path.join(cache_dir, key[:2], '%s.gz' % key)
+
+
+def run_dssp(model, contents, binary=DSSP_BINARY):
+    """
+    Runs DSSP on the filtered contents of a pdb file.  The file is written to
+    PDB_TMP_DIR for the duration of the run.
+
+    @param model: Bio.PDB model parsed from contents, or None to parse it
+    @return dict mapping (chain, residue id) to secondary structure
+    """
+    if model is None:
+        model = Bio.PDB.PDBParser().get_structure('pdbname',
+                                                  StringIO(contents))[0]
+    decompressed = NamedTemporaryFile(dir=settings.PDB_TMP_DIR)
+    decompressed.write(contents)
+    decompressed.flush()
+    dssp = Bio.PDB.DSSP(model=model, pdb_file=decompressed.name, dssp=binary)
+    decompressed.close()
+
+    structures = {}
+    for key in dssp.keys():
+        (residue_dssp, secondary_structure, accessibility,
+         relative_accessibility, phi, psi) = dssp[key]
+        structures[key] = secondary_structure
+    return structures
+
+
+def read_entry(path):
+    structures = {}
+    for line in GzipFile(path):
+        chain, hetflag, resseq, icode, ss = line.rstrip('\n').split('\t')
+        structures[(chain, (hetflag, int(resseq), icode))] = ss
+    return structures
+
+
+def write_entry(path, structures):
+    """
+    Writes a cache entry.  The entry is written to a temporary file first
+    and renamed, so concurrent imports never read a partial entry.
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created by another process
+            pass
+
+    out = NamedTemporaryFile(dir=directory, delete=False)
+    with GzipFile(fileobj=out, mode='wb') as gzipped:
+        for (chain, (hetflag, resseq, icode)), ss in sorted(structures.items()):
+            gzipped.write('%s\t%s\t%s\t%s\t%s\n' % (chain, hetflag, resseq,
+                                                    icode, ss))
+    out.close()
+    os.rename(out.name, path)
+
+
+def secondary_structure(model, contents, cache_dir=None, binary=DSSP_BINARY):
+    """
+    Secondary structure of the residues in model, read from the cache if
+    possible.  DSSP is only run when cache_dir is None or the cache has no
+    entry for contents.
+
+    @param model: Bio.PDB model parsed from contents.  If None, the model is
+                  only parsed when DSSP has to be run.
+    @param contents: filtered pdb file contents
+    @return dict mapping (chain, residue id) to secondary structure
+    """
+    if cache_dir is None:
+        return run_dssp(model, contents, binary)
+
+    path = cache_path(cache_dir, contents, binary)
+    if os.path.exists(path):
+        return read_entry(path)
+
+    structures = run_dssp(model, contents, binary)
+    if structures:
+        write_entry(path, structures)
+    return structures
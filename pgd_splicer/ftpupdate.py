@@ -111,7 +111,16 @@ class FTPUpdateTask(object):
             #===============================================
             #1 get list of local files matching the pdbs and the file modification date
 
-            filename = 'pdb%s.ent.gz' % pdb
+            # the pdb file, or the mmCIF file of entries without one
+            print '    Checking Remote File:', 'pdb%s.ent.gz' % pdb
+            found = self.remote_file(pdb)
+            if found is None:
+                # 550 error (permission error) results when a file does not
+                # exist, remove pdb from list
+                print 'File Not Found:', pdb, error_perm
+                continue
+            filename, remote, resp = found
+
             path = os.path.join(ftp_update_settings.PDB_LOCAL_DIR, filename)
             if os.path.exists(path):
                 date = time.gmtime(os.path.getmtime(path))
@@ -128,16 +137,6 @@ class FTPUpdateTask(object):
             # ===============================================
             #2 iterate through list and purge pdbs that are not new or newer
 
-            print '    Checking Remote File:', filename
-
-            try:
-                resp = self.ftp.sendcmd('MDTM %s' % filename)
-            except error_perm:
-                # 550 error (permission error) results when a file does not
-                # exist, remove pdb from list
-                print 'File Not Found:', pdb, error_perm
-                continue
-
             remote_date = time.strptime(resp[4:], '%Y%m%d%H%M%S')
 
             # keep only pdbs in the list that are new or newer, remove all others.
@@ -147,7 +146,7 @@ class FTPUpdateTask(object):
 
             # ===============================================
             #3 download files that are in the list
-            self.download_pdb(pdb)
+            self.download_pdb(pdb, filename, remote)
 
             self.pdbCount += 1
 
@@ -157,13 +156,30 @@ class FTPUpdateTask(object):
                                                          self.progress())
         return kwargs
 
-    def download_pdb(self, pdb):
-        filename = 'pdb%s.ent.gz' % pdb
+    def remote_file(self, pdb):
+        """
+        Finds the pdb file of a protein on the FTP server, or its mmCIF file
+        if there is no pdb file.
+
+        @return (local filename, remote path, MDTM response) or None if
+                neither file exists
+        """
+        cif = '%s.cif.gz' % pdb
+        for filename, remote in (
+                ('pdb%s.ent.gz' % pdb, 'pdb%s.ent.gz' % pdb),
+                (cif, ftp_update_settings.PDB_CIF_REMOTE_DIR + cif)):
+            try:
+                return filename, remote, self.ftp.sendcmd('MDTM %s' % remote)
+            except error_perm:
+                continue
+        return None
+
+    def download_pdb(self, pdb, filename, remote):
         local_filename = '%s/%s' % (ftp_update_settings.PDB_LOCAL_DIR,
                                     filename)
 
         # Grab size and pretty-print our progress.
-        size = self.ftp.size(filename)
+        size = self.ftp.size(remote)
         if size:
             print "  %s - %s (%.2f KiB)" % (self.progressMessage(), pdb,
                                                 size / 1024),
@@ -175,7 +191,7 @@ class FTPUpdateTask(object):
             os.remove(local_filename)
 
         self._incoming_file = open(local_filename,"w")
-        self.ftp.retrbinary('RETR %s' % filename, self.processChunk)
+        self.ftp.retrbinary('RETR %s' % remote, self.processChunk)
         self._incoming_file.close()
         sys.stdout.write("\n")
 
@@ -0,0 +1,310 @@
+"""
+Vectorized geometry calculations used by the splicer.
+
+The functions in this module operate on (n, 3) arrays of coordinates and
+return one value per row, so that all residues in a chain are processed with
+a few array operations instead of one Bio.PDB Vector calculation at a time.
+Missing atoms are represented by rows of NaN; any value calculated from a
+missing atom is NaN as well.
+
+Angles are returned in degrees.  They follow the same conventions as
+Bio.PDB.calc_angle and Bio.PDB.calc_dihedral, and are calculated in the same
+order of operations so the values are identical.
+"""
+
+import numpy
+
+from pgd_splicer.chi import CHI_MAP, CHI_CORRECTIONS_TESTS, CHI_CORRECTIONS
+from pgd_splicer.sidechain import bond_angles, bond_lengths
+
+NAN = float('nan')
+
+# maximum C(-1)-N distance for two residues to be considered bonded.  If the
+# distance is larger the residues cannot be next to each other in the chain.
+MAX_PEPTIDE_BOND = 2.5
+
+# values calculated by backbone_geometry
+BACKBONE_FIELDS = ('L1', 'L2', 'L3', 'L4', 'L5',
+                   'a1', 'a2', 'a3', 'a4', 'a5', 'a6', 'a7',
+                   'phi', 'psi', 'ome', 'omep', 'zeta')
+
+
+def coordinates(atom_dicts, name, coords=None):
+    """
+    Gathers the coordinates of one atom from a list of atom dicts into an
+    (n, 3) array.  Rows for residues lacking the atom are NaN.
+
+    @param coords: optional (atoms, 3) array.  If given, atom dicts map atom
+                   names to rows of coords instead of to Bio.PDB atoms, see
+                   atom_records.py.
+    """
+    if coords is not None:
+        rows = numpy.array([atoms.get(name, -1) for atoms in atom_dicts], int)
+        gathered = coords[rows].astype('d')
+        gathered[rows < 0] = NAN
+        return gathered
+
+    coords = numpy.empty((len(atom_dicts), 3), 'd')
+    for i, atoms in enumerate(atom_dicts):
+        if name in atoms:
+            coords[i] = atoms[name].coord
+        else:
+            coords[i] = NAN
+    return coords
+
+
+def _dot(a, b):
+    # summed in the same order as Bio.PDB.Vector so results are identical
+    return (a[:, 0] * b[:, 0] + a[:, 1] * b[:, 1]) + a[:, 2] * b[:, 2]
+
+
+def _angle(a, b):
+    """ angle in radians between the rows of two arrays of vectors """
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        cos = _dot(a, b) / (numpy.sqrt(_dot(a, a)) * numpy.sqrt(_dot(b, b)))
+        return numpy.arccos(numpy.clip(cos, -1, 1))
+
+
+def _cross(a, b):
+    """
+    cross product of the rows of two arrays of vectors.  Bio.PDB.Vector
+    calculates it from 2x2 determinants rather than with numpy.cross, which
+    rounds differently, so the determinants are taken here as well.
+    """
+    def det(i, j):
+        return numpy.linalg.det(numpy.stack(
+            (numpy.stack((a[:, i], a[:, j]), -1),
+             numpy.stack((b[:, i], b[:, j]), -1)), -2))
+    # rows with missing atoms are NaN
+    with numpy.errstate(invalid='ignore'):
+        return numpy.stack((det(1, 2), -det(0, 2), det(0, 1)), -1)
+
+
+def calc_distances(atoms1, atoms2):
+    """
+    Distance between each pair of atoms
+    """
+    diff = atoms1 - atoms2
+    return numpy.sqrt(_dot(diff, diff))
+
+
+def calc_angles(atoms1, atoms2, atoms3):
+    """
+    Angle atom1-atom2-atom3 for each row, in degrees
+    """
+    return numpy.degrees(_angle(atoms1 - atoms2, atoms3 - atoms2))
+
+
+def calc_dihedrals(atoms1, atoms2, atoms3, atoms4):
+    """
+    Dihedral angle atom1-atom2-atom3-atom4 for each row, in degrees
+    """
+    ab = atoms1 - atoms2
+    cb = atoms3 - atoms2
+    db = atoms4 - atoms3
+    u = _cross(ab, cb)
+    v = _cross(db, cb)
+    w = _cross(u, v)
+    angle = _angle(u, v)
+
+    # the angle is negative when w points away from cb.  When u and v are
+    # parallel w is zero and the angle is left positive.
+    with numpy.errstate(invalid='ignore'):
+        angle[_angle(cb, w) > 0.001] *= -1
+    return numpy.degrees(angle)
+
+
+def chain_layout(positions, length):
+    """
+    Determines how the valid residues of a chain are connected.
+
+    @param positions: sorted array with the position of each valid residue
+                      among all residues of the chain
+    @param length: number of residues in the chain, including invalid ones
+    @return (chain_index, contiguous, terminal) arrays, one value per valid
+            residue:
+              chain_index - 1-based index of the residue.  A number is
+                            skipped after every invalid residue that follows a
+                            valid one, so the break is visible in the index.
+              contiguous - True if the previous valid residue directly
+                           precedes this residue.
+              terminal - True if this residue is directly followed by an
+                         invalid residue.
+    """
+    positions = numpy.asarray(positions, int)
+    invalid = numpy.ones(length, bool)
+    invalid[positions] = False
+
+    breaks = numpy.zeros(length, int)
+    breaks[1:] = invalid[1:] & ~invalid[:-1]
+    chain_index = positions + 1 + numpy.cumsum(breaks)[positions]
+
+    contiguous = numpy.zeros(len(positions), bool)
+    contiguous[1:] = positions[1:] - positions[:-1] == 1
+
+    following = positions + 1
+    terminal = following < length
+    terminal[terminal] = invalid[following[terminal]]
+
+    return chain_index, contiguous, terminal
+
+
+def backbone_geometry(N, CA, C, O, CB, CD, contiguous, proline):
+    """
+    Calculates backbone lengths, angles and dihedrals for a chain.
+
+    @param N, CA, C, O, CB, CD: (n, 3) coordinate arrays, NaN where missing
+    @param contiguous: boolean array, see chain_layout()
+    @param proline: boolean array, True for proline residues
+    @return dict mapping each name in BACKBONE_FIELDS to an array of n
+            values, plus 'linked': a boolean array that is True where a
+            residue is bonded to the residue before it.
+    """
+    n = len(N)
+    geometry = {}
+
+    # properties of a single residue
+    geometry['L2'] = calc_distances(N, CA)
+    geometry['L3'] = calc_distances(CA, CB)
+    geometry['L4'] = calc_distances(CA, C)
+    geometry['L5'] = calc_distances(C, O)
+    geometry['a2'] = calc_angles(N, CA, CB)
+    geometry['a3'] = calc_angles(N, CA, C)
+    geometry['a4'] = calc_angles(CB, CA, C)
+    geometry['a5'] = calc_angles(CA, C, O)
+    geometry['zeta'] = calc_dihedrals(CA, N, C, CB)
+
+    # properties spanning residue i-1 and residue i.  These are calculated
+    # for every pair and masked afterwards, pairs that aren't bonded are NaN
+    L1 = numpy.empty(n)
+    L1[:1] = NAN
+    L1[1:] = calc_distances(C[:-1], N[1:])
+    with numpy.errstate(invalid='ignore'):
+        linked = contiguous & (L1 < MAX_PEPTIDE_BOND)
+
+    following = {
+        'L1': L1[1:],
+        'a1': calc_angles(C[:-1], N[1:], CA[1:]),
+        'phi': calc_dihedrals(C[:-1], N[1:], CA[1:], C[1:]),
+        'omep': calc_dihedrals(CA[:-1], C[:-1], N[1:], CD[1:]),
+    }
+    preceding = {
+        'a6': calc_angles(CA[:-1], C[:-1], N[1:]),
+        'a7': calc_angles(O[:-1], C[:-1], N[1:]),
+        'psi': calc_dihedrals(N[:-1], CA[:-1], C[:-1], N[1:]),
+        'ome': calc_dihedrals(CA[:-1], C[:-1], N[1:], CA[1:]),
+    }
+    following['omep'][~proline[1:]] = NAN
+
+    unlinked = ~linked[1:]
+    for name, values in following.items():
+        values[unlinked] = NAN
+        geometry[name] = numpy.append(NAN, values)
+    for name, values in preceding.items():
+        values[unlinked] = NAN
+        geometry[name] = numpy.append(values, NAN)
+
+    geometry['linked'] = linked
+    return geometry
+
+
+class SidechainTable(object):
+    """
+    Precompiled atom index table for one residue type.  Every atom used by
+    the chi, chi correction and sidechain mappings of the residue type is
+    given a row in a (atoms, residues, 3) coordinate array, and every mapping
+    is translated into rows of that array.  Atoms of the previous residue
+    (names ending with '-1') are stored in their own rows.
+    """
+
+    def __init__(self, resname):
+        self.resname = resname
+        names = set()
+        for mapping in (CHI_MAP, CHI_CORRECTIONS_TESTS, bond_lengths,
+                        bond_angles, CHI_CORRECTIONS):
+            for atom_names in mapping.get(resname, ()):
+                names.update(atom_names)
+        self.names = sorted(names)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+
+        rows = lambda atom_names: tuple(self.index[n] for n in atom_names)
+        self.chi = [rows(a) for a in CHI_MAP.get(resname, ())]
+        self.tests = [rows(a) for a in CHI_CORRECTIONS_TESTS.get(resname, ())]
+        self.corrections = [rows(a) for a in CHI_CORRECTIONS.get(resname, ())]
+        self.lengths = [('%s_%s' % (a[0], a[1]), rows(a))
+                        for a in bond_lengths.get(resname, ())]
+        self.angles = [(('%s_%s_%s' % tuple(a)).replace('-', '_'), rows(a))
+                       for a in bond_angles.get(resname, ())]
+
+    def coordinates(self, atom_dicts, prev_residues, atom_coords=None):
+        """
+        Gathers coordinates for all atoms in the table.
+
+        @param atom_dicts: list of atom dicts, one per residue
+        @param prev_residues: list of the previous residue for each residue,
+                              or None where there is no previous residue
+        @param atom_coords: optional array of coordinates that atom dicts
+                            refer to by row, see coordinates()
+        """
+        coords = numpy.empty((len(self.names), len(atom_dicts), 3), 'd')
+        for row, name in enumerate(self.names):
+            if name[-2:] == '-1':
+                coords[row] = coordinates(
+                    [prev if prev else {} for prev in prev_residues],
+                    name[:-2], atom_coords)
+            else:
+                coords[row] = coordinates(atom_dicts, name, atom_coords)
+        return coords
+
+    def correct(self, coords):
+        """
+        Swaps symmetrical atoms that were recorded in the wrong order, see
+        CHI_CORRECTIONS in chi.py.  Residues for which neither test angle
+        can be calculated lose the atoms listed in the corrections.
+        """
+        if not self.tests:
+            return
+        test1, test2 = [calc_dihedrals(*coords[list(rows)])
+                        for rows in self.tests]
+        has1 = ~numpy.isnan(test1)
+        has2 = ~numpy.isnan(test2)
+        with numpy.errstate(invalid='ignore'):
+            correct = numpy.where(
+                has1 & has2, numpy.abs(test2) < numpy.abs(test1),
+                numpy.where(has1, numpy.abs(test1) > 90,
+                            has2 & (numpy.abs(test2) < 90)))
+        neither = ~(has1 | has2)
+
+        for row1, row2 in self.corrections:
+            atom1 = coords[row1].copy()
+            atom2 = coords[row2]
+            coords[row1] = numpy.where(correct[:, None], atom2, atom1)
+            coords[row2] = numpy.where(correct[:, None], atom1, atom2)
+            coords[row1][neither] = NAN
+            coords[row2][neither] = NAN
+
+    def calculate(self, atom_dicts, prev_residues, atom_coords=None):
+        """
+        Calculates chi angles and sidechain lengths and angles for a group of
+        residues of this type.
+
+        @return (chi, sidechain) dicts mapping field names to arrays with one
+                value per residue.  Values are NaN where an atom is missing.
+        """
+        coords = self.coordinates(atom_dicts, prev_residues, atom_coords)
+        self.correct(coords)
+
+        chi = {}
+        for i, rows in enumerate(self.chi):
+            chi['chi%i' % (i+1)] = calc_dihedrals(*coords[list(rows)])
+
+        sidechain = {}
+        for name, rows in self.lengths:
+            sidechain[name] = calc_distances(*coords[list(rows)])
+        for name, rows in self.angles:
+            sidechain[name] = calc_angles(*coords[list(rows)])
+        return chi, sidechain
+
+
+SIDECHAIN_TABLES = dict((resname, SidechainTable(resname)) for resname in
+                        set(CHI_MAP) | set(bond_lengths) | set(bond_angles))
@@ -0,0 +1,95 @@
+"""
+Import journal.
+
+Every protein saved by ProcessPDBTask is appended to the journal as a tab
+separated line:
+
+    code  splicer_version  file_hash  pdb_date  saved
+
+The journal lets an interrupted import be resumed without asking the
+database which proteins were imported.  A protein is considered done if its
+latest entry was written by the current splicer version for the same pdb
+file, i.e. a file with the same modification date or the same hash.
+"""
+
+from datetime import datetime
+import os
+
+from pgd_splicer.atom_records import pdb_path
+from pgd_splicer.parse_cache import DATE_FORMAT, SPLICER_VERSION, file_hash
+
+
+class ImportJournal(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.out = None
+
+    def entries(self):
+        """
+        @return dict mapping protein code to its latest entry, a tuple of
+                (splicer_version, file_hash, pdb_date)
+        """
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        for line in open(self.path):
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 5:
+                # partial line written while the import died
+                continue
+            code, version, pdb_hash, pdb_date, saved = fields
+            entries[code] = (int(version), pdb_hash, pdb_date)
+        return entries
+
+    def pending(self, pdbs, pdb_dir='./pdb'):
+        """
+        Splits proteins into those that still need to be imported and those
+        the journal records as done.
+
+        @return tuple of lists (pending, done)
+        """
+        entries = self.entries()
+        pending = []
+        done = []
+        for data in pdbs:
+            code = data['code']
+            if code in entries and self.is_current(code, entries[code],
+                                                   pdb_dir):
+                done.append(data)
+            else:
+                pending.append(data)
+        return pending, done
+
+    def is_current(self, code, entry, pdb_dir):
+        version, pdb_hash, pdb_date = entry
+        if version != SPLICER_VERSION:
+            return False
+        path = pdb_path(code, pdb_dir)
+        if path is None:
+            # nothing to compare against, e.g. when loading from the cache
+            return True
+        mtime = datetime.fromtimestamp(os.path.getmtime(path))
+        return mtime.strftime(DATE_FORMAT) == pdb_date \
+            or file_hash(path) == pdb_hash
+
+    def record(self, code, pdb_hash, pdb_date):
+        """
+        Appends an entry for a saved protein.  The journal is flushed after
+        every entry so that it survives a crash of the import.
+
+        @param pdb_date: modification date of the pdb file as a string in
+                         DATE_FORMAT
+        """
+        if self.out is None:
+            self.out = open(self.path, 'a')
+        self.out.write('%s\t%s\t%s\t%s\t%s\n' % (
+            code, SPLICER_VERSION, pdb_hash or '', pdb_date or '',
+            datetime.now().strftime(DATE_FORMAT)))
+        self.out.flush()
+        os.fsync(self.out.fileno())
+
+    def close(self):
+        if self.out is not None:
+            self.out.close()
+            self.out = None
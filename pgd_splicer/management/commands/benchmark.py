@@ -0,0 +1,191 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from optparse import make_option
+from datetime import datetime
+import json
+import os
+
+from pgd_splicer.ProcessPDBTask import (parseWithBioPython, store_pdb,
+                                        bulk_store_pdb)
+from pgd_splicer.timing import add_timings, timed
+
+STAGES = ('filter', 'parse', 'dssp', 'residues', 'backbone', 'sidechain',
+          'db')
+
+
+class Command(BaseCommand):
+    args = '[directory]'
+    option_list = BaseCommand.option_list + (
+        make_option('--output',
+                    default=False,
+                    help='write JSON results to FILE'),
+        make_option('--baseline',
+                    default=False,
+                    help='compare results against the JSON results in FILE'),
+        make_option('--tolerance',
+                    type='float',
+                    default=0.25,
+                    help='allowed slowdown compared to the baseline as a '
+                         'fraction, default 0.25'),
+        make_option('--repeat',
+                    type='int',
+                    default=1,
+                    help='import each file N times and keep the fastest run'),
+        make_option('--bulk',
+                    action='store_true',
+                    default=False,
+                    help='benchmark the bulk write path'),
+        make_option('--no-db',
+                    action='store_true',
+                    default=False,
+                    help='skip the database write stage'),
+        make_option('--use-cache',
+                    action='store_true',
+                    default=False,
+                    help='use the DSSP cache, if configured'),
+    )
+    help = ('Benchmarks the import stages on a directory of pdb*.ent.gz and '
+            '*.cif.gz files, pgd_splicer/testfiles by default.  Database '
+            'writes are rolled back.')
+
+    def handle(self, *args, **options):
+        if len(args) > 1:
+            raise CommandError('Only one directory may be given')
+        directory = args[0] if args else \
+            os.path.join(os.path.dirname(__file__), '..', '..', 'testfiles')
+        directory = os.path.abspath(directory)
+        files = sorted(f for f in os.listdir(directory)
+                       if (f.startswith('pdb') and f.endswith('.ent.gz'))
+                       or f.endswith('.cif.gz'))
+        if not files:
+            raise CommandError('No pdb files found in %s' % directory)
+
+        if not options['use_cache']:
+            settings.DSSP_CACHE_DIR = None
+
+        store = bulk_store_pdb if options['bulk'] else store_pdb
+        proteins = {}
+        for filename in files:
+            path = os.path.join(directory, filename)
+            best = None
+            for i in range(options['repeat']):
+                result = self.benchmark(path, store, not options['no_db'])
+                if best is None or total_wall(result) < total_wall(best):
+                    best = result
+            proteins[protein_code(filename)] = best
+            self.stdout.write(format_row(protein_code(filename), best))
+
+        results = {'date': datetime.now().isoformat(),
+                   'directory': directory,
+                   'proteins': proteins,
+                   'total': total(proteins)}
+        self.stdout.write(format_row('TOTAL', results['total']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            if not os.path.exists(options['baseline']):
+                raise CommandError('Baseline file does not exist!')
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = compare(baseline['total'], results['total'],
+                                  options['tolerance'])
+            for line in format_comparison(baseline['total'], results['total']):
+                self.stdout.write(line)
+            if regressions:
+                raise CommandError('Slower than baseline: %s'
+                                   % ', '.join(regressions))
+
+    def benchmark(self, path, store, write):
+        """
+        Imports a single file, recording the time spent in each stage
+        """
+        data = {'code': protein_code(os.path.basename(path)), 'chains': {},
+                'threshold': 0, 'resolution': 0, 'rfactor': 0, 'rfree': 0,
+                'pdb_date': datetime.fromtimestamp(os.path.getmtime(path))}
+        timings = {}
+        parseWithBioPython(path, data, timings=timings)
+        if write:
+            self.write(data, store, timings)
+
+        return {'residues': sum(len(r) for r in data['chains'].values()),
+                'stages': timings}
+
+    @transaction.commit_manually
+    def write(self, data, store, timings):
+        try:
+            with timed(timings, 'db'):
+                store(data)
+        finally:
+            transaction.rollback()
+
+
+def protein_code(filename):
+    if filename.endswith('.cif.gz'):
+        return filename[:-7].upper()
+    return filename[3:-7].upper()
+
+
+def total_wall(result):
+    return sum(t['wall'] for t in result['stages'].values())
+
+
+def total(proteins):
+    stages = {}
+    for result in proteins.values():
+        add_timings(stages, result['stages'])
+    return {'residues': sum(r['residues'] for r in proteins.values()),
+            'stages': stages}
+
+
+def compare(baseline, current, tolerance):
+    """
+    @return list of stages whose wall time per residue exceeds the baseline
+            by more than tolerance
+    """
+    regressions = []
+    for stage, values in current['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        before = per_residue(baseline, stage)
+        after = per_residue(current, stage)
+        if after > before * (1 + tolerance):
+            regressions.append(stage)
+    return sorted(regressions, key=stage_order)
+
+
+def per_residue(result, stage):
+    return result['stages'][stage]['wall'] / max(result['residues'], 1)
+
+
+def stage_order(stage):
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+
+def format_row(code, result):
+    stages = result['stages']
+    columns = ['%s %0.3fs/%0.3fs' % (stage, stages[stage]['wall'],
+                                     stages[stage]['cpu'])
+               for stage in sorted(stages, key=stage_order)]
+    return '%-6s %6d residues  %s' % (code, result['residues'],
+                                      '  '.join(columns))
+
+
+def format_comparison(baseline, current):
+    """
+    Lines comparing the wall time per residue of each stage
+    """
+    yield 'stage      baseline   current  (ms per 1000 residues)'
+    for stage in sorted(current['stages'], key=stage_order):
+        after = per_residue(current, stage)
+        if stage in baseline['stages']:
+            before = per_residue(baseline, stage)
+            yield '%-9s %9.2f %9.2f %+6.1f%%' % (stage, before * 1e6,
+                                                  after * 1e6,
+                                                  (after / before - 1) * 100
+                                                  if before else 0)
+        else:
+            yield '%-9s %9s %9.2f' % (stage, '-', after * 1e6)
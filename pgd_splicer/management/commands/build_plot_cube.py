@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pgd_core.models import DataVersion
+from pgd_search.models import PlotCube
+from pgd_splicer.cube import store_plot_cube
+
+
+class Command(BaseCommand):
+    help = ('Sums the stored search windows into the plot cube for the '
+            'current data version.  The cube is built by imports and '
+            'rebuilds, run this after loading windows any other way.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            store_plot_cube()
+        self.stdout.write('Stored %s plot cube cells for version %s' % (
+            PlotCube.objects.count(), DataVersion.current()))
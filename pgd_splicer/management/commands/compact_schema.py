@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+import time
+
+from pgd_core.fields import CodeField, CompactFloatField
+from pgd_core.models import Residue, Sidechain
+from pgd_search.models import ResidueWindow, iIndex
+from pgd_splicer.ProcessPDBTask import DROPPED_RESIDUE_COLUMNS
+
+# tables altered, with the column scanned to time a full table scan
+TABLES = ((Residue, 'phi'), (Sidechain, 'ARG_CB_CG'),
+          (ResidueWindow, 'r%i_phi' % iIndex))
+
+
+def quote(name):
+    return connection.ops.quote_name(name)
+
+
+class Command(BaseCommand):
+    help = ('Alters the residue, sidechain and search window tables to the '
+            'column types of the current schema: 4 byte floats and single '
+            'byte aa/ss codes when COMPACT_SCHEMA is set, double precision '
+            'and varchar otherwise.  The residue chainID, prev_id and '
+            'next_id columns removed from the model are dropped, which is '
+            'required before importing into older databases.  Table sizes '
+            'and full scan times are reported before and after.  MySQL '
+            'only.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'mysql':
+            raise CommandError('compact_schema requires MySQL')
+        self.cursor = connection.cursor()
+
+        before = [self.report(model, column) for model, column in TABLES]
+
+        residue_table = Residue._meta.db_table
+        columns = self.columns(residue_table)
+        dropped = [column for column in DROPPED_RESIDUE_COLUMNS
+                   if column in columns]
+        if dropped:
+            # the foreign keys of the prev/next links must go first
+            self.cursor.execute("""
+                SELECT CONSTRAINT_NAME FROM information_schema.KEY_COLUMN_USAGE
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %%s
+                    AND REFERENCED_TABLE_NAME IS NOT NULL
+                    AND COLUMN_NAME IN (%s)""" % ', '.join(['%s'] * len(dropped)),
+                [residue_table] + dropped)
+            constraints = [row[0] for row in self.cursor.fetchall()]
+            if constraints:
+                self.cursor.execute('ALTER TABLE %s %s' % (
+                    quote(residue_table),
+                    ', '.join('DROP FOREIGN KEY %s' % quote(c)
+                              for c in constraints)))
+            self.cursor.execute('ALTER TABLE %s %s' % (
+                quote(residue_table),
+                ', '.join('DROP COLUMN %s' % quote(c) for c in dropped)))
+
+        for model, column in TABLES:
+            fields = [field for field in model._meta.concrete_fields
+                      if isinstance(field, (CodeField, CompactFloatField))]
+            # a single ALTER rebuilds the table once
+            self.cursor.execute('ALTER TABLE %s %s' % (
+                quote(model._meta.db_table), ', '.join(
+                    'MODIFY %s %s %s' % (quote(field.column),
+                                         field.db_type(connection),
+                                         'NULL' if field.null else 'NOT NULL')
+                    for field in fields)))
+
+        after = [self.report(model, column) for model, column in TABLES]
+
+        self.stdout.write('%-30s %14s %14s %10s %10s' % (
+            'table', 'bytes before', 'bytes after', 'scan before',
+            'scan after'))
+        for (model, column), (size, scan), (new_size, new_scan) in \
+                zip(TABLES, before, after):
+            self.stdout.write('%-30s %14i %14i %9.2fs %9.2fs' % (
+                model._meta.db_table, size, new_size, scan, new_scan))
+
+    def columns(self, table):
+        return [row[0] for row in connection.introspection \
+                .get_table_description(self.cursor, table)]
+
+    def report(self, model, column):
+        """
+        @return (size of the table and its indexes in bytes, seconds taken by
+                 a full scan of the table)
+        """
+        table = model._meta.db_table
+        # statistics are estimates until the table is analyzed
+        self.cursor.execute('ANALYZE TABLE %s' % quote(table))
+        self.cursor.fetchall()
+        self.cursor.execute("""
+            SELECT DATA_LENGTH + INDEX_LENGTH FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s""", [table])
+        size = self.cursor.fetchone()[0]
+
+        # summing an unindexed column reads every row
+        start = time.time()
+        self.cursor.execute('SELECT SUM(%s) FROM %s' % (quote(column),
+                                                        quote(table)))
+        self.cursor.fetchall()
+        return size, time.time() - start
@@ -47,11 +47,33 @@ class Command(BaseCommand):
 
     localdir = ftp_update_settings.PDB_LOCAL_DIR
     remotedir = ftp_update_settings.PDB_REMOTE_DIR
+    cif_remotedir = ftp_update_settings.PDB_CIF_REMOTE_DIR
     ftphost = ftp_update_settings.PDB_FTP_HOST
 
     def filename(self, code):
         return 'pdb%s.ent.gz' % code[:4].lower()
 
+    def cif_filename(self, code):
+        return '%s.cif.gz' % code[:4].lower()
+
+    def remote_file(self, ftp, code):
+        """
+        Finds the pdb file of a protein on the site, or its mmCIF file if
+        there is no pdb file.
+
+        @return (local filename, remote path, MDTM response) or None if
+                neither file exists
+        """
+        for filename, remote in (
+                (self.filename(code), self.filename(code)),
+                (self.cif_filename(code),
+                 self.cif_remotedir + self.cif_filename(code))):
+            try:
+                return filename, remote, ftp.sendcmd('MDTM %s' % remote)
+            except error_perm:
+                continue
+        return None
+
     def prefix(self, code, mesg=''):
         now = datetime.now()
         elapsed = now - self.started
@@ -68,20 +90,19 @@ class Command(BaseCommand):
         self.infile.write(data)
 
     def fetch_pdb(self, ftp, code):
-        filename = self.filename(code)
+        found = self.remote_file(ftp, code)
+        if found is None:
+            # file not found on the website
+            self.stdout.write(self.prefix(code, 'file not found on site!\n'))
+            return 'notonsite'
+        filename, remote, resp = found
+
         localfile = os.path.join(self.localdir, filename)
         if os.path.exists(localfile):
             date = time.gmtime(os.path.getmtime(localfile))
         else:
             date = None
 
-        try:
-            resp = ftp.sendcmd('MDTM %s' % filename)
-        except error_perm:
-            # file not found on the website
-            self.stdout.write(self.prefix(code, 'file not found on site!\n'))
-            return 'notonsite'
-
         remote_date = time.strptime(resp[4:], '%Y%m%d%H%M%S')
 
         if date and time.mktime(remote_date) <= time.mktime(date):
@@ -91,11 +112,11 @@ class Command(BaseCommand):
             return 'unchanged'
 
         # download the file
-        size = ftp.size(filename)
+        size = ftp.size(remote)
 
         self.infile = open(localfile, 'w')
         self.stdout.write(self.prefix(code))
-        ftp.retrbinary('RETR %s' % filename, self.process_chunk)
+        ftp.retrbinary('RETR %s' % remote, self.process_chunk)
         self.infile.close()
         sys.stdout.write('\n')
         if date:
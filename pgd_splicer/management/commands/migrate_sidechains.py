@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection
+
+from pgd_core.models import Residue, Sidechain, sidechain_column
+from pgd_splicer.sidechain import sidechain_string_dict
+from pgd_splicer.windows import recreate_window_table
+
+
+def quote(name):
+    return connection.ops.quote_name(name)
+
+
+class Command(BaseCommand):
+    help = ('Moves the sidechains of a database created with a table per '
+            'residue type (pgd_core_sidechain_arg, ...) into the single '
+            'sidechain table, then drops the old tables and rebuilds the '
+            'search windows.  MySQL only.  Databases that are rebuilt with '
+            'the rebuild command do not need this.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'mysql':
+            raise CommandError('migrate_sidechains requires MySQL')
+        self.cursor = connection.cursor()
+        tables = connection.introspection.table_names()
+        residue_table = Residue._meta.db_table
+        sidechain_table = Sidechain._meta.db_table
+        column = Residue._meta.get_field('sidechain').column
+
+        # MySQL commits each schema change.  Old tables are dropped as soon
+        # as they are moved, running the command again moves the rest.
+        if sidechain_table not in tables:
+            style = no_style()
+            statements, pending = connection.creation.sql_create_model(
+                Sidechain, style)
+            for statement in statements:
+                self.cursor.execute(statement)
+        if column not in self.columns(residue_table):
+            self.cursor.execute(
+                'ALTER TABLE %s ADD COLUMN %s integer NULL UNIQUE, '
+                'ADD CONSTRAINT %s FOREIGN KEY (%s) REFERENCES %s (%s)' % (
+                    quote(residue_table), quote(column),
+                    quote('%s_refs_sidechain' % residue_table),
+                    quote(column), quote(sidechain_table), quote('id')))
+
+        for resname, fields in sorted(sidechain_string_dict.items()):
+            table = 'pgd_core_sidechain_%s' % resname.lower()
+            if table not in tables:
+                continue
+            old_column = 'sidechain_%s_id' % resname
+            # sidechains take the id of their residue
+            columns = [field.replace('-', '_') for field in fields]
+            self.cursor.execute(
+                'INSERT INTO %s (%s, %s) SELECT r.%s, %s FROM %s r '
+                'JOIN %s s ON s.%s = r.%s' % (
+                    quote(sidechain_table), quote('id'),
+                    ', '.join(quote(sidechain_column(resname, c))
+                              for c in columns),
+                    quote('id'),
+                    ', '.join('s.%s' % quote(c) for c in columns),
+                    quote(residue_table), quote(table), quote('id'),
+                    quote(old_column)))
+            self.cursor.execute(
+                'UPDATE %s SET %s = %s WHERE %s IS NOT NULL' % (
+                    quote(residue_table), quote(column), quote('id'),
+                    quote(old_column)))
+            self.drop_column(residue_table, old_column)
+            self.cursor.execute('DROP TABLE %s' % quote(table))
+            self.stdout.write('%s: %s sidechains' % (
+                resname, Residue.objects.filter(
+                    **{'sidechain__%s__isnull' % sidechain_column(
+                        resname, columns[0]): False}).count()))
+
+        # the windows gained a sidechain column per position
+        recreate_window_table()
+
+    def columns(self, table):
+        return [row[0] for row in connection.introspection \
+                .get_table_description(self.cursor, table)]
+
+    def drop_column(self, table, column):
+        """
+        Drops a column after the foreign keys that use it
+        """
+        self.cursor.execute("""
+            SELECT CONSTRAINT_NAME
+            FROM information_schema.KEY_COLUMN_USAGE
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+              AND COLUMN_NAME = %s
+              AND REFERENCED_TABLE_NAME IS NOT NULL""", [table, column])
+        for (name,) in self.cursor.fetchall():
+            self.cursor.execute('ALTER TABLE %s DROP FOREIGN KEY %s' % (
+                quote(table), quote(name)))
+        self.cursor.execute('ALTER TABLE %s DROP COLUMN %s' % (
+            quote(table), quote(column)))
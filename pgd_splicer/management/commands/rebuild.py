@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+import os
+import tempfile
+
+from pgd_splicer.ProcessPDBTask import check_schema, load_pdb
+from pgd_splicer.rebuild import (RebuildError, TableFiles, load_tables,
+                                 read_selection, rollback)
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--selection',
+                    default=False,
+                    help='rebuild the proteins listed in FILE'),
+        make_option('--dir',
+                    default=False,
+                    help='write the table files to DIR, a temporary '
+                         'directory by default'),
+        make_option('--keep-files',
+                    action='store_true',
+                    default=False,
+                    help='keep the table files after loading them'),
+        make_option('--data-version',
+                    default=False,
+                    help='version of the rebuilt data, the DATA_VERSION '
+                         'setting by default'),
+        make_option('--rollback',
+                    action='store_true',
+                    default=False,
+                    help='swap the tables replaced by the last rebuild back '
+                         'in'),
+    )
+    help = ('Rebuilds the protein tables from the parse cache with bulk '
+            'loads into shadow tables, which then replace the live tables '
+            'at once.  All proteins, chains, residues, sidechains and '
+            'search windows are replaced, together with the plot cube '
+            'summed from the new windows.')
+
+    def handle(self, *args, **options):
+        if options['rollback']:
+            try:
+                rollback(self.stdout.write)
+            except RebuildError, e:
+                raise CommandError(e)
+            return
+
+        selection = options['selection']
+        if not selection:
+            raise CommandError('Selection file required!')
+        if not os.path.exists(selection):
+            raise CommandError('Selection file does not exist!')
+        if not settings.PARSE_CACHE_DIR:
+            raise CommandError('PARSE_CACHE_DIR must be set to rebuild')
+        try:
+            check_schema()
+        except Exception, e:
+            raise CommandError(e)
+
+        directory = options['dir'] or tempfile.mkdtemp(prefix='pgd-rebuild-')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        table_files = TableFiles(directory)
+        try:
+            table_files.write_version(options['data_version'] or
+                                      settings.DATA_VERSION)
+            missing = []
+            for data in read_selection(selection):
+                try:
+                    data = load_pdb(data)
+                    if not data['pdb_date']:
+                        raise Exception('Cached parse has no pdb date')
+                except Exception, e:
+                    self.stderr.write('%s: %s' % (data['code'], e))
+                    missing.append(data['code'])
+                    continue
+                table_files.write_protein(data)
+            table_files.close()
+            self.stdout.write('Wrote table files to %s, %s proteins could '
+                              'not be loaded from the cache'
+                              % (directory, len(missing)))
+
+            load_tables(table_files, self.stdout.write)
+            for table_file in table_files:
+                self.stdout.write('%s: %s rows' % (table_file.table,
+                                                   table_file.rows))
+        except RebuildError, e:
+            raise CommandError(e)
+        finally:
+            if not options['keep_files']:
+                table_files.close()
+                for table_file in table_files:
+                    os.remove(table_file.path)
+                if not options['dir']:
+                    os.rmdir(directory)
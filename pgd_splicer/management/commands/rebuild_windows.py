@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pgd_splicer.windows import recreate_window_table
+
+
+class Command(BaseCommand):
+    help = ('Recreates the search window table from the current model and '
+            'stores the windows of all proteins and the plot cube.  Run '
+            'this after upgrading to a version that changes the window '
+            'columns.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            recreate_window_table()
+        self.stdout.write('Stored windows of all proteins')
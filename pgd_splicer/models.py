@@ -16,5 +16,7 @@ pdb_select_settings = PDBSelectSettings()
 class FTPUpdateSettings():
     PDB_FTP_HOST   = 'ftp.ebi.ac.uk'
     PDB_REMOTE_DIR = '/pub/databases/rcsb/pdb/data/structures/all/pdb/'
+    # entries too large for the pdb format are only available as mmCIF
+    PDB_CIF_REMOTE_DIR = '/pub/databases/rcsb/pdb/data/structures/all/mmCIF/'
     PDB_LOCAL_DIR  = './pdb/'
 ftp_update_settings = FTPUpdateSettings()
\ No newline at end of file
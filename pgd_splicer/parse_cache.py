@@ -0,0 +1,233 @@
+"""
+Cache of parsed proteins.
+
+The residue dicts produced by parseWithBioPython only depend on the pdb file
+and the splicer code.  Saving them allows the database to be rebuilt, e.g.
+after a schema change, without running Bio.PDB and DSSP again.
+
+Each protein is stored as a .npz file.  Every residue property is a column
+with one value per residue, sidechain properties are prefixed with
+'sidechain.'.  Residue dicts do not all have the same keys and values may
+be None, so columns that aren't simple floats or strings have a state column
+recording how each value is restored:
+
+    0 - key is absent
+    1 - None
+    2 - stored value (float or string)
+    3 - int
+    4 - bool
+
+Metadata is stored as JSON in the 'meta' entry: the hash of the pdb file,
+the splicer version, the date of the pdb file, the chain filter used while
+parsing and the parsed chains.
+
+The cache is enabled by setting PARSE_CACHE_DIR.
+"""
+
+from datetime import datetime
+import hashlib
+import json
+import os
+from tempfile import NamedTemporaryFile
+
+import numpy
+
+# Increment when the output of parseWithBioPython changes, existing cache
+# entries will no longer be used.
+SPLICER_VERSION = 1
+
+ABSENT, NONE, VALUE, INT, BOOL = range(5)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def file_hash(path):
+    """
+    SHA-1 of a pdb file
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), ''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def cache_path(cache_dir, code):
+    return os.path.join(cache_dir, 'pdb%s.npz' % code.lower())
+
+
+# marks keys missing from a residue dict
+class _Absent(object):
+    pass
+
+_absent = _Absent()
+
+
+def _state(value):
+    if value is None:
+        return NONE
+    if isinstance(value, bool):
+        return BOOL
+    if isinstance(value, (int, long)):
+        return INT
+    return VALUE
+
+
+def _encode(values):
+    """
+    Encode a list of values (_absent for absent keys) as a column and a
+    state column.  The state column is None if it isn't needed.
+    """
+    states = numpy.array([ABSENT if v is _absent else _state(v)
+                          for v in values], 'u1')
+    present = [v for v in values if v is not _absent and v is not None]
+
+    if any(isinstance(v, basestring) for v in present):
+        column = numpy.array([str(v) if v is not _absent and v is not None
+                              else '' for v in values])
+    else:
+        column = numpy.array([float(v) if v is not _absent and v is not None
+                              else 0 for v in values], 'd')
+
+    if (states == VALUE).all():
+        states = None
+    return column, states
+
+
+def _decode(value, state):
+    if state == VALUE:
+        return value.item() if hasattr(value, 'item') else value
+    if state == INT:
+        return int(value)
+    if state == BOOL:
+        return bool(float(value))
+    return None
+
+
+def write_entry(path, data, pdb_hash, chains_filter=None):
+    """
+    Writes the parsed chains of a protein.  The entry is written to a
+    temporary file and renamed so that a partial entry is never read.
+
+    @param chains_filter: chains the protein was parsed with
+    """
+    residues = []
+    for chain_id, chain in sorted(data['chains'].items()):
+        residues.extend(sorted(chain.values(), key=lambda r: r['chainIndex']))
+
+    fields = set()
+    sidechain_fields = set()
+    for residue in residues:
+        fields.update(residue)
+        sidechain_fields.update(residue.get('sidechain', ()))
+    fields.discard('sidechain')
+
+    columns = {}
+    for name in fields:
+        columns[name] = [r.get(name, _absent) for r in residues]
+    for name in sidechain_fields:
+        columns['sidechain.%s' % name] = [r.get('sidechain', {}).get(name, _absent)
+                                          for r in residues]
+
+    arrays = {}
+    for name, values in columns.items():
+        column, states = _encode(values)
+        arrays['field:%s' % name] = column
+        if states is not None:
+            arrays['state:%s' % name] = states
+
+    meta = {'code': data['code'],
+            'hash': pdb_hash,
+            'splicer_version': SPLICER_VERSION,
+            'pdb_date': data['pdb_date'].strftime(DATE_FORMAT)
+                        if data.get('pdb_date') else None,
+            'chains_filter': chains_filter,
+            'chains': sorted(data['chains'])}
+    arrays['meta'] = numpy.array(json.dumps(meta))
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created by another process
+            pass
+    out = NamedTemporaryFile(dir=directory, suffix='.npz', delete=False)
+    numpy.savez_compressed(out, **arrays)
+    out.close()
+    os.rename(out.name, path)
+
+
+def read_chains(entry, meta):
+    """
+    Restores the residue dicts of a cache entry, in the same structure as
+    data['chains'] produced by parseWithBioPython.
+    """
+    columns = {}
+    for key in entry.files:
+        if key.startswith('field:'):
+            name = key[6:]
+            state_key = 'state:%s' % name
+            states = entry[state_key] if state_key in entry.files else None
+            columns[name] = (entry[key], states)
+
+    chains = dict((str(chain_id), {}) for chain_id in meta['chains'])
+    count = len(columns['chainIndex'][0]) if columns else 0
+    for i in range(count):
+        residue = {}
+        sidechain = {}
+        for name, (column, states) in columns.items():
+            state = VALUE if states is None else states[i]
+            if state == ABSENT:
+                continue
+            value = _decode(column[i], state)
+            if name.startswith('sidechain.'):
+                sidechain[name[10:]] = value
+            else:
+                residue[name] = value
+        if sidechain:
+            residue['sidechain'] = sidechain
+        chains[residue['chain']][residue['oldID']] = residue
+    return chains
+
+
+def load(cache_dir, code, pdb_hash=None):
+    """
+    Loads the parsed chains of a protein.  The entry is only used if it was
+    created by the current splicer version and, if pdb_hash is given, from
+    the same pdb file.
+
+    @return (meta, chains) or None if there is no usable entry
+    """
+    path = cache_path(cache_dir, code)
+    if not os.path.exists(path):
+        return None
+
+    with numpy.load(path) as entry:
+        meta = json.loads(entry['meta'].item())
+        if meta['splicer_version'] != SPLICER_VERSION:
+            return None
+        if pdb_hash is not None and meta['hash'] != pdb_hash:
+            return None
+        chains = read_chains(entry, meta)
+
+    if meta['pdb_date']:
+        meta['pdb_date'] = datetime.strptime(meta['pdb_date'], DATE_FORMAT)
+    return meta, chains
+
+
+def select_chains(meta, chains, chains_filter):
+    """
+    Selects the chains requested by chains_filter from a cache entry.
+
+    @return dict of chains, or None if the entry was parsed with a filter
+            that excluded some of the requested chains
+    """
+    cached_filter = meta['chains_filter']
+    if cached_filter is not None:
+        if chains_filter is None or not set(chains_filter) <= set(cached_filter):
+            return None
+    if chains_filter is None:
+        return chains
+    return dict((chain_id, residues) for chain_id, residues in chains.items()
+                if chain_id in chains_filter)
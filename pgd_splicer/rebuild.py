@@ -0,0 +1,474 @@
+"""
+Full rebuild of the protein tables with bulk loads.
+
+Inserting millions of residues through the ORM, even in batches, is slow
+because every row updates the indexes and checks the foreign keys of its
+table.  A rebuild instead writes the rows of every table to a tab separated
+file and loads the files into empty shadow tables without secondary indexes
+or foreign keys.  The indexes are added afterwards, so each index is built
+once from sorted data.
+
+The live tables are not touched while loading, searches keep running
+against the current data.  Once every shadow table holds the expected
+number of rows, all live tables are renamed to old tables and the shadow
+tables take their place at once.  The DataVersion table is rebuilt along
+with the protein tables, so the data version changes with the data.  The
+plot cube is summed from the shadow window table into a shadow cube table
+before the swap and is swapped in with them, so plots never see a cube of
+other windows.  The old tables are kept until the next rebuild, rollback
+swaps them back in.
+
+    MySQL  - files are loaded with LOAD DATA LOCAL INFILE, which must be
+             enabled for the connection, e.g. with 'local_infile': 1 in the
+             OPTIONS of the database settings.  Foreign key and unique
+             checks are disabled while loading.  The tables are swapped
+             with a single RENAME TABLE statement.
+    SQLite - rows are inserted with executemany, for local testing.  The
+             tables are renamed in one transaction.
+
+Ids are assigned while writing the files: residues are numbered from 1 and
+each sidechain uses the id of its residue, as in bulk_store_pdb.  The
+search windows of the residues are written along with them.  Values are
+written as text, NULL as \\N.  None of the values written contain tabs or
+newlines, so no escaping is done.
+"""
+
+import os
+import time
+
+from django.db import connection, transaction
+from django.db.models import FloatField
+from django.utils import timezone
+
+from pgd_core.models import (Protein as ProteinModel, Chain as ChainModel,
+                             Residue as ResidueModel, Sidechain, DataVersion)
+from pgd_search.models import PlotCube, ResidueWindow
+from pgd_splicer.cube import cube_sql
+from pgd_splicer.ProcessPDBTask import protein_args, sidechain_values
+from pgd_splicer.windows import window_rows
+
+NULL = '\\N'
+
+SHADOW_SUFFIX = '_shadow'
+OLD_SUFFIX = '_old'
+
+# tables in the order they are loaded
+MODELS = [DataVersion, ProteinModel, ChainModel, Sidechain, ResidueModel,
+          ResidueWindow]
+
+# tables swapped by a rebuild: the loaded tables and the plot cube summed
+# from the loaded windows
+SWAPPED_MODELS = MODELS + [PlotCube]
+
+
+# start of the version line dunbrack_selector.py prints before the proteins
+VERSION_PREFIX = 'VERSION:'
+
+
+class RebuildError(Exception):
+    pass
+
+
+def read_selection(path):
+    """
+    Reads the proteins of a selection file, a line per protein as read by
+    ProcessPDBTask.protein_args.  Blank lines and the version line of
+    dunbrack_selector.py are skipped.
+
+    @return list of protein dicts as passed to ProcessPDBTask
+    @raise RebuildError: if any other line is not a protein
+    """
+    pdbs = []
+    for number, line in enumerate(open(path), 1):
+        if not line.strip() or line.startswith(VERSION_PREFIX):
+            continue
+        try:
+            pdbs.append(protein_args(line.split()))
+        except (IndexError, ValueError):
+            raise RebuildError('Line %s of %s is not a protein: %r'
+                               % (number, path, line.rstrip('\n')))
+    return pdbs
+
+
+def tsv_value(field, value):
+    if value is None:
+        return NULL
+    if isinstance(field, FloatField):
+        return repr(float(value))
+    value = field.get_db_prep_save(value, connection)
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return unicode(value).encode('utf-8')
+
+
+class TableFile(object):
+    """
+    Tab separated file of the rows of a model's table.  Fields missing from
+    a row get their default, as they would when saving a new object.
+    """
+
+    def __init__(self, model, directory):
+        self.model = model
+        self.table = model._meta.db_table
+        self.fields = model._meta.concrete_fields
+        self.columns = [field.column for field in self.fields]
+        self.defaults = dict((field.attname, field.get_default())
+                             for field in self.fields)
+        self.path = os.path.join(directory, '%s.tsv' % self.table)
+        self.out = open(self.path, 'w')
+        self.rows = 0
+
+    def write(self, values):
+        self.out.write('%s\n' % '\t'.join(
+            tsv_value(field, values[field.attname] if field.attname in values
+                      else self.defaults[field.attname])
+            for field in self.fields))
+        self.rows += 1
+
+    def close(self):
+        self.out.close()
+
+
+class TableFiles(object):
+    """
+    Writes parsed proteins into the TableFiles of all tables
+    """
+
+    def __init__(self, directory):
+        self.files = dict((model, TableFile(model, directory))
+                          for model in MODELS)
+        self.next_id = 1
+        self.version = None
+
+    def write_version(self, version):
+        self.version = version
+        self.files[DataVersion].write({'id': 1, 'version': version,
+                                       'imported': timezone.now()})
+
+    def write_protein(self, data):
+        code = data['code']
+        self.files[ProteinModel].write({
+            'code': code,
+            'threshold': data['threshold'],
+            'resolution': data['resolution'],
+            'rfactor': data['rfactor'],
+            'rfree': data['rfree'],
+            'pdb_date': data['pdb_date']})
+
+        rows = []
+        for chaincode, residues in sorted(data['chains'].items()):
+            chain_id = '%s%s' % (code, chaincode)
+            self.files[ChainModel].write({'id': chain_id, 'protein_id': code,
+                                          'code': chaincode})
+
+            residues = sorted(residues.values(), key=lambda r: r['chainIndex'])
+            ids = {}
+            for residue_props in residues:
+                ids[residue_props['chainIndex']] = self.next_id
+                self.next_id += 1
+
+            for residue_props in residues:
+                id = ids[residue_props['chainIndex']]
+                values = dict(residue_props)
+                values.update({'id': id, 'protein_id': code,
+                               'chain_id': chain_id,
+                               'oldID': str(residue_props['oldID'])})
+                if 'sidechain' in residue_props:
+                    sidechain = sidechain_values(residue_props['aa'],
+                                                 residue_props['sidechain'])
+                    sidechain['id'] = id
+                    self.files[Sidechain].write(sidechain)
+                    values['sidechain_id'] = id
+                self.files[ResidueModel].write(values)
+                rows.append(values)
+
+        for window in window_rows(rows, data):
+            self.files[ResidueWindow].write(window)
+
+    def close(self):
+        for table_file in self.files.values():
+            table_file.close()
+
+    def __iter__(self):
+        return (self.files[model] for model in MODELS)
+
+
+def quote(name):
+    return connection.ops.quote_name(name)
+
+
+def shadow_table(table):
+    return '%s%s' % (table, SHADOW_SUFFIX)
+
+
+def old_table(table):
+    return '%s%s' % (table, OLD_SUFFIX)
+
+
+def tagged(name, tag):
+    """
+    Names an index or constraint of a shadow table.  These names must be
+    unique in the database, so the name of the live table's index is tagged
+    with the rebuild, replacing the tag of an earlier rebuild.
+    """
+    return '%s__%s' % (name.split('__')[0], tag)
+
+
+class Loader(object):
+    """
+    Creates shadow tables, loads table files into them and swaps them with
+    the live tables.  The SQLite loader is the base, MySQLLoader overrides
+    what differs.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def begin(self):
+        pass
+
+    def end(self):
+        pass
+
+    def drop_table(self, table):
+        self.cursor.execute('DROP TABLE IF EXISTS %s' % quote(table))
+
+    def table_exists(self, table):
+        return table in connection.introspection.table_names(self.cursor)
+
+    def create_shadow(self, table):
+        """
+        Creates an empty copy of a table without secondary indexes
+        """
+        shadow = shadow_table(table)
+        self.drop_table(shadow)
+        self.cursor.execute("SELECT sql FROM sqlite_master "
+                            "WHERE type = 'table' AND name = %s", [table])
+        sql = self.cursor.fetchone()[0]
+        self.cursor.execute(sql.replace(quote(table), quote(shadow), 1))
+
+    def add_indexes(self, table, tag):
+        """
+        Adds the secondary indexes of a table to its shadow table
+        """
+        shadow = shadow_table(table)
+        self.cursor.execute("SELECT name, sql FROM sqlite_master "
+                            "WHERE type = 'index' AND tbl_name = %s "
+                            "AND sql IS NOT NULL", [table])
+        for name, sql in self.cursor.fetchall():
+            sql = sql.replace(quote(name), quote(tagged(name, tag)), 1)
+            self.cursor.execute(sql.replace(' ON %s' % quote(table),
+                                            ' ON %s' % quote(shadow), 1))
+
+    def load(self, table_file, table):
+        placeholders = ', '.join(['%s'] * len(table_file.columns))
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            quote(table), ', '.join(quote(c) for c in table_file.columns),
+            placeholders)
+        with open(table_file.path) as f, transaction.atomic():
+            rows = ([None if v == NULL else v.decode('utf-8')
+                     for v in line.rstrip('\n').split('\t')] for line in f)
+            self.cursor.executemany(sql, rows)
+
+    def count(self, table):
+        self.cursor.execute('SELECT COUNT(*) FROM %s' % quote(table))
+        return self.cursor.fetchone()[0]
+
+    def rename(self, renames):
+        """
+        Renames tables in a single transaction.  References of other tables
+        are left alone, they name the live tables.
+
+        @param renames: list of (table, new name)
+        """
+        self.cursor.execute('PRAGMA legacy_alter_table = ON')
+        try:
+            with transaction.atomic():
+                for table, name in renames:
+                    self.cursor.execute('ALTER TABLE %s RENAME TO %s'
+                                        % (quote(table), quote(name)))
+        finally:
+            self.cursor.execute('PRAGMA legacy_alter_table = OFF')
+
+
+class MySQLLoader(Loader):
+
+    def begin(self):
+        self.cursor.execute('SET foreign_key_checks = 0')
+        self.cursor.execute('SET unique_checks = 0')
+
+    def end(self):
+        self.cursor.execute('SET unique_checks = 1')
+        self.cursor.execute('SET foreign_key_checks = 1')
+
+    def indexes(self, table):
+        """
+        @return dict mapping the name of each secondary index to a tuple of
+                (unique, list of columns)
+        """
+        self.cursor.execute('SHOW INDEX FROM %s' % quote(table))
+        indexes = {}
+        for row in self.cursor.fetchall():
+            non_unique, name, seq, column = row[1:5]
+            if name != 'PRIMARY':
+                indexes.setdefault(name, (not non_unique, {}))[1][seq] = column
+        return dict((name, (unique, [columns[seq] for seq in sorted(columns)]))
+                    for name, (unique, columns) in indexes.items())
+
+    def foreign_keys(self, table):
+        """
+        @return list of (name, column, referenced table, referenced column)
+        """
+        self.cursor.execute("""
+            SELECT CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME,
+                   REFERENCED_COLUMN_NAME
+            FROM information_schema.KEY_COLUMN_USAGE
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+              AND REFERENCED_TABLE_NAME IS NOT NULL""", [table])
+        return self.cursor.fetchall()
+
+    def create_shadow(self, table):
+        # CREATE TABLE ... LIKE copies the indexes but not the foreign keys
+        shadow = shadow_table(table)
+        self.drop_table(shadow)
+        self.cursor.execute('CREATE TABLE %s LIKE %s' % (quote(shadow),
+                                                         quote(table)))
+        indexes = self.indexes(shadow)
+        if indexes:
+            self.cursor.execute('ALTER TABLE %s %s' % (quote(shadow), ', '.join(
+                'DROP INDEX %s' % quote(name) for name in indexes)))
+
+    def add_indexes(self, table, tag):
+        """
+        Adds the secondary indexes and foreign keys of a table to its shadow
+        table.  Foreign keys to tables that are rebuilt reference their
+        shadow tables, and follow them when they are renamed.
+        """
+        shadow = shadow_table(table)
+        indexes = self.indexes(table)
+        if indexes:
+            self.cursor.execute('ALTER TABLE %s %s' % (quote(shadow), ', '.join(
+                'ADD %sINDEX %s (%s)' % ('UNIQUE ' if unique else '',
+                                         quote(name),
+                                         ', '.join(quote(c) for c in columns))
+                for name, (unique, columns) in indexes.items())))
+        foreign_keys = self.foreign_keys(table)
+        if foreign_keys:
+            rebuilt = set(model._meta.db_table for model in MODELS)
+            self.cursor.execute('ALTER TABLE %s %s' % (quote(shadow), ', '.join(
+                'ADD CONSTRAINT %s FOREIGN KEY (%s) REFERENCES %s (%s)' % (
+                    quote(tagged(name, tag)), quote(column),
+                    quote(shadow_table(ref_table) if ref_table in rebuilt
+                          else ref_table),
+                    quote(ref_column))
+                for name, column, ref_table, ref_column in foreign_keys)))
+
+    def load(self, table_file, table):
+        self.cursor.execute(
+            "LOAD DATA LOCAL INFILE %%s INTO TABLE %s "
+            "CHARACTER SET utf8 "
+            "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' (%s)" % (
+                quote(table),
+                ', '.join(quote(c) for c in table_file.columns)),
+            [os.path.abspath(table_file.path)])
+
+    def rename(self, renames):
+        # a single RENAME TABLE statement is atomic
+        self.cursor.execute('RENAME TABLE %s' % ', '.join(
+            '%s TO %s' % (quote(table), quote(name))
+            for table, name in renames))
+
+
+def get_loader(cursor):
+    if connection.vendor == 'mysql':
+        return MySQLLoader(cursor)
+    if connection.vendor == 'sqlite':
+        return Loader(cursor)
+    raise RebuildError('Rebuilds are only supported on MySQL and SQLite')
+
+
+def load_tables(table_files, report=None):
+    """
+    Loads the table files into shadow tables, checks that every row was
+    loaded, sums the plot cube of the loaded windows and swaps the shadow
+    tables with the live tables.  The live tables are kept as old tables,
+    replacing those of the rebuild before.
+
+    @param report: function called with a line describing each step
+    @raise RebuildError: if a table has a different number of rows than its
+                         file.  The live tables are not changed.
+    """
+    report = report or (lambda line: None)
+    cursor = connection.cursor()
+    loader = get_loader(cursor)
+    # rebuilds run back to back need different tags
+    tag = format(int(time.time() * 1000000), 'x')
+    tables = [table_file.table for table_file in table_files]
+    cube_table = PlotCube._meta.db_table
+
+    loader.begin()
+    try:
+        for table in tables + [cube_table]:
+            loader.create_shadow(table)
+        for table_file in table_files:
+            report('Loading %s rows into %s' % (
+                table_file.rows, shadow_table(table_file.table)))
+            loader.load(table_file, shadow_table(table_file.table))
+        for table in tables:
+            report('Adding indexes to %s' % shadow_table(table))
+            loader.add_indexes(table, tag)
+    finally:
+        loader.end()
+
+    errors = []
+    for table_file in table_files:
+        count = loader.count(shadow_table(table_file.table))
+        if count != table_file.rows:
+            errors.append('%s has %s rows, expected %s' % (
+                shadow_table(table_file.table), count, table_file.rows))
+    if errors:
+        raise RebuildError('; '.join(errors))
+
+    report('Summing the plot cube into %s' % shadow_table(cube_table))
+    with transaction.atomic():
+        cursor.execute(cube_sql(shadow_table(cube_table),
+                                shadow_table(ResidueWindow._meta.db_table)),
+                       [table_files.version])
+    loader.add_indexes(cube_table, tag)
+    tables.append(cube_table)
+
+    report('Swapping in the new tables')
+    # the old tables of the last rebuild reference each other, they are
+    # dropped children first with the checks off
+    loader.begin()
+    try:
+        for table in reversed(tables):
+            loader.drop_table(old_table(table))
+    finally:
+        loader.end()
+    loader.rename([(table, old_table(table)) for table in tables] +
+                  [(shadow_table(table), table) for table in tables])
+
+
+def rollback(report=None):
+    """
+    Swaps the live tables with the old tables kept by the last rebuild.
+    Rolling back twice restores the rebuilt tables.
+    """
+    report = report or (lambda line: None)
+    loader = get_loader(connection.cursor())
+    tables = [model._meta.db_table for model in SWAPPED_MODELS]
+    missing = [old_table(table) for table in tables
+               if not loader.table_exists(old_table(table))]
+    if missing:
+        raise RebuildError('No tables to roll back to: %s'
+                           % ', '.join(missing))
+
+    report('Swapping in the old tables')
+    for table in reversed(tables):
+        loader.drop_table(shadow_table(table))
+    loader.rename([(table, shadow_table(table)) for table in tables] +
+                  [(old_table(table), table) for table in tables] +
+                  [(shadow_table(table), old_table(table)) for table in tables])
@@ -0,0 +1,81 @@
+"""
+Comparison of parsed residues with the rows stored by a previous import.
+
+When an entry is re-released most of its values are unchanged.  Instead of
+overwriting every row, the stored rows are compared with the freshly
+computed ones and only the fields that changed are written.  Floating point
+fields are compared with a per-field tolerance so that differences far below
+the precision of the coordinates do not cause writes, all other fields must
+be equal.
+"""
+
+from pgd_core.models import sidechain_column
+from pgd_splicer.sidechain import (bond_angles_string_dict,
+                                   bond_lengths_string_dict)
+
+# tolerances of the floating point fields, in angstroms, degrees, or the
+# units of the B-factors and energies
+LENGTH_TOLERANCE = 1e-4
+ANGLE_TOLERANCE = 1e-3
+BFACTOR_TOLERANCE = 1e-3
+ENERGY_TOLERANCE = 1e-3
+
+FIELD_TOLERANCES = dict(
+    [(field, LENGTH_TOLERANCE) for field in
+     ('L1', 'L2', 'L3', 'L4', 'L5', 'L6', 'L7')] +
+    [(field, ANGLE_TOLERANCE) for field in
+     ('a1', 'a2', 'a3', 'a4', 'a5', 'a6', 'a7', 'phi', 'psi', 'ome', 'omep',
+      'chi1', 'chi2', 'chi3', 'chi4', 'chi5', 'zeta')] +
+    [(field, BFACTOR_TOLERANCE) for field in ('bm', 'bs', 'bg')] +
+    [('h_bond_energy', ENERGY_TOLERANCE)] +
+    # sidechain columns, e.g. ARG_CB_CG and PRO_CD_N_C_1
+    [(sidechain_column(resname, field), LENGTH_TOLERANCE)
+     for resname, fields in bond_lengths_string_dict.items()
+     for field in fields] +
+    [(sidechain_column(resname, field), ANGLE_TOLERANCE)
+     for resname, fields in bond_angles_string_dict.items()
+     for field in fields])
+
+
+def tolerance(field):
+    """
+    Tolerance of a field, 0 for fields that must be equal
+    """
+    return FIELD_TOLERANCES.get(field, 0)
+
+
+def equal(field, old, new):
+    if old is None or new is None:
+        return old is None and new is None
+    if isinstance(old, float) or isinstance(new, float):
+        return abs(old - new) <= tolerance(field)
+    return old == new
+
+
+def changed_fields(old, new):
+    """
+    @param old: stored row, a dict of field values
+    @param new: computed row, a dict of the field values to compare
+    @return dict of the fields of new that differ from old
+    """
+    return dict((field, value) for field, value in new.items()
+                if not equal(field, old.get(field), value))
+
+
+def new_summary():
+    """
+    Per-protein change summary:
+        unchanged - residues that were not written
+        updated - residues, or their sidechains, with changed fields
+        inserted - residues that were not stored yet
+        deleted - stored residues that are no longer present
+        fields - number of fields written by updates
+    """
+    return {'unchanged': 0, 'updated': 0, 'inserted': 0, 'deleted': 0,
+            'fields': 0}
+
+
+def format_summary(summary):
+    return '%(updated)s updated, %(inserted)s inserted, %(deleted)s ' \
+           'deleted, %(unchanged)s unchanged residues, %(fields)s fields ' \
+           'written' % summary
@@ -0,0 +1,115 @@
+"""
+Scheduling of proteins across the import pool.
+
+Parsing time varies by orders of magnitude between proteins.  Dispatching
+them in cull file order lets a few large structures near the end keep one
+core busy while the others are idle.  Instead proteins are ordered longest
+first by their estimated cost and grouped into chunks that shrink as the
+remaining work shrinks (guided self-scheduling): chunks are large while
+there is plenty of work, keeping dispatch overhead low, and the last chunks
+hold single proteins so that all workers finish at about the same time.
+
+The cost of a protein is its parse time in a previous run, read from the
+event log, or else estimated from the size of its compressed file.
+"""
+
+import json
+import os
+
+# target number of chunks per process for the remaining work
+CHUNK_FACTOR = 4
+
+
+def load_runtimes(log_file):
+    """
+    Reads the wall time of each protein parsed in previous runs from an
+    event log.  The latest run of a protein wins.
+
+    @return dict mapping protein code to seconds
+    """
+    runtimes = {}
+    if not log_file or not os.path.exists(log_file):
+        return runtimes
+    for line in open(log_file):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # partial line written while the import died
+            continue
+        if event.get('event') == 'parsed':
+            runtimes[event['code']] = sum(event.get('stages', {}).values())
+    return runtimes
+
+
+def estimate_costs(pdbs, sizes, runtimes=None):
+    """
+    Estimates the cost of each protein in seconds.  Proteins without a
+    runtime are estimated from their file size, scaled by the seconds per
+    byte of the proteins that have both.
+
+    @param sizes: dict mapping protein code to file size in bytes
+    @param runtimes: dict mapping protein code to seconds
+    @return dict mapping protein code to cost
+    """
+    runtimes = runtimes or {}
+    known = [data['code'] for data in pdbs
+             if data['code'] in runtimes and sizes.get(data['code'])]
+    known_size = sum(sizes[code] for code in known)
+    if known_size:
+        rate = sum(runtimes[code] for code in known) / float(known_size)
+    else:
+        rate = 1.0
+
+    costs = {}
+    for data in pdbs:
+        code = data['code']
+        if code in runtimes:
+            costs[code] = runtimes[code]
+        else:
+            costs[code] = sizes.get(code, 0) * rate
+    return costs
+
+
+def file_sizes(pdbs, path):
+    """
+    @param path: function returning the path of a protein's file
+    @return dict mapping protein code to file size, 0 if missing
+    """
+    sizes = {}
+    for data in pdbs:
+        filename = path(data['code'])
+        sizes[data['code']] = os.path.getsize(filename) \
+            if os.path.exists(filename) else 0
+    return sizes
+
+
+def longest_first(pdbs, costs):
+    return sorted(pdbs, key=lambda data: costs[data['code']], reverse=True)
+
+
+def chunks(pdbs, costs, processes, factor=CHUNK_FACTOR):
+    """
+    Groups proteins, ordered longest first, into chunks.  A chunk is closed
+    once its cost reaches the remaining cost divided by factor * processes,
+    so chunks shrink towards single proteins at the end of the run.
+
+    @return list of lists of proteins
+    """
+    remaining = sum(costs[data['code']] for data in pdbs)
+    grouped = []
+    chunk = []
+    chunk_cost = 0
+    target = remaining / float(factor * processes)
+    for data in pdbs:
+        cost = costs[data['code']]
+        chunk.append(data)
+        chunk_cost += cost
+        remaining -= cost
+        if chunk_cost >= target:
+            grouped.append(chunk)
+            chunk = []
+            chunk_cost = 0
+            target = remaining / float(factor * processes)
+    if chunk:
+        grouped.append(chunk)
+    return grouped
@@ -0,0 +1,221 @@
+"""
+Import telemetry.
+
+Worker processes describe what happened to each protein with an event, a
+plain dict that is sent back to the parent process:
+
+    {'event': 'parsed', 'code': '1ABC', 'residues': 120,
+     'stages': {'parse': 0.2, ...}, 'invalid': {'missing_atom': 2}}
+    {'event': 'failed', 'code': '1ABC', 'stage': 'parse',
+     'reason': 'ValueError'}
+    {'event': 'saved', 'code': '1ABC', 'residues': 120, 'stages': {'db': 1.1},
+     'pdb_hash': '...', 'pdb_date': '2013-01-01 00:00:00.000000'}
+
+Proteins saved by diff_store_pdb also carry their change summary, see
+residue_diff.py:
+
+    {'event': 'saved', ..., 'changes': {'updated': 3, 'inserted': 0, ...}}
+
+Events also name the worker process that produced them, the time it spent
+on the protein and when it finished:
+
+    {..., 'worker': 'pool-1234', 'worker_started': 1400000000.0,
+     'busy': 0.7, 'finished': 1400000005.2}
+
+The parent records events in a Telemetry object which keeps counters,
+latency histograms and the utilization of each worker, writes a rolling
+JSON status file and optionally logs every event as one line of JSON.
+"""
+
+from bisect import bisect_left
+from datetime import datetime
+import json
+import os
+import time
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, 100, 300)
+
+# minimum number of seconds between writes of the status file
+STATUS_INTERVAL = 5
+
+
+class Histogram(object):
+    """
+    Histogram of latencies with fixed, logarithmic buckets
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        """
+        Upper bound of the bucket containing the given percentile
+        """
+        if not self.count:
+            return None
+        target = self.count * percent / 100.0
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count,
+                'total': self.total,
+                'mean': self.total / self.count if self.count else None,
+                'min': self.min,
+                'max': self.max,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'buckets': dict(('<=%s' % bound, count) for bound, count
+                                in zip(BUCKETS + ('inf',), self.counts)
+                                if count)}
+
+
+class Telemetry(object):
+    """
+    Collects the events of an import.
+
+    @param total: number of proteins that will be processed
+    @param status_file: path of the JSON status file, or None
+    @param log_file: path of the event log, or None
+    """
+
+    def __init__(self, total, status_file=None, log_file=None):
+        self.total = total
+        self.status_file = status_file
+        self.log = open(log_file, 'a') if log_file else None
+        self.started = time.time()
+        self.written = 0
+        self.counters = {}
+        self.histograms = {}
+        self.workers = {}
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def histogram(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        return self.histograms[name]
+
+    @property
+    def finished(self):
+        """
+        Number of proteins that were saved or failed
+        """
+        return self.counters.get('saved', 0) + self.counters.get('failed', 0)
+
+    def record(self, event):
+        """
+        Records an event from a worker
+        """
+        name = event['event']
+        self.count(name)
+        if name == 'failed':
+            self.count('failed.%s.%s' % (event['stage'], event['reason']))
+        if name == 'saved':
+            self.count('residues', event.get('residues', 0))
+        for change, count in event.get('changes', {}).items():
+            self.count('changes.%s' % change, count)
+        for stage, seconds in event.get('stages', {}).items():
+            self.histogram(stage).add(seconds)
+        for reason, count in event.get('invalid', {}).items():
+            self.count('invalid_residues.%s' % reason, count)
+        if 'worker' in event:
+            worker = self.workers.setdefault(event['worker'], {
+                'proteins': 0, 'busy': 0.0,
+                'started': event['worker_started'],
+                'finished': event['finished']})
+            worker['proteins'] += 1
+            worker['busy'] += event['busy']
+            worker['finished'] = max(worker['finished'], event['finished'])
+
+        if self.log:
+            line = dict(event, time=datetime.now().isoformat())
+            self.log.write('%s\n' % json.dumps(line, sort_keys=True))
+            self.log.flush()
+
+        if time.time() - self.written > STATUS_INTERVAL:
+            self.write_status()
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def remaining(self):
+        """
+        Estimated seconds until all proteins are finished
+        """
+        if not self.finished:
+            return None
+        return self.elapsed() * (self.total - self.finished) / self.finished
+
+    def percent(self):
+        if not self.total:
+            return 100.0
+        return self.finished * 100.0 / self.total
+
+    def utilization(self):
+        """
+        Fraction of its lifetime each worker spent on proteins.  A worker's
+        lifetime ends with the last protein it finished.
+
+        @return dict mapping worker name to utilization
+        """
+        utilization = {}
+        for name, worker in self.workers.items():
+            lifetime = worker['finished'] - (worker['started'] or
+                                             self.started)
+            utilization[name] = min(worker['busy'] / lifetime, 1.0) \
+                if lifetime > 0 else 1.0
+        return utilization
+
+    def status(self):
+        elapsed = self.elapsed()
+        return {'updated': datetime.now().isoformat(),
+                'elapsed': elapsed,
+                'remaining': self.remaining(),
+                'total': self.total,
+                'finished': self.finished,
+                'percent': self.percent(),
+                'rates': {
+                    'proteins_per_second':
+                        self.counters.get('saved', 0) / elapsed,
+                    'residues_per_second':
+                        self.counters.get('residues', 0) / elapsed},
+                'counters': self.counters,
+                'utilization': self.utilization(),
+                'histograms': dict((name, histogram.to_dict()) for name,
+                                   histogram in self.histograms.items())}
+
+    def write_status(self):
+        """
+        Writes the status file.  The file is replaced atomically so that it
+        can be read at any time.
+        """
+        self.written = time.time()
+        if not self.status_file:
+            return
+        tmp = '%s.tmp' % self.status_file
+        with open(tmp, 'w') as f:
+            json.dump(self.status(), f, indent=2, sort_keys=True)
+        os.rename(tmp, self.status_file)
+
+    def close(self):
+        self.write_status()
+        if self.log:
+            self.log.close()
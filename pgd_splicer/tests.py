@@ -1,13 +1,46 @@
+from Bio.PDB import PDBParser
+from django.conf import settings
 from django.core import management
+from django.db import connection
+from django.db.models import Sum
 from django.test import TestCase
+from django.test.utils import override_settings
+import numpy
+from pgd_core.models import DataVersion, Protein, Residue, Sidechain
+from pgd_search.models import (PlotCube, ResidueWindow, CUBE_BIN_SIZE,
+                               WINDOW_FIELDS, angle_bin, iIndex)
+from pgd_splicer import (atom_records, dssp_cache, parse_cache,
+                         residue_diff, scheduling)
+from pgd_splicer.geometry import SIDECHAIN_TABLES
+from pgd_splicer.management.commands.benchmark import compare
 from pgd_splicer.models import ftp_update_settings
+from pgd_splicer.ProcessPDBTask import (save_protein, save_chain,
+                                        delete_residues, bulk_create_residues,
+                                        initialize_all_geometry, filter_pdb,
+                                        filter_records, parseWithBioPython,
+                                        SIDECHAIN_FIELDS,
+                                        find_stale_pdbs, store_pdb,
+                                        bulk_store_pdb, diff_store_pdb,
+                                        write_batch, check_writers,
+                                        put_to_writers, check_schema)
+from pgd_splicer.cube import store_plot_cube
+from pgd_splicer.windows import store_windows, window_rows
+from pgd_splicer.telemetry import Histogram, Telemetry
+from pgd_splicer.journal import ImportJournal
+from pgd_splicer.rebuild import RebuildError, read_selection
+import copy
 from cStringIO import StringIO
+from gzip import GzipFile
 import sys
 import os
 from datetime import datetime
 import ftplib
+from multiprocessing import Process, Queue
+import json
+import math
 import urllib
 import shutil
+import tempfile
 import time
 
 # JMT: Due to a quirk with InnoDB and MySQL, an error may be generated
@@ -339,3 +372,1138 @@ class ManagementCommands(TestCase):
 
         good_out = MonkeyPatch.sitefile('cullpdb_crosscheck.txt')
         self.assertEqual(test_out, file(good_out).read())
+
+
+def parsed_residue(i, prev=True):
+    """
+    Residue dict mimicking the output of parseWithBioPython.  prev tells
+    whether the residue is bonded to residue i - 1.
+    """
+    props = {'oldID': str(i), 'chainIndex': i, 'chain': 'A', 'aa': 'r',
+             'ss': 'H', 'a3': 110.0, 'a5': 120.0, 'L2': 1.46,
+             'L4': 1.52, 'L5': 1.23, 'h_bond_energy': 0.0,
+             'sidechain': {'CB_CG': 1.52, 'CA_CB_CG': 114.0}}
+    initialize_all_geometry(props)
+    if prev:
+        props['L1'] = 1.33
+    return props
+
+
+def parsed_testfile(code):
+    """
+    Protein dict of a pdb file in testfiles, parsed as for an import.  No
+    dsspcmbi is needed, the DSSP cache is seeded with a secondary structure
+    for every residue of the filtered file.
+    """
+    path = os.path.join(os.path.dirname(__file__), 'testfiles',
+                        'pdb%s.ent.gz' % code.lower())
+    contents = filter_pdb(GzipFile(path))
+    structures = {}
+    for chain_id, chain in atom_records.read_model(contents).chains:
+        for res in chain:
+            structures[(chain_id, res.id)] = 'HE'[res.id[1] % 2]
+
+    cache_dir = tempfile.mkdtemp()
+    binaries = dict(dssp_cache._binary_hashes)
+    dssp_cache._binary_hashes[dssp_cache.DSSP_BINARY] = 'version'
+    try:
+        dssp_cache.write_entry(dssp_cache.cache_path(cache_dir, contents),
+                               structures)
+        data = {'code': code, 'threshold': 25, 'resolution': 1.5,
+                'rfactor': 0.2, 'rfree': 0.25,
+                'pdb_date': datetime(2001, 1, 1), 'chains': {}}
+        with override_settings(DSSP_CACHE_DIR=cache_dir):
+            return parseWithBioPython(path, data)
+    finally:
+        shutil.rmtree(cache_dir)
+        dssp_cache._binary_hashes.clear()
+        dssp_cache._binary_hashes.update(binaries)
+
+
+def window_links(windows):
+    """
+    (chainIndex of residue i, of the residue before it and of the residue
+    after it) of each window, None where the window stops
+    """
+    return [tuple(w.segment[k].chainIndex if w.segment[k] else None
+                  for k in (0, -1, 1))
+            for w in windows.order_by('r%i_chainIndex' % iIndex)]
+
+
+class ImportTestCase(TestCase):
+
+    # Base of the tests saving parsed proteins.  Proteins are either built
+    # from parsed_residue, to set up a particular case, or parsed from the
+    # pdb files in testfiles.
+
+    # parsed testfiles by code, each file is parsed once for all tests
+    testfiles = {}
+
+    def parsed_protein(self, code='1ABC', **chains):
+        """
+        Protein dict as returned by parse_pdb, e.g.
+        parsed_protein('1ABC', A=self.residues(range(1, 4)))
+        """
+        return {'code': code, 'threshold': 25, 'resolution': 1.5,
+                'rfactor': 0.2, 'rfree': 0.25,
+                'pdb_date': datetime(2001, 1, 1), 'chains': chains}
+
+    def residues(self, indexes, unbonded=(1,), chain='A'):
+        """
+        Residue dicts of a chain keyed by oldID.  Every residue except those
+        in unbonded is bonded to the residue before it.
+        """
+        residues = dict((str(i), parsed_residue(i, i not in unbonded))
+                        for i in indexes)
+        for residue in residues.values():
+            residue['chain'] = chain
+        return residues
+
+    def parsed_testfile(self, code):
+        if code not in self.testfiles:
+            self.testfiles[code] = parsed_testfile(code)
+        return copy.deepcopy(self.testfiles[code])
+
+    def linked(self, bonded, chain, index, offset):
+        """
+        chainIndex of the residue at offset from residue index, walking one
+        bond at a time, or None if a bond is missing on the way
+        """
+        step = 1 if offset > 0 else -1
+        for k in range(abs(offset)):
+            # the bond to the residue before is recorded on the residue after
+            if not bonded.get((chain, index if step < 0 else index + 1)):
+                return None
+            index += step
+        return index
+
+    def assertWindowsMatchBonds(self, data):
+        """
+        Windows find neighbours by chainIndex, they must match walking the
+        bonds of the parsed residues.
+        """
+        bonded = {}
+        for chain, residues in data['chains'].items():
+            for props in residues.values():
+                bonded[(chain, props['chainIndex'])] = \
+                    props.get('L1') is not None
+        windows = dict((w.id, w) for w in ResidueWindow.objects.all())
+        residues = Residue.objects.select_related('chain')
+        ids = dict(((r.chain.code, r.chainIndex), r.id) for r in residues)
+        self.assertEqual(sorted(windows), sorted(ids.values()))
+        for residue in residues:
+            window = windows[residue.id]
+            for offset in range(-iIndex, settings.SEGMENT_SIZE - iIndex):
+                index = self.linked(bonded, residue.chain.code,
+                                    residue.chainIndex, offset)
+                self.assertEqual(getattr(window, 'r%i_id' % (iIndex + offset)),
+                                 ids[(residue.chain.code, index)]
+                                 if index is not None else None)
+            if residue.terminal_flag:
+                self.assertEqual(window.segment[1], None)
+
+    def stored_rows(self):
+        """
+        Values of the stored residues and their sidechains without ids, in
+        chain order
+        """
+        sidechains = dict((row['id'], row)
+                          for row in Sidechain.objects.values())
+        rows = []
+        for residue in Residue.objects.order_by('chain', 'chainIndex') \
+                                      .values():
+            sidechain = dict(sidechains.get(residue.pop('sidechain_id'), {}))
+            sidechain.pop('id', None)
+            del residue['id']
+            rows.append((residue, sidechain))
+        return rows
+
+
+class BulkImport(ImportTestCase):
+
+    # Residue 4 has no prev because of a chain break (L1 is not set).
+
+    def import_protein(self):
+        protein = save_protein(self.parsed_protein())
+        delete_residues(protein)
+        chain = save_chain(protein, 'A')
+        bulk_create_residues(protein, chain,
+                             self.residues(range(1, 6), unbonded=(1, 4)))
+        return protein
+
+    def test_bulk_create_residues(self):
+        protein = self.import_protein()
+        residues = list(protein.residues.order_by('chainIndex'))
+        self.assertEqual(len(residues), 5)
+        self.assertEqual([r.L1 for r in residues],
+                         [None, 1.33, 1.33, None, 1.33])
+        for residue in residues:
+            self.assertEqual(residue.sidechain_ARG.CB_CG, 1.52)
+
+    def test_bulk_sidechain_ids(self):
+        # sidechains saved one at a time take ids the residues may also have
+        stray = [Sidechain.objects.create() for i in range(3)]
+        protein = self.import_protein()
+        self.assertEqual(Sidechain.objects.count(), 8)
+        for residue in protein.residues.all():
+            self.assertNotIn(residue.sidechain_id, [s.id for s in stray])
+            self.assertEqual(residue.sidechain_ARG.CB_CG, 1.52)
+
+    def test_bulk_reimport(self):
+        self.import_protein()
+        self.import_protein()
+        self.assertEqual(Residue.objects.count(), 5)
+        self.assertEqual(Sidechain.objects.count(), 5)
+
+    def test_bulk_store_testfile(self):
+        # the bulk path stores the same rows as saving residue by residue
+        store_pdb(self.parsed_testfile('1MWQ'))
+        stored = self.stored_rows()
+        self.assertEqual(len(stored), 196)
+        bulk_store_pdb(self.parsed_testfile('1MWQ'))
+        self.assertEqual(self.stored_rows(), stored)
+        self.assertWindowsMatchBonds(self.parsed_testfile('1MWQ'))
+
+    def test_windows(self):
+        protein = self.import_protein()
+        store_windows(protein)
+        store_windows(protein)
+        windows = ResidueWindow.objects.order_by('r%i_chainIndex' % iIndex)
+        self.assertEqual(len(windows), 5)
+        # windows stop at the chain break between residues 3 and 4
+        self.assertEqual([(w.segment[-1].chainIndex if w.segment[-1] else None,
+                           w.segment[1].chainIndex if w.segment[1] else None)
+                          for w in windows],
+                         [(None, 2), (1, 3), (2, None), (None, 5), (4, None)])
+        self.assertEqual(windows[1].segment[-1].oldID, '1')
+        self.assertEqual(windows[1].segment[1].sidechain_ARG.CB_CG, 1.52)
+        self.assertEqual(ResidueWindow.objects.filter(
+            **{'r%i__isnull' % (iIndex - 2): False}).count(), 1)
+
+
+class WindowJoins(ImportTestCase):
+
+    # Windows find neighbours by chainIndex, they must match walking the
+    # bonds of the parsed residues.
+
+    def joined_protein(self):
+        # chain A: the invalid residue after 3 skips chainIndex 4 and flags 3
+        # as terminal, 7 is not bonded to 6.  chain B reuses the chainIndexes
+        # of chain A.
+        chain_a = self.residues((1, 2, 3, 5, 6, 7, 8), unbonded=(1, 5, 7))
+        chain_a['3']['terminal_flag'] = True
+        return self.parsed_protein(A=chain_a,
+                                   B=self.residues(range(1, 4), chain='B'))
+
+    def test_store(self):
+        store_pdb(self.joined_protein())
+        self.assertWindowsMatchBonds(self.joined_protein())
+
+    def test_bulk_store(self):
+        bulk_store_pdb(self.joined_protein())
+        self.assertWindowsMatchBonds(self.joined_protein())
+
+    def test_store_testfile(self):
+        # 3CGX has chain breaks and invalid residues
+        store_pdb(self.parsed_testfile('3CGX'))
+        self.assertWindowsMatchBonds(self.parsed_testfile('3CGX'))
+
+    def assertWindowRowsMatch(self, code):
+        """
+        The windows the rebuild command builds in python, without the
+        database, must have the values of every column of the windows
+        stored by window_sql.
+        """
+        residues = Residue.objects.filter(protein__code=code).values(
+            'id', 'protein_id', 'chain_id', 'sidechain_id', *WINDOW_FIELDS)
+        protein = Protein.objects.filter(code=code).values()[0]
+        rows = dict((row['id'], row)
+                    for row in window_rows(list(residues), protein))
+        windows = ResidueWindow.objects.filter(protein__code=code).values()
+        self.assertEqual(sorted(rows), sorted(w['id'] for w in windows))
+        for window in windows:
+            # positions beyond the end of a window are left out of the row
+            row = rows[window['id']]
+            self.assertEqual(set(row) - set(window), set())
+            for k, value in window.items():
+                # sin/cos are calculated by the database for stored windows
+                if isinstance(value, float):
+                    self.assertAlmostEqual(row.get(k), value, places=6)
+                else:
+                    self.assertEqual(row.get(k), value)
+
+    def test_window_rows(self):
+        store_pdb(self.joined_protein())
+        self.assertWindowRowsMatch('1ABC')
+
+    def test_window_rows_testfiles(self):
+        # real proteins have chain breaks, missing sidechains and the angles
+        # the sin/cos and bin columns are calculated from
+        for code in ('1MWQ', '3CGX'):
+            store_pdb(self.parsed_testfile(code))
+            self.assertWindowRowsMatch(code)
+
+
+class PlotCubeCells(ImportTestCase):
+
+    # The plot cube sums the windows of residue i by aa, ss, quality tier,
+    # segment and phi/psi bin.
+
+    def setUp(self):
+        # residue 4 is not bonded to 3, residue 6 is in another bin
+        residues = self.residues(range(1, 7), unbonded=(1, 4))
+        for i, residue in residues.items():
+            residue['phi'], residue['psi'] = (-120.0, 130.0) if i == '6' \
+                                             else (-60.0, -45.0)
+        store_pdb(self.parsed_protein(A=residues))
+        store_plot_cube()
+
+    def test_cells(self):
+        cells = PlotCube.objects.all()
+        self.assertEqual(set(cells.values_list('version', 'aa', 'ss',
+                                               'threshold', 'resolution_tier',
+                                               'rfactor_tier', 'rfree_tier')),
+                         set([(DataVersion.current(), 'r', 'H', 25, 2, 0, 0)]))
+        self.assertEqual(sorted(cells.values_list('phi_bin', 'psi_bin',
+                                                  'segment', 'observations')),
+                         [(6, 31, 1, 1), (12, 13, 1, 1), (12, 13, 2, 2),
+                          (12, 13, 3, 2)])
+        cell = cells.get(phi_bin=12, psi_bin=13, segment=2)
+        self.assertEqual(cell.L2_count, 2)
+        self.assertAlmostEqual(cell.L2_sum, 2 * 1.46)
+        self.assertAlmostEqual(cell.L2_sumsq, 2 * 1.46 ** 2)
+        self.assertAlmostEqual(cell.phi_sin, 2 * math.sin(math.radians(-60)))
+
+    def test_replaced(self):
+        store_plot_cube()
+        self.assertEqual(PlotCube.objects.aggregate(
+            observations=Sum('observations'))['observations'], 6)
+
+    def test_testfile(self):
+        # every window of 3CGX with a phi and psi is counted in the cell of
+        # its residue type, secondary structure and bins
+        store_pdb(self.parsed_testfile('3CGX'))
+        store_plot_cube()
+        expected = {}
+        for aa, ss, phi, psi in ResidueWindow.objects.values_list(
+                *['r%i_%s' % (iIndex, field)
+                  for field in ('aa', 'ss', 'phi', 'psi')]):
+            if phi is not None and psi is not None:
+                key = (aa, ss, angle_bin(phi, CUBE_BIN_SIZE),
+                       angle_bin(psi, CUBE_BIN_SIZE))
+                expected[key] = expected.get(key, 0) + 1
+        counted = {}
+        for cell in PlotCube.objects.values_list('aa', 'ss', 'phi_bin',
+                                                 'psi_bin', 'observations'):
+            counted[cell[:4]] = counted.get(cell[:4], 0) + cell[4]
+        self.assertEqual(counted, expected)
+        self.assertGreater(sum(expected.values()), 200)
+
+
+class DiffImport(ImportTestCase):
+
+    # Re-imports only write the residues, sidechains and fields that changed.
+
+    def links(self):
+        return window_links(ResidueWindow.objects.all())
+
+    def test_unchanged(self):
+        store_pdb(self.parsed_protein(A=self.residues(range(1, 5))))
+        data = self.parsed_protein(A=self.residues(range(1, 5)))
+        data['chains']['A']['2']['L2'] = 1.46001
+        diff_store_pdb(data)
+        self.assertEqual(data['changes'], {'unchanged': 4, 'updated': 0,
+                                           'inserted': 0, 'deleted': 0,
+                                           'fields': 0})
+        self.assertEqual(Residue.objects.get(chainIndex=2).L2, 1.46)
+
+    def test_unchanged_testfile(self):
+        # the stored values of a real protein compare equal to the parsed
+        # values, and a single changed angle is a single write
+        store_pdb(self.parsed_testfile('3CGX'))
+        stored = self.stored_rows()
+        data = self.parsed_testfile('3CGX')
+        diff_store_pdb(data)
+        self.assertEqual(data['changes'], {'unchanged': len(stored),
+                                           'updated': 0, 'inserted': 0,
+                                           'deleted': 0, 'fields': 0})
+
+        data = self.parsed_testfile('3CGX')
+        residue = [r for r in data['chains']['A'].values()
+                   if r['psi'] is not None][0]
+        residue['psi'] += 1.0
+        diff_store_pdb(data)
+        self.assertEqual(data['changes'], {'unchanged': len(stored) - 1,
+                                           'updated': 1, 'inserted': 0,
+                                           'deleted': 0, 'fields': 1})
+        self.assertAlmostEqual(Residue.objects.get(
+            chain__code='A', chainIndex=residue['chainIndex']).psi,
+            residue['psi'])
+
+    def test_quality(self):
+        # windows follow the protein's values when no residue changed
+        store_pdb(self.parsed_protein(A=self.residues(range(1, 5))))
+        data = self.parsed_protein(A=self.residues(range(1, 5)))
+        data['resolution'] = 2.5
+        diff_store_pdb(data)
+        self.assertEqual(data['changes']['unchanged'], 4)
+        self.assertEqual(set(ResidueWindow.objects.values_list('resolution',
+                                                               flat=True)),
+                         set([2.5]))
+
+    def test_changes(self):
+        store_pdb(self.parsed_protein(A=self.residues(range(1, 5))))
+        data = self.parsed_protein(A=self.residues([1, 2, 3, 5]))
+        residues = data['chains']['A']
+        residues['2']['psi'] = 120.0
+        residues['3']['sidechain']['CB_CG'] = 1.6
+        del residues['5']['L1']
+        diff_store_pdb(data)
+        self.assertEqual(data['changes'], {'unchanged': 1, 'updated': 2,
+                                           'inserted': 1, 'deleted': 1,
+                                           'fields': 2})
+        self.assertEqual(Residue.objects.get(chainIndex=2).psi, 120.0)
+        self.assertEqual(Residue.objects.get(chainIndex=3).sidechain_ARG.CB_CG,
+                         1.6)
+        self.assertEqual(self.links(), [(1, None, 2), (2, 1, 3), (3, 2, None),
+                                        (5, None, None)])
+        self.assertEqual(Sidechain.objects.count(), 4)
+
+    def test_relink(self):
+        # residue 3 follows 1 once residue 2 is gone
+        store_pdb(self.parsed_protein(A=self.residues(range(1, 4))))
+        data = self.parsed_protein(A=self.residues([1, 3]))
+        data['chains']['A']['3']['chainIndex'] = 2
+        diff_store_pdb(data)
+        self.assertEqual(self.links(), [(1, None, 2), (2, 1, None)])
+        self.assertEqual(ResidueWindow.objects.get(
+            **{'r%i_chainIndex' % iIndex: 2}).segment[-1].oldID, '1')
+
+    def test_mutation(self):
+        store_pdb(self.parsed_protein(A=self.residues(range(1, 4))))
+        data = self.parsed_protein(A=self.residues(range(1, 4)))
+        data['chains']['A']['2']['aa'] = 'n'
+        diff_store_pdb(data)
+        residue = Residue.objects.get(chainIndex=2)
+        self.assertEqual(residue.aa, 'n')
+        self.assertEqual(residue.sidechain_ASN.CB_CG, 1.52)
+        self.assertEqual(residue.sidechain_ARG, None)
+        # the sidechain is rewritten in place, the ARG columns are cleared
+        self.assertEqual(residue.sidechain.ARG_CB_CG, None)
+        self.assertEqual(Sidechain.objects.count(), 3)
+
+    def test_tolerance(self):
+        self.assertTrue(residue_diff.equal('L1', 1.33, 1.33005))
+        self.assertFalse(residue_diff.equal('L1', 1.33, 1.331))
+        self.assertTrue(residue_diff.equal('ARG_CA_CB_CG', 114.0, 114.0005))
+        self.assertTrue(residue_diff.equal('ARG_CB_CG', 1.52, 1.52005))
+        self.assertFalse(residue_diff.equal('ARG_CB_CG', 1.52, 1.53))
+        # atom names may contain underscores, e.g. C_1 for C-1
+        self.assertTrue(residue_diff.equal('PRO_CD_N_C_1', 120.0, 120.0005))
+        self.assertFalse(residue_diff.equal('PRO_CD_N_C_1', 120.0, 120.01))
+        # every sidechain column has a tolerance
+        for field in SIDECHAIN_FIELDS:
+            self.assertNotEqual(residue_diff.tolerance(field), 0, field)
+        self.assertFalse(residue_diff.equal('phi', None, 0.0))
+        self.assertFalse(residue_diff.equal('ss', 'H', 'E'))
+
+
+class SidechainGeometry(TestCase):
+
+    # The sidechain tables must reproduce exactly the values recorded in
+    # pdb1twf_sidechains.json.  These were calculated with Bio.PDB.calc_angle
+    # and Bio.PDB.calc_dihedral by the per residue calc_chi,
+    # calc_sidechain_lengths and calc_sidechain_angles functions that the
+    # tables replaced, including the chi corrections, for the first ten
+    # residues of each type in chain A.
+
+    testfile = os.path.join(os.path.dirname(__file__), 'testfiles',
+                            'pdb1twf.ent.gz')
+    expected_file = os.path.join(os.path.dirname(__file__), 'testfiles',
+                                 'pdb1twf_sidechains.json')
+
+    def residues(self):
+        structure = PDBParser(QUIET=True).get_structure(
+            'test', GzipFile(self.testfile))
+        prev = None
+        for res in structure[0]['A']:
+            atoms = {}
+            for atom in res.get_unpacked_list():
+                if atom.get_altloc() in ('A', ' '):
+                    atoms[atom.name] = atom
+            yield res, atoms, prev
+            prev = res
+
+    def assertValuesEqual(self, expected, values, j):
+        calculated = dict((name, value[j]) for name, value in values.items()
+                          if not numpy.isnan(value[j]))
+        self.assertEqual(sorted(calculated), sorted(expected))
+        for name in expected:
+            self.assertEqual(calculated[name], expected[name])
+
+    def test_sidechain_tables(self):
+        expected = dict((row['id'], row)
+                        for row in json.load(open(self.expected_file)))
+        by_type = {}
+        for res, atoms, prev in self.residues():
+            if res.id[1] in expected:
+                by_type.setdefault(res.resname, []).append(
+                    (expected[res.id[1]], atoms, prev))
+        self.assertEqual(sum(len(group) for group in by_type.values()),
+                         len(expected))
+
+        for resname, group in by_type.items():
+            chi, sidechain = SIDECHAIN_TABLES[resname].calculate(
+                [atoms for row, atoms, prev in group],
+                [prev for row, atoms, prev in group])
+            for j, (row, atoms, prev) in enumerate(group):
+                self.assertEqual(row['resname'], resname)
+                self.assertValuesEqual(row['chi'], chi, j)
+                self.assertValuesEqual(row['sidechain'], sidechain, j)
+
+    def test_missing_atoms(self):
+        res, atoms, prev = [r for r in self.residues()
+                            if r[0].resname == 'ARG'][0]
+        atoms = dict(atoms)
+        del atoms['CZ']
+        chi, sidechain = SIDECHAIN_TABLES['ARG'].calculate([atoms], [prev])
+        self.assertFalse(numpy.isnan(chi['chi3'][0]))
+        self.assertTrue(numpy.isnan(chi['chi4'][0]))
+        self.assertTrue(numpy.isnan(chi['chi5'][0]))
+        self.assertTrue(numpy.isnan(sidechain['NE_CZ'][0]))
+
+
+class PDBFilter(TestCase):
+
+    # ALA appears in the atom name field of the HOH line and in the element
+    # field of the UNK line, only the residue name field counts.
+
+    lines = [
+        'HEADER    TEST\n',
+        'ATOM      1  N   ALA A   1      11.104   6.134  -6.504  1.00  0.00           N\n',
+        'ATOM      2  ALA UNK A   2      11.639   6.071  -5.147  1.00  0.00         ALA\n',
+        'HETATM    3  CA  MET A   3      10.000   6.000  -5.000  1.00  0.00           C\n',
+        'HETATM    4  ALA HOH A   4      12.000   5.000  -4.000  1.00  0.00           O\n',
+    ]
+
+    def test_filter_pdb(self):
+        self.assertEqual(filter_pdb(self.lines),
+                         ''.join(self.lines[:2] + self.lines[4:]))
+
+
+class AtomRecords(TestCase):
+
+    # The native parser must group atoms the same way Bio.PDB does.
+
+    testfiles = os.path.join(os.path.dirname(__file__), 'testfiles')
+
+    lines = [
+        'MODEL        1\n',
+        'ATOM      1  N   SER A   1      11.104   6.134  -6.504  1.00 10.00           N\n',
+        'ATOM      2  CA ASER A   1      11.639   6.071  -5.147  0.40 11.00           C\n',
+        'ATOM      3  CA BSER A   1      11.539   6.171  -5.047  0.60 12.00           C\n',
+        'ATOM      4  N   SER A   1      11.000   6.000  -6.000  1.00 13.00           N\n',
+        'ATOM      5  N   GLY A   2A     12.000   5.000  -4.000  1.00\n',
+        'HETATM    6  O   HOH B   3      12.000   5.000  -4.000  1.00  9.00           O\n',
+        'ENDMDL\n',
+        'MODEL        2\n',
+        'ATOM      7  N   SER A   1      11.104   6.134  -6.504  1.00 10.00           N\n',
+    ]
+
+    def test_read_model(self):
+        model = atom_records.read_model(''.join(self.lines))
+        self.assertEqual([chain_id for chain_id, residues in model.chains],
+                         ['A', 'B'])
+        ser, gly = model.chains[0][1]
+        self.assertEqual(ser.id, (' ', 1, ' '))
+        self.assertEqual(ser.atoms, {'N': 0, 'CA': 1})
+        self.assertEqual(ser.selected, {'N': 0, 'CA': 2})
+        self.assertEqual(gly.id, (' ', 2, 'A'))
+        self.assertEqual(model.bfactor[4], 0)
+        self.assertEqual(model.chains[1][1][0].id, ('W', 3, ' '))
+        self.assertEqual(len(model.coord), 6)
+        self.assertEqual(model.coord.dtype, numpy.float32)
+
+    def test_biopython(self):
+        for filename in sorted(os.listdir(self.testfiles)):
+            if not filename.endswith('.ent.gz'):
+                continue
+            contents = filter_pdb(GzipFile(os.path.join(self.testfiles,
+                                                        filename)))
+            native = atom_records.read_model(contents)
+            bio = atom_records.from_structure(PDBParser(QUIET=True)
+                .get_structure('test', StringIO(contents))[0])
+
+            self.assertEqual([c for c, r in native.chains],
+                             [c for c, r in bio.chains])
+            for (chain_id, residues), (bio_id, bio_residues) in \
+                    zip(native.chains, bio.chains):
+                self.assertEqual([(r.id, r.resname) for r in residues],
+                                 [(r.id, r.resname) for r in bio_residues])
+                for res, bio_res in zip(residues, bio_residues):
+                    for name in ('atoms', 'selected'):
+                        rows = getattr(res, name)
+                        bio_rows = getattr(bio_res, name)
+                        self.assertEqual(sorted(rows), sorted(bio_rows))
+                        for atom in rows:
+                            self.assertEqual(
+                                native.coord[rows[atom]].tolist(),
+                                bio.coord[bio_rows[atom]].tolist())
+                            self.assertEqual(native.bfactor[rows[atom]],
+                                             bio.bfactor[bio_rows[atom]])
+
+
+class MMCIFRecords(TestCase):
+
+    lines = [
+        'data_TEST\n',
+        '#\n',
+        'loop_\n',
+        '_atom_site.group_PDB\n',
+        '_atom_site.id\n',
+        '_atom_site.label_atom_id\n',
+        '_atom_site.label_alt_id\n',
+        '_atom_site.label_comp_id\n',
+        '_atom_site.label_asym_id\n',
+        '_atom_site.label_seq_id\n',
+        '_atom_site.pdbx_PDB_ins_code\n',
+        '_atom_site.Cartn_x\n',
+        '_atom_site.Cartn_y\n',
+        '_atom_site.Cartn_z\n',
+        '_atom_site.occupancy\n',
+        '_atom_site.B_iso_or_equiv\n',
+        '_atom_site.auth_seq_id\n',
+        '_atom_site.auth_asym_id\n',
+        '_atom_site.auth_atom_id\n',
+        '_atom_site.pdbx_PDB_model_num\n',
+        'ATOM 1 N . SER A 1 ? 11.104 6.134 -6.504 1.00 10.00 5 A N 1\n',
+        'ATOM 2 CA A SER A 1 ? 11.639 6.071 -5.147 0.40 11.00 5 A CA 1\n',
+        'ATOM 3 "O5\'" . SER A 1 ?\n',
+        '11.539 6.171 -5.047 1.00 12.00 5 A "O5\'" 1\n',
+        'HETATM 4 O . HOH B . A 12.000 5.000 -4.000 1.00 ? 7 BB O 1\n',
+        'ATOM 5 N . SER A 1 ? 11.104 6.134 -6.504 1.00 10.00 5 A N 2\n',
+        '#\n',
+    ]
+
+    def test_read_cif_records(self):
+        records = atom_records.read_cif_records(iter(self.lines))
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records['name'].tolist(), ['N', 'CA', "O5'", 'O'])
+        self.assertEqual(records['altloc'].tolist(), [' ', 'A', ' ', ' '])
+        self.assertEqual(records['resseq'].tolist(), [5, 5, 5, 7])
+        self.assertEqual(records['chain'].tolist(), ['A', 'A', 'A', 'BB'])
+        self.assertEqual(records['icode'].tolist(), [' ', ' ', ' ', 'A'])
+        self.assertEqual(records['hetatm'].tolist(),
+                         [False, False, False, True])
+        self.assertEqual(records['bfactor'][3], 0)
+        self.assertAlmostEqual(records['coord'][2][0], 11.539, 5)
+
+        model = atom_records.group_records(records)
+        self.assertEqual([chain_id for chain_id, residues in model.chains],
+                         ['A', 'BB'])
+        # chains with long names can't be written as pdb records
+        self.assertEqual(len(atom_records.format_records(records)
+                             .splitlines()), 3)
+
+    def test_parse_long_chain_id(self):
+        # a chain with a two character auth_asym_id is left out of the parsed
+        # chains, as it could not be stored as a Chain
+        atoms = [('N', 11.104, 6.134, -6.504), ('CA', 11.639, 6.071, -5.147),
+                 ('C', 13.143, 6.147, -5.106), ('O', 13.717, 6.855, -5.932)]
+        lines = self.lines[:20]
+        for serial, (chain, resseq) in enumerate([('A', 1), ('BB', 1)]):
+            for n, (name, x, y, z) in enumerate(atoms):
+                lines.append('ATOM %s %s . GLY %s %s ? %s %s %s 1.00 10.00 '
+                             '%s %s %s 1\n' % (serial * 4 + n + 1, name, chain,
+                                                resseq, x + serial * 10, y,
+                                                z, resseq, chain, name))
+        lines.append('#\n')
+
+        tmp_dir = tempfile.mkdtemp()
+        dssp_cache._binary_hashes[dssp_cache.DSSP_BINARY] = 'version'
+        try:
+            path = os.path.join(tmp_dir, '1abc.cif.gz')
+            with GzipFile(path, 'wb') as cif:
+                cif.writelines(lines)
+            contents = atom_records.format_records(filter_records(
+                atom_records.read_cif_records(iter(lines))))
+            dssp_cache.write_entry(
+                dssp_cache.cache_path(tmp_dir, contents),
+                {('A', (' ', 1, ' ')): 'H'})
+
+            props = {'chains': {}}
+            invalid = {}
+            with self.settings(DSSP_CACHE_DIR=tmp_dir):
+                parseWithBioPython(path, props, invalid=invalid)
+        finally:
+            shutil.rmtree(tmp_dir)
+            del dssp_cache._binary_hashes[dssp_cache.DSSP_BINARY]
+
+        self.assertEqual(props['chains'].keys(), ['A'])
+        self.assertEqual(props['chains']['A'].keys(), [1])
+        self.assertEqual(invalid, {'chain_id': 1})
+
+    def test_format_long_resname(self):
+        # residue names of mmCIF files may be longer than a pdb file allows
+        records = numpy.zeros(3, dtype=atom_records.ATOM_DTYPE)
+        records['chain'] = 'A'
+        records['resseq'] = [1, 2, 3]
+        records['resname'] = ['SER', 'A1B2', 'A1B2C']
+        records['name'] = 'C1'
+        records['altloc'] = records['icode'] = ' '
+        records['hetatm'] = [False, True, True]
+        lines = atom_records.format_records(records).splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0][17:20], 'SER')
+
+    def test_pdb_records(self):
+        # atoms written as pdb records are read back unchanged
+        path = os.path.join(os.path.dirname(__file__), 'testfiles',
+                            'pdb1mwq.ent.gz')
+        records = atom_records.read_records(filter_pdb(GzipFile(path)))
+        formatted = atom_records.read_records(
+            atom_records.format_records(records))
+        for name in ('hetatm', 'chain', 'resseq', 'icode', 'resname', 'name',
+                     'altloc', 'coord', 'bfactor'):
+            self.assertEqual(records[name].tolist(), formatted[name].tolist())
+
+    def test_filter_records(self):
+        records = atom_records.read_records(''.join(PDBFilter.lines))
+        self.assertEqual(filter_records(records)['resname'].tolist(),
+                         ['ALA', 'HOH'])
+
+
+class StalePDBs(TestCase):
+
+    def setUp(self):
+        self.pdb_dir = tempfile.mkdtemp()
+        for code in ('1abc', '2abc'):
+            file(os.path.join(self.pdb_dir, 'pdb%s.ent.gz' % code), 'w')
+        os.utime(os.path.join(self.pdb_dir, 'pdb1abc.ent.gz'),
+                 (time.mktime((2001, 1, 1, 0, 0, 0, 0, 0, -1)),) * 2)
+        save_protein({'code': '1ABC', 'threshold': 25, 'resolution': 1.5,
+                      'rfactor': 0.2, 'rfree': 0.25,
+                      'pdb_date': datetime(2001, 1, 1)})
+
+    def tearDown(self):
+        shutil.rmtree(self.pdb_dir)
+
+    def test_find_stale_pdbs(self):
+        pdbs = [{'code': code} for code in ('1ABC', '2ABC', '3ABC')]
+        stale, up_to_date, missing = find_stale_pdbs(pdbs, self.pdb_dir)
+        self.assertEqual([p['code'] for p in stale], ['2ABC'])
+        self.assertEqual([p['code'] for p in up_to_date], ['1ABC'])
+        self.assertEqual([p['code'] for p in missing], ['3ABC'])
+        self.assertEqual(up_to_date[0]['pdb_date'], datetime(2001, 1, 1))
+
+    def test_mmcif_file(self):
+        file(os.path.join(self.pdb_dir, '3abc.cif.gz'), 'w')
+        stale, up_to_date, missing = find_stale_pdbs([{'code': '3ABC'}],
+                                                     self.pdb_dir)
+        self.assertEqual([p['code'] for p in stale], ['3ABC'])
+
+
+class WriteBatch(ImportTestCase):
+
+    # Parsed proteins are saved several per transaction.  A protein that
+    # fails to save must not prevent the others in its batch from saving.
+
+    def test_write_batch(self):
+        bad = self.parsed_testfile('3CGX')
+        del bad['rfree']
+        proteins = [self.parsed_testfile('1MWQ'), bad,
+                    self.parsed_protein('3ABC', A=self.residues(range(1, 4)))]
+        self.assertEqual(write_batch(proteins, store_pdb),
+                         {'3CGX': 'KeyError'})
+        self.assertEqual(sorted(Protein.objects.values_list('code', flat=True)),
+                         ['1MWQ', '3ABC'])
+        self.assertEqual(Residue.objects.filter(protein__code='1MWQ').count(),
+                         196)
+        self.assertEqual(window_links(ResidueWindow.objects.filter(
+                             protein__code='3ABC')),
+                         [(1, None, 2), (2, 1, 3), (3, 2, None)])
+
+
+class WriterLiveness(TestCase):
+
+    # An import stops instead of waiting forever on a writer that died.
+
+    def writer(self, exitcode):
+        process = Process(target=os._exit, args=(exitcode,))
+        process.start()
+        process.join()
+        return process
+
+    def test_check_writers(self):
+        check_writers([self.writer(0)])
+        self.assertRaises(Exception, check_writers,
+                          [self.writer(0), self.writer(1)])
+
+    def test_put_to_dead_writers(self):
+        queue = Queue(1)
+        queue.put('1ABC')
+        self.assertRaises(Exception, put_to_writers, queue, '2ABC',
+                          [self.writer(-9)], 0.1)
+
+
+class ResidueSchema(TestCase):
+
+    # Imports refuse to start while the residue table still has columns that
+    # were removed from the model, they are dropped by compact_schema.
+
+    def test_check_schema(self):
+        check_schema()
+        connection.cursor().execute(
+            'ALTER TABLE %s ADD COLUMN chainID varchar(1) NOT NULL DEFAULT ""'
+            % connection.ops.quote_name(Residue._meta.db_table))
+        try:
+            check_schema()
+        except Exception, e:
+            self.assertIn('chainID', str(e))
+            self.assertIn('compact_schema', str(e))
+        else:
+            self.fail('check_schema accepted the chainID column')
+
+
+class DSSPCache(TestCase):
+
+    structures = {('A', (' ', 1, ' ')): 'H', ('A', (' ', 2, 'A')): 'E',
+                  ('B', ('W', 3, ' ')): ' '}
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        # no dsspcmbi is needed as long as the version is known
+        dssp_cache._binary_hashes['test-dssp'] = 'version'
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        del dssp_cache._binary_hashes['test-dssp']
+
+    def test_cache_hit(self):
+        path = dssp_cache.cache_path(self.cache_dir, 'contents', 'test-dssp')
+        dssp_cache.write_entry(path, self.structures)
+        self.assertEqual(dssp_cache.secondary_structure(
+            None, 'contents', self.cache_dir, 'test-dssp'), self.structures)
+
+    def test_cache_key(self):
+        path = dssp_cache.cache_path(self.cache_dir, 'contents', 'test-dssp')
+        self.assertNotEqual(path, dssp_cache.cache_path(
+            self.cache_dir, 'contents2', 'test-dssp'))
+        dssp_cache._binary_hashes['test-dssp'] = 'version2'
+        self.assertNotEqual(path, dssp_cache.cache_path(
+            self.cache_dir, 'contents', 'test-dssp'))
+
+
+class ParseCache(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def parsed(self):
+        residues = dict((i, parsed_residue(i, i != 1)) for i in range(1, 4))
+        for i, residue in residues.items():
+            residue['oldID'] = i
+        residues[3]['terminal_flag'] = True
+        del residues[2]['sidechain']
+        inserted = parsed_residue(4)
+        inserted['oldID'] = '3A'
+        inserted['chi1'] = -61.5
+        residues['3A'] = inserted
+        return {'code': '1ABC',
+                'pdb_date': datetime(2001, 1, 1, 12, 30, 15, 25),
+                'chains': {'A': residues, 'B': {}}}
+
+    def test_round_trip(self):
+        data = self.parsed()
+        path = parse_cache.cache_path(self.cache_dir, '1ABC')
+        parse_cache.write_entry(path, data, 'hash', ['A', 'B'])
+        meta, chains = parse_cache.load(self.cache_dir, '1ABC', 'hash')
+        self.assertEqual(chains, data['chains'])
+        self.assertEqual(meta['chains_filter'], ['A', 'B'])
+        self.assertEqual(type(chains['A'][1]['chainIndex']), int)
+        self.assertEqual(meta['pdb_date'], data['pdb_date'])
+
+        # entries are only used for the same file and splicer version
+        self.assertEqual(parse_cache.load(self.cache_dir, '1ABC', 'other'),
+                         None)
+        parse_cache.SPLICER_VERSION += 1
+        try:
+            self.assertEqual(parse_cache.load(self.cache_dir, '1ABC'), None)
+        finally:
+            parse_cache.SPLICER_VERSION -= 1
+
+    def test_select_chains(self):
+        chains = {'A': {}, 'B': {}}
+        meta = {'chains_filter': ['A', 'B']}
+        self.assertEqual(parse_cache.select_chains(meta, chains, ['A']),
+                         {'A': {}})
+        self.assertEqual(parse_cache.select_chains(meta, chains, None), None)
+        meta = {'chains_filter': None}
+        self.assertEqual(parse_cache.select_chains(meta, chains, None), chains)
+
+
+class Rebuild(ImportTestCase):
+
+    # Full rebuilds load the protein tables from the parse cache.
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.selection = os.path.join(self.cache_dir, 'selection.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def write_cache(self):
+        for code in ('1ABC', '2ABC'):
+            data = self.parsed_protein(code, A=self.residues(range(1, 5),
+                                                             unbonded=(3,)))
+            data['chains']['A']['4']['terminal_flag'] = True
+            for residue in data['chains']['A'].values():
+                residue.update({'phi': -60.0, 'psi': -45.0})
+            parse_cache.write_entry(
+                parse_cache.cache_path(self.cache_dir, code), data, 'hash')
+        with open(self.selection, 'w') as f:
+            f.write('VERSION: 2014-01-01\n'
+                    '1ABC A 25 1.5 0.2 0.25\n'
+                    '2ABC A 90 2.5 0.3 0.35\n'
+                    '3ABC A 25 1.5 0.2 0.25\n')
+
+    def rebuild(self, version):
+        with self.settings(PARSE_CACHE_DIR=self.cache_dir):
+            management.call_command('rebuild', selection=self.selection,
+                                    data_version=version,
+                                    stdout=StringIO(), stderr=StringIO())
+
+    def test_rebuild(self):
+        self.write_cache()
+
+        # proteins stored before the rebuild are replaced
+        store_pdb(self.parsed_protein('4ABC', A=self.residues([1])))
+
+        self.rebuild('2014-01-01')
+
+        self.assertEqual(sorted(Protein.objects.values_list('code', 'threshold')),
+                         [('1ABC', 25), ('2ABC', 90)])
+        self.assertEqual(Residue.objects.count(), 8)
+        self.assertEqual(Sidechain.objects.count(), 8)
+        self.assertEqual(ResidueWindow.objects.filter(
+            **{'r%i__isnull' % (iIndex + 1): False}).count(), 4)
+        residues = Residue.objects.filter(protein__code='2ABC') \
+                                  .order_by('chainIndex')
+        self.assertEqual(window_links(ResidueWindow.objects.filter(
+                             protein__code='2ABC')),
+                         [(1, None, 2), (2, 1, None), (3, None, 4),
+                          (4, 3, None)])
+        self.assertEqual([r.terminal_flag for r in residues],
+                         [False, False, False, True])
+        self.assertEqual([r.sidechain_ARG.CB_CG for r in residues], [1.52] * 4)
+        self.assertEqual(residues[0].chain.id, '2ABCA')
+        self.assertEqual(residues[0].oldID, '1')
+        self.assertEqual(DataVersion.current(), '2014-01-01')
+        # the plot cube of the new windows was swapped in with them
+        self.assertEqual(set(PlotCube.objects.values_list('version',
+                                                          flat=True)),
+                         set(['2014-01-01']))
+        self.assertEqual(
+            PlotCube.objects.aggregate(Sum('observations'))
+                            ['observations__sum'],
+            ResidueWindow.objects.filter(**{
+                'r%i_phi__isnull' % iIndex: False,
+                'r%i_psi__isnull' % iIndex: False}).count())
+        # only the table files are removed
+        self.assertEqual(os.listdir(self.cache_dir).count('selection.txt'), 1)
+
+        # the replaced tables are swapped back by a rollback, and a second
+        # rollback restores the rebuilt tables
+        management.call_command('rebuild', rollback=True, stdout=StringIO())
+        self.assertEqual(list(Protein.objects.values_list('code', flat=True)),
+                         ['4ABC'])
+        self.assertEqual(Residue.objects.count(), 1)
+        self.assertEqual(DataVersion.current(), settings.DATA_VERSION)
+        self.assertEqual(PlotCube.objects.count(), 0)
+        management.call_command('rebuild', rollback=True, stdout=StringIO())
+        self.assertEqual(Residue.objects.count(), 8)
+        self.assertEqual(DataVersion.current(), '2014-01-01')
+        self.assertNotEqual(PlotCube.objects.count(), 0)
+
+    def test_read_selection(self):
+        with open(self.selection, 'w') as f:
+            f.write('VERSION: 2014-01-01\n'
+                    '1ABC A 25 1.5 0.2 0.25\n'
+                    '\n'
+                    '2ABC A 90 2.5 0.3 0.35\n')
+        self.assertEqual([p['code'] for p in read_selection(self.selection)],
+                         ['1ABC', '2ABC'])
+
+        # anything else is reported instead of being skipped
+        with open(self.selection, 'a') as f:
+            f.write('3ABC A 25 1.5 0.2\n')
+        self.assertRaises(RebuildError, read_selection, self.selection)
+
+    def test_rebuild_twice(self):
+        # the second rebuild replaces the old tables kept by the first
+        self.write_cache()
+        self.rebuild('2014-01-01')
+        self.rebuild('2014-02-01')
+        self.assertEqual(Residue.objects.count(), 8)
+        self.assertEqual(DataVersion.current(), '2014-02-01')
+        management.call_command('rebuild', rollback=True, stdout=StringIO())
+        self.assertEqual(Residue.objects.count(), 8)
+        self.assertEqual(DataVersion.current(), '2014-01-01')
+
+
+class Benchmark(TestCase):
+
+    def result(self, residues, **walls):
+        return {'residues': residues,
+                'stages': dict((stage, {'wall': wall, 'cpu': wall})
+                               for stage, wall in walls.items())}
+
+    def test_compare(self):
+        baseline = self.result(1000, parse=1.0, dssp=2.0, db=4.0)
+        # twice the residues, parse and db per residue got slower
+        current = self.result(2000, parse=2.6, dssp=4.0, db=12.2, sidechain=1)
+        self.assertEqual(compare(baseline, current, 0.25), ['parse', 'db'])
+        self.assertEqual(compare(baseline, current, 0.5), ['db'])
+
+
+class ImportTelemetry(TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in (0.002, 0.02, 0.02, 0.2, 2.5):
+            histogram.add(value)
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.min, 0.002)
+        self.assertEqual(histogram.percentile(50), 0.03)
+        self.assertEqual(histogram.percentile(100), 2.5)
+
+    def test_status(self):
+        directory = tempfile.mkdtemp()
+        try:
+            status_file = os.path.join(directory, 'status.json')
+            log_file = os.path.join(directory, 'events.log')
+            telemetry = Telemetry(4, status_file, log_file)
+            telemetry.record({'event': 'parsed', 'code': '1ABC',
+                              'residues': 10, 'stages': {'parse': 0.5},
+                              'invalid': {'missing_atom': 2}})
+            telemetry.record({'event': 'saved', 'code': '1ABC',
+                              'residues': 10, 'stages': {'db': 0.1}})
+            telemetry.record({'event': 'failed', 'code': '2ABC',
+                              'stage': 'parse', 'reason': 'ValueError'})
+            telemetry.close()
+
+            status = json.load(open(status_file))
+            self.assertEqual(status['finished'], 2)
+            self.assertEqual(status['percent'], 50)
+            self.assertEqual(status['counters']['residues'], 10)
+            self.assertEqual(status['counters']['failed.parse.ValueError'], 1)
+            self.assertEqual(
+                status['counters']['invalid_residues.missing_atom'], 2)
+            self.assertEqual(status['histograms']['db']['count'], 1)
+            self.assertEqual(len(open(log_file).readlines()), 3)
+        finally:
+            shutil.rmtree(directory)
+
+
+class ResumeImport(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal')
+        pdb = os.path.join(self.directory, 'pdb%s.ent.gz')
+        for code in ('1abc', '2abc'):
+            with open(pdb % code, 'w') as f:
+                f.write(code)
+        self.pdb_date = datetime.fromtimestamp(os.path.getmtime(
+            pdb % '1abc')).strftime(parse_cache.DATE_FORMAT)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def pending(self, journal):
+        pdbs = [{'code': '1ABC'}, {'code': '2ABC'}, {'code': '3ABC'}]
+        pending, done = journal.pending(pdbs, self.directory)
+        return [d['code'] for d in pending], [d['code'] for d in done]
+
+    def test_resume(self):
+        journal = ImportJournal(self.path)
+        self.assertEqual(self.pending(journal), (['1ABC', '2ABC', '3ABC'], []))
+
+        journal.record('1ABC', None, self.pdb_date)
+        # the file has changed but has the same hash
+        journal.record('2ABC', parse_cache.file_hash(
+            os.path.join(self.directory, 'pdb2abc.ent.gz')), None)
+        journal.close()
+        self.assertEqual(self.pending(journal), (['3ABC'], ['1ABC', '2ABC']))
+
+    def test_changed_file(self):
+        journal = ImportJournal(self.path)
+        journal.record('1ABC', 'oldhash', '2000-01-01 00:00:00.000000')
+        journal.close()
+        self.assertEqual(self.pending(journal), (['1ABC', '2ABC', '3ABC'], []))
+
+    def test_splicer_version(self):
+        with open(self.path, 'w') as f:
+            f.write('1ABC\t%s\t\t%s\t\n' % (parse_cache.SPLICER_VERSION - 1,
+                                            self.pdb_date))
+        journal = ImportJournal(self.path)
+        self.assertEqual(self.pending(journal), (['1ABC', '2ABC', '3ABC'], []))
+
+    def test_partial_line(self):
+        journal = ImportJournal(self.path)
+        journal.record('1ABC', None, self.pdb_date)
+        journal.close()
+        with open(self.path, 'a') as f:
+            f.write('2ABC\t%s' % parse_cache.SPLICER_VERSION)
+        self.assertEqual(self.pending(journal), (['2ABC', '3ABC'], ['1ABC']))
+
+
+class Scheduling(TestCase):
+
+    def test_estimate_costs(self):
+        pdbs = [{'code': '1ABC'}, {'code': '2ABC'}, {'code': '3ABC'}]
+        sizes = {'1ABC': 1000, '2ABC': 4000, '3ABC': 2000}
+        costs = scheduling.estimate_costs(pdbs, sizes, {'1ABC': 2.0})
+        self.assertEqual(costs, {'1ABC': 2.0, '2ABC': 8.0, '3ABC': 4.0})
+        self.assertEqual([d['code'] for d in
+                          scheduling.longest_first(pdbs, costs)],
+                         ['2ABC', '3ABC', '1ABC'])
+
+    def test_chunks(self):
+        pdbs = [{'code': str(i)} for i in range(20)]
+        costs = dict((str(i), 1) for i in range(20))
+        costs['0'] = 100
+        chunks = scheduling.chunks(pdbs, costs, 2, factor=2)
+        self.assertEqual(sum(chunks, []), pdbs)
+        # the most expensive protein runs alone, then chunks shrink
+        self.assertEqual([len(chunk) for chunk in chunks],
+                         [1, 5, 4, 3, 2, 2, 1, 1, 1])
+
+    def test_load_runtimes(self):
+        directory = tempfile.mkdtemp()
+        try:
+            log_file = os.path.join(directory, 'events.log')
+            with open(log_file, 'w') as f:
+                f.write('{"event": "parsed", "code": "1ABC", '
+                        '"stages": {"parse": 1.5, "dssp": 0.5}}\n')
+                f.write('{"event": "saved", "code": "1ABC", '
+                        '"stages": {"db": 9}}\n')
+                f.write('{"event": "parsed", "code": "2A')
+            self.assertEqual(scheduling.load_runtimes(log_file),
+                             {'1ABC': 2.0})
+        finally:
+            shutil.rmtree(directory)
+
+    def test_utilization(self):
+        telemetry = Telemetry(2)
+        for code, busy, finished in (('1ABC', 3.0, 104.0),
+                                     ('2ABC', 2.0, 110.0)):
+            telemetry.record({'event': 'parsed', 'code': code,
+                              'worker': 'pool-1', 'worker_started': 100.0,
+                              'busy': busy, 'finished': finished})
+        self.assertEqual(telemetry.workers['pool-1']['proteins'], 2)
+        self.assertAlmostEqual(telemetry.utilization()['pool-1'], 0.5)
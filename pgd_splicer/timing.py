@@ -0,0 +1,73 @@
+"""
+Per-stage timing of the splicer.
+
+Stages are timed by passing a dict to the splicer functions that accept a
+timings argument.  Each stage is recorded as {'wall': seconds, 'cpu':
+seconds}, and time spent in a stage more than once, e.g. once per chain, is
+added up.  CPU time includes child processes so that DSSP is counted.
+"""
+
+from contextlib import contextmanager
+import os
+import time
+
+
+def cpu_time():
+    """
+    CPU time used by this process and its finished children
+    """
+    user, system, child_user, child_system = os.times()[:4]
+    return user + system + child_user + child_system
+
+
+@contextmanager
+def timed(timings, stage):
+    """
+    Times the enclosed block as stage.  Does nothing if timings is None.
+    """
+    if timings is None:
+        yield
+        return
+
+    wall = time.time()
+    cpu = cpu_time()
+    try:
+        yield
+    finally:
+        totals = timings.setdefault(stage, {'wall': 0.0, 'cpu': 0.0})
+        totals['wall'] += time.time() - wall
+        totals['cpu'] += cpu_time() - cpu
+
+
+def add_timings(total, timings):
+    """
+    Adds the stages in timings to total
+    """
+    for stage, values in timings.items():
+        totals = total.setdefault(stage, {'wall': 0.0, 'cpu': 0.0})
+        totals['wall'] += values['wall']
+        totals['cpu'] += values['cpu']
+
+
+class StageTimer(object):
+    """
+    Times consecutive stages of a function.  Each call to mark() records the
+    time since the previous mark (or since the timer was created) as the
+    given stage.  Does nothing if timings is None.
+    """
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.wall = time.time()
+        self.cpu = cpu_time()
+
+    def mark(self, stage):
+        if self.timings is None:
+            return
+        wall = time.time()
+        cpu = cpu_time()
+        totals = self.timings.setdefault(stage, {'wall': 0.0, 'cpu': 0.0})
+        totals['wall'] += wall - self.wall
+        totals['cpu'] += cpu - self.cpu
+        self.wall = wall
+        self.cpu = cpu
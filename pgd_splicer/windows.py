@@ -0,0 +1,229 @@
+"""
+Residue windows of imported proteins.
+
+Every residue gets a ResidueWindow holding its own fields and those of its
+neighbours within SEGMENT_SIZE, see pgd_search/models.py.
+
+Neighbours are found by chainIndex: the residue at offset k from residue i
+is the residue of the same chain with chainIndex i + k.  Two residues
+adjacent in chainIndex are bonded when the second has L1 set, which the
+parser only sets when the peptide bond between them was accepted.  A window
+stops at the first missing bond, so it stops at every chain break.  Invalid
+residues skip a chainIndex, so no residue is found across them.
+
+Windows are derived from the residues of a protein and are replaced as a
+whole whenever the protein is imported.  The quality values of the protein
+are copied into each window, and updated in place when only the protein
+changed.  Dihedral angles are stored along with their sin and cos, and
+those of residue i with their plot bins.
+"""
+
+import math
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection
+
+from pgd_core.models import Chain, Protein, Residue as ResidueModel
+from pgd_splicer.cube import store_plot_cube
+from pgd_search.models import (ResidueWindow, BIN_FIELDS, BIN_SIZES,
+                               CIRCULAR_FIELDS, QUALITY_FIELDS, WINDOW_FIELDS,
+                               angle_bin, bin_field, iIndex)
+
+
+def window_rows(residues, protein):
+    """
+    Builds the windows of a protein's residues.
+
+    @param residues: list of dicts of residue values with at least id,
+                     protein_id, chain_id, chainIndex and L1.  Other
+                     missing fields, including sidechain_id, are stored as
+                     NULL.
+    @param protein: dict of the protein's values with at least QUALITY_FIELDS
+    @return list of dicts of window values keyed by attname, a window per
+            residue in the order of residues
+    """
+    residues_by_index = dict(((residue['chain_id'], residue['chainIndex']),
+                              residue) for residue in residues)
+    windows = []
+    for residue in residues:
+        chain_id = residue['chain_id']
+        window = {'id': residue['id'],
+                  'protein_id': residue['protein_id'],
+                  # chain ids are the protein code followed by the chain code
+                  'chainID': residue['chain_id'][len(residue['protein_id']):]}
+        for field in QUALITY_FIELDS:
+            window[field] = protein[field]
+        add_position(window, iIndex, residue)
+
+        # walk the chain in both directions until the window is full or a
+        # residue is not bonded to its neighbour
+        for step in (-1, 1):
+            neighbour = residue
+            for offset in range(1, settings.SEGMENT_SIZE):
+                position = iIndex + step * offset
+                if not 0 <= position < settings.SEGMENT_SIZE:
+                    break
+                following = residues_by_index.get(
+                    (chain_id, neighbour['chainIndex'] + step))
+                if following is None:
+                    break
+                if (following if step > 0 else neighbour).get('L1') is None:
+                    break
+                neighbour = following
+                add_position(window, position, neighbour)
+        windows.append(window)
+    return windows
+
+
+def add_position(window, position, residue):
+    window['r%i_id' % position] = residue['id']
+    window['r%i_sidechain_id' % position] = residue.get('sidechain_id')
+    for field in WINDOW_FIELDS:
+        window['r%i_%s' % (position, field)] = residue.get(field)
+    for field in CIRCULAR_FIELDS:
+        angle = residue.get(field)
+        if angle is None:
+            sin = cos = None
+        else:
+            sin = math.sin(math.radians(angle))
+            cos = math.cos(math.radians(angle))
+        window['r%i_%s_sin' % (position, field)] = sin
+        window['r%i_%s_cos' % (position, field)] = cos
+    if position == iIndex:
+        for field in BIN_FIELDS:
+            angle = residue.get(field)
+            for size in BIN_SIZES:
+                window[bin_field(field, size)] = \
+                    None if angle is None else angle_bin(angle, size)
+
+
+def window_sql():
+    """
+    Builds the statement that inserts the windows of a protein.  Each
+    position is a LEFT JOIN on (chain_id, chainIndex + k), which is covered by
+    the composite index on Residue.  The join of a position requires the bond
+    to the position next to it that is closer to residue i, so positions
+    beyond a break are NULL.
+    """
+    qn = connection.ops.quote_name
+    window_opts = ResidueWindow._meta
+    residue_opts = ResidueModel._meta
+    chain_opts = Chain._meta
+
+    def alias(position):
+        return qn('p%i' % position)
+
+    def column(position, field):
+        return '%s.%s' % (alias(position),
+                          qn(residue_opts.get_field(field).column))
+
+    i = alias(iIndex)
+    columns = [qn(window_opts.get_field(name).column)
+               for name in ('id', 'protein', 'chainID')]
+    selects = [column(iIndex, 'id'), column(iIndex, 'protein'),
+               '%s.%s' % (qn('c'), qn(chain_opts.get_field('code').column))]
+    # the quality values are the same for every window of the protein
+    for field in QUALITY_FIELDS:
+        columns.append(qn(window_opts.get_field(field).column))
+        selects.append('%s')
+    for position in range(settings.SEGMENT_SIZE):
+        columns.append(qn(window_opts.get_field('r%i' % position).column))
+        selects.append(column(position, 'id'))
+        columns.append(qn(window_opts.get_field(
+            'r%i_sidechain' % position).column))
+        selects.append(column(position, 'sidechain'))
+        for field in WINDOW_FIELDS:
+            columns.append(qn(window_opts.get_field(
+                'r%i_%s' % (position, field)).column))
+            selects.append(column(position, field))
+        for field in CIRCULAR_FIELDS:
+            for function in ('sin', 'cos'):
+                columns.append(qn(window_opts.get_field(
+                    'r%i_%s_%s' % (position, field, function)).column))
+                selects.append('%s(RADIANS(%s))' % (function.upper(),
+                                                    column(position, field)))
+
+    # see angle_bin
+    for field in BIN_FIELDS:
+        for size in BIN_SIZES:
+            columns.append(qn(window_opts.get_field(
+                bin_field(field, size)).column))
+            selects.append('LEAST(FLOOR((%s + 180) / %i), %i)' % (
+                column(iIndex, field), size, 360 / size - 1))
+
+    joins = []
+    for positions in (range(iIndex - 1, -1, -1),
+                      range(iIndex + 1, settings.SEGMENT_SIZE)):
+        for position in positions:
+            offset = position - iIndex
+            # the second residue of the bond carries L1
+            if offset < 0:
+                bond = column(position + 1, 'L1')
+            else:
+                bond = column(position, 'L1')
+            conditions = [
+                '%s = %s' % (column(position, 'chain'), column(iIndex, 'chain')),
+                '%s = %s %+d' % (column(position, 'chainIndex'),
+                                 column(iIndex, 'chainIndex'), offset),
+                '%s IS NOT NULL' % bond,
+            ]
+            if offset > 1:
+                conditions.append('%s IS NOT NULL' % column(position - 1, 'id'))
+            joins.append('LEFT JOIN %s %s ON %s' % (
+                qn(residue_opts.db_table), alias(position),
+                ' AND '.join(conditions)))
+
+    # the chain code of the window is read from the chain of residue i
+    joins.insert(0, 'JOIN %s %s ON %s.%s = %s' % (
+        qn(chain_opts.db_table), qn('c'), qn('c'),
+        qn(chain_opts.pk.column), column(iIndex, 'chain')))
+
+    return 'INSERT INTO %s (%s) SELECT %s FROM %s %s %s WHERE %s = %%s' % (
+        qn(window_opts.db_table), ', '.join(columns), ', '.join(selects),
+        qn(residue_opts.db_table), i, ' '.join(joins),
+        column(iIndex, 'protein'))
+
+
+def store_windows(protein):
+    """
+    Replaces the windows of a protein with windows built from its stored
+    residues.  Must be called within a transaction.
+    """
+    ResidueWindow.objects.filter(protein=protein).delete()
+    cursor = connection.cursor()
+    cursor.execute(window_sql(), [getattr(protein, field)
+                                  for field in QUALITY_FIELDS] + [protein.code])
+
+
+def store_quality(protein):
+    """
+    Copies the quality values of a protein into its windows, for imports
+    that changed the protein but none of its residues
+    """
+    ResidueWindow.objects.filter(protein=protein).update(
+        **dict((field, getattr(protein, field)) for field in QUALITY_FIELDS))
+
+
+def recreate_window_table():
+    """
+    Replaces the window table with one created from the current model and
+    stores the windows of every protein, then the plot cube summed from
+    them.  Windows are derived from the residues, so this is how changes of
+    the window columns are applied to an existing database.
+    """
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    table = ResidueWindow._meta.db_table
+    if table in connection.introspection.table_names():
+        cursor.execute('DROP TABLE %s' % qn(table))
+    style = no_style()
+    statements, pending = connection.creation.sql_create_model(ResidueWindow,
+                                                              style)
+    statements += connection.creation.sql_indexes_for_model(ResidueWindow,
+                                                            style)
+    for statement in statements:
+        cursor.execute(statement)
+    for protein in Protein.objects.all():
+        store_windows(protein)
+    store_plot_cube()